@@ -1,19 +1,31 @@
 import time
-import matplotlib.pyplot as plt
-import pandas as pd
+from typing import TYPE_CHECKING
+
+import numpy as np
 
 from Models.AfterstateModel import AfterstateModel
 from Models.StateActionModel import StateValueModel
+from Models.ValueTables import DenseValueTable
 from gym import Env
+from tetris_environment.batched_tetris_engine import BatchedTetrisGame, X_OFFSET
+from tetris_environment.state_codec import StateCodec
+
+# pandas and matplotlib take longer to import than the rest of the evaluation together, so they are only imported
+# by the functions which use them
+if TYPE_CHECKING:
+    import pandas as pd
 
 
-def evaluate_policy_afterstates(algorithm: AfterstateModel, env: Env, nb_episodes: int) -> pd.DataFrame():
+def evaluate_policy_afterstates(algorithm: AfterstateModel, env: Env, nb_episodes: int) -> "pd.DataFrame":
     """
 
     :param algorithm: of type StateValueModel: provides the policy to follow
     :param env: the environment in which to test the provided :param algorithm
     :param nb_episodes: number of evaluation episodes
-    :return: returns the mean and variance of number of pieces placed, number of lines cleared and score achieved
+    :return: returns the mean and variance of number of pieces placed, number of lines cleared and score achieved.
+            The pieces are placed with TetrisEnv.place, so Nb_pieces only counts the pieces which were placed.
+            Truncated is 1 for the episodes which reached a limit of TetrisEnv.set_episode_limits instead of
+            ending in game over, and 0 otherwise, so its mean is the fraction of truncated episodes.
     """
 
     # metrics will be constructed as a list of dicts, then converted to pandas dataframe for analysis
@@ -24,30 +36,102 @@ def evaluate_policy_afterstates(algorithm: AfterstateModel, env: Env, nb_episode
         total_score = 0
         total_cleared = 0
         nb_pieces = 0
-        state = env.reset()
+        state = env.reset(from_bank=False)  # always evaluate from an empty board
         done = False
         while not done:
-            _, actions = algorithm.predict()
-            for action in actions:
-                state, reward, done, data = env.step(action)
-                if done:
-                    break
-                total_cleared += data["lines_cleared"]
-                total_score += data["score"]
-            nb_pieces += 1
+            _, _, placement = algorithm.predict()
+            if placement is None:  # no falling piece, so wait for the next one
+                state, reward, done, data = env.step(env.no_move)
+            else:
+                state, reward, done, data = env.place(*placement)
+                nb_pieces += 1
+            total_cleared += data["lines_cleared"]
+            total_score += data["score"]
 
-        metrics.append({"Nb_pieces": nb_pieces, "Lines_cleared": total_cleared, "Score": total_score})
+        metrics.append({"Nb_pieces": nb_pieces, "Lines_cleared": total_cleared, "Score": total_score,
+                        "Truncated": int(data.get("TimeLimit.truncated", False))})
 
+    import pandas as pd
     metrics_df = pd.DataFrame.from_records(metrics)
     return metrics_df
 
 
-def evaluate_policy_state_action(algorithm: StateValueModel, env: Env, nb_episodes: int) -> pd.DataFrame():
+def evaluate_policy_afterstates_batched(algorithm: AfterstateModel, nb_episodes: int, nb_games: int = 1000,
+                                        seed: int = None, max_pieces: int = None) -> "pd.DataFrame":
+    """
+    Evaluates the greedy policy of an afterstate model on nb_games games at once, using BatchedTetrisGame.
+    In every game, the placement with the highest afterstate value is chosen, with ties broken at random.
+    :param algorithm: of type AfterstateModel: provides the value function of the policy to follow
+    :param nb_episodes: number of evaluation episodes. These are divided evenly over the games.
+    :param nb_games: number of games played simultaneously
+    :param seed: seed for the pieces and the tie-breaking
+    :param max_pieces: if provided, an episode is truncated once this many pieces have been placed
+    :return: a dataframe with the number of pieces placed, number of lines cleared and score achieved in every
+            episode, and whether it was truncated.
+    """
+    nb_games = min(nb_games, nb_episodes)
+    game = BatchedTetrisGame(algorithm.env.type, nb_games, seed)
+    rng = np.random.default_rng(seed)
+    episodes_left = np.full(nb_games, nb_episodes // nb_games)
+    episodes_left[:nb_episodes % nb_games] += 1
+
+    metrics = []
+    while game.active.any():
+        legal, states, _, _ = game.afterstates()
+        values = afterstate_values(algorithm.value_function, states, algorithm.env.compact_states)
+        values = np.where(legal, values, -np.inf)
+
+        # pick a random placement among those with the highest value
+        best = values == values.max(axis=(1, 2), keepdims=True)
+        priority = np.where(legal & best, rng.random(legal.shape), -1).reshape(nb_games, -1)
+        rotations, xs = np.unravel_index(priority.argmax(axis=1), legal.shape[1:])
+        _, _, done, data = game.place(rotations, xs - X_OFFSET)
+        finished = [(data, np.flatnonzero(done & game.active), False)]
+        if max_pieces is not None:
+            truncated = np.flatnonzero(game.active & ~done & (game.pieces >= max_pieces))
+            finished.append((game.truncate(truncated), truncated, True))
+
+        for data, games, truncated in finished:
+            for index in games:
+                metrics.append({"Nb_pieces": data["episode_pieces"][index],
+                                "Lines_cleared": data["episode_lines"][index],
+                                "Score": data["episode_score"][index],
+                                "Truncated": int(truncated)})
+                episodes_left[index] -= 1
+                if episodes_left[index] == 0:
+                    game.active[index] = False
+
+    import pandas as pd
+    metrics_df = pd.DataFrame.from_records(metrics)
+    return metrics_df
+
+
+def afterstate_values(value_function: dict, states: np.ndarray, compact_states: bool = False) -> np.ndarray:
+    """
+    Looks up the values of an array of encoded states. Every distinct state is only looked up once.
+    :param value_function: a dict mapping encoded states to their value, or a DenseValueTable. Missing states have
+            value 0.
+    :param states: an integer array of shape (..., board_width - 1)
+    :param compact_states: whether the keys of value_function are the integer codes of the states (see StateCodec)
+            instead of tuples
+    :return: an array of shape states.shape[:-1] with the value of every state
+    """
+    if isinstance(value_function, DenseValueTable):
+        return value_function.lookup(states).astype(float)
+    codec = StateCodec(states.shape[-1])
+    codes, inverse = np.unique(codec.encode_array(states), return_inverse=True)
+    keys = codes.tolist() if compact_states else [codec.decode(code) for code in codes.tolist()]
+    unique_values = np.array([value_function.get(key, 0) for key in keys], dtype=float)
+    return unique_values[inverse.reshape(-1)].reshape(states.shape[:-1])
+
+
+def evaluate_policy_state_action(algorithm: StateValueModel, env: Env, nb_episodes: int) -> "pd.DataFrame":
     """
     :param algorithm: of type StateValueModel: provides the policy to follow
     :param env: the environment in which to test the provided :param algorithm
     :param nb_episodes: number of evaluation episodes
-    :return: returns the mean and variance of number of pieces placed, number of lines cleared and score achieved
+    :return: returns the mean and variance of number of pieces placed, number of lines cleared and score achieved,
+            and whether the episodes were truncated, as in evaluate_policy_afterstates
     """
 
     # metrics will be constructed as a list of dicts, then converted to pandas dataframe for analysis
@@ -55,24 +139,25 @@ def evaluate_policy_state_action(algorithm: StateValueModel, env: Env, nb_episod
 
     metrics = []
     for episode in range(1, nb_episodes + 1):
-        state = env.reset()
+        state, data = env.reset(return_info=True, from_bank=False)  # always evaluate from an empty board
         done = False
         nb_pieces = 0
         j = 0
-        data = {}
         total_cleared = 0
         total_score = 0
         while not done:
             j += 1
-            action = algorithm.predict(state)
+            action = algorithm.predict(state, data["action_mask"])
             state, reward, done, data = env.step(action)
             if data["new_piece"]:
                 nb_pieces += 1
             total_cleared += data["lines_cleared"]
             total_score += data["score"]
 
-        metrics.append({"Nb_pieces": nb_pieces, "Lines_cleared": total_cleared, "Score": total_score})
+        metrics.append({"Nb_pieces": nb_pieces, "Lines_cleared": total_cleared, "Score": total_score,
+                        "Truncated": int(data.get("TimeLimit.truncated", False))})
 
+    import pandas as pd
     metrics_df = pd.DataFrame.from_records(metrics)
     return metrics_df
 
@@ -86,6 +171,7 @@ def plot_with_errors(x_sequence, y_sequence, errors, name, image_path, fig_nb) -
     :param image_path: path where the figure is saved
     :return: None
     """
+    import matplotlib.pyplot as plt
     plt.figure(fig_nb)
     plt.errorbar(x_sequence, y_sequence, yerr=errors,
                  linestyle='-', marker='x', label=name)
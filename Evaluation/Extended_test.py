@@ -6,7 +6,8 @@ from Models.AfterstateModel import AfterstateModel
 
 
 def extended_test(model_type: Type[AfterstateModel], models_dir: str,
-                  target_dir: str = None, nb_episodes: int = 2000) -> None:
+                  target_dir: str = None, nb_episodes: int = 2000, nb_parallel_games: int = 0,
+                  max_pieces: int = None) -> None:
     """
     Runs an extensive test of all models of the same type in a given folder. For every model, a csv containing
     score, pieces placed and lines cleared is created. A text upper_dir containing an overview of all test is also created
@@ -15,6 +16,10 @@ def extended_test(model_type: Type[AfterstateModel], models_dir: str,
     :raises TypeError if not all models are of the type provided in model_type
     :param target_dir: the directory which is to contain all results
     :param nb_episodes: the amount of episodes each model will train
+    :param nb_parallel_games: if greater than zero, the episodes are played this many at once with
+            evaluate_policy_afterstates_batched
+    :param max_pieces: if provided, every episode is truncated once this many pieces have been placed. The
+            results tell which episodes were truncated.
     :return: None
     """
     if target_dir is None:
@@ -25,7 +30,12 @@ def extended_test(model_type: Type[AfterstateModel], models_dir: str,
     for model_dir in os.listdir(models_dir):
         model_path = os.path.join(models_dir, model_dir, "Model", "model.pickle")
         model = model_type.load(model_path)
-        metrics = evaluate_policy_afterstates(model, model.env, nb_episodes)
+        if nb_parallel_games > 0:
+            metrics = evaluate_policy_afterstates_batched(model, nb_episodes, nb_parallel_games,
+                                                          max_pieces=max_pieces)
+        else:
+            model.env.set_episode_limits(max_pieces=max_pieces)
+            metrics = evaluate_policy_afterstates(model, model.env, nb_episodes)
         results_dir = os.path.join(target_dir, "Results")
 
         if not os.path.isdir(results_dir):
@@ -51,7 +61,8 @@ def extended_test(model_type: Type[AfterstateModel], models_dir: str,
 
 
 def extended_test_state_action(model_type, models_dir: str,
-                               target_dir: str = None, nb_episodes: int = 2000) -> None:
+                               target_dir: str = None, nb_episodes: int = 2000, max_pieces: int = None,
+                               max_steps: int = None) -> None:
     """
     Runs an extensive test of all models of the same type in a given folder. For every model, a csv containing
     score, pieces placed and lines cleared is created. A text upper_dir containing an overview of all test is also created
@@ -60,6 +71,8 @@ def extended_test_state_action(model_type, models_dir: str,
     :raises TypeError if not all models are of the type provided in model_type
     :param target_dir: the directory which is to contain all results
     :param nb_episodes: the amount of episodes each model will train
+    :param max_pieces, max_steps: if provided, the limits on the length of every episode, see
+            TetrisEnv.set_episode_limits. The results tell which episodes were truncated.
     :return: None
     """
     if target_dir is None:
@@ -70,6 +83,7 @@ def extended_test_state_action(model_type, models_dir: str,
     for model_dir in os.listdir(models_dir):
         model_path = os.path.join(models_dir, model_dir, "Model", "model.pickle")
         model = model_type.load(model_path)
+        model.env.set_episode_limits(max_pieces, max_steps)
         metrics = evaluate_policy_state_action(model, model.env, nb_episodes)
         results_dir = os.path.join(target_dir, "Results")
 
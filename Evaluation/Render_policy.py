@@ -11,12 +11,15 @@ def render_policy_afterstates(model: AfterstateModel, env: TetrisEnv, nb_episode
         env.render()
         done = False
         while not done:
-            _, actions = model.predict()
+            _, actions, _ = model.predict()
+            # frame by frame, so that the piece is seen moving
             for action in actions:
                 state, reward, done, obs = env.step(action)
                 time.sleep(0.1)
                 print(int(reward))
                 env.render()
+                if done:
+                    break
 
 
 def render_policy_state_action(model: StateValueModel, env: TetrisEnv, nb_episodes: int = 10) -> None:
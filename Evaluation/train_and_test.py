@@ -6,7 +6,6 @@ from Models.StateActionModel import StateValueModel
 import os
 import datetime
 import time
-import pandas as pd
 
 
 def train_and_test(model: Union[StateValueModel, AfterstateModel],
@@ -24,6 +23,8 @@ def train_and_test(model: Union[StateValueModel, AfterstateModel],
     Evaluation data saved:
         • the number of pieces placed using the policy after each 1000-game interval (mean and quantiles)
         • the score obtained using the policy after each 1000-game interval (mean and quantiles)
+        • the fraction of evaluation episodes which were truncated, if the environment of the model limits the
+            length of the episodes (see TetrisEnv.set_episode_limits)
     Training data saved:
         • the time it took the algorithm to achieve an average lines cleared of 20 and 50 (in seconds).
             If this number was not reached after the whole of training, the time is of type str, containing "Inf"
@@ -42,7 +43,7 @@ def train_and_test(model: Union[StateValueModel, AfterstateModel],
     print(f"starting train and test for {model} at {datetime.datetime.now()}")
     all_metrics = [["Episodes trained", "Lines mean", "Lines lower quantile", "Lines upper quantile", "Nb pieces mean",
                     "Nb pieces lower quantile", "Nb pieces upper quantile", "Score mean",
-                    "Score lower quantile", "Score upper quantile"]]
+                    "Score lower quantile", "Score upper quantile", "Truncated fraction"]]
     episodes_trained = ep_trained
     reached_200, reached_1000 = False, False
     t1, t2 = None, None
@@ -69,11 +70,13 @@ def train_and_test(model: Union[StateValueModel, AfterstateModel],
         all_metrics.append([episodes_trained,
                             mean["Lines_cleared"], quantiles["Lines_cleared"][0.25], quantiles["Lines_cleared"][0.75],
                             mean["Nb_pieces"], quantiles["Nb_pieces"][0.25], quantiles["Nb_pieces"][0.75],
-                            mean["Score"], quantiles["Score"][0.25], quantiles["Score"][0.75]])
+                            mean["Score"], quantiles["Score"][0.25], quantiles["Score"][0.75],
+                            mean["Truncated"]])
         model.save(model_path)
         # print(f"ending round {i} at {datetime.datetime.now()}. Average score is {mean['Score']}.")
     # print(f"starting afterprocessing at {datetime.datetime.now()}")
 
+    import pandas as pd
     dataframe = pd.DataFrame(all_metrics[1:], columns=all_metrics[0])
 
     # save the measured times
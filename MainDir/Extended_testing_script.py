@@ -7,4 +7,4 @@ from Models.SarsaLambdaAfterstates import SarsaLambdaAfterstates
 
 models_dir = "/scratch/leuven/343/vsc34339/RLData/SarsaLambda_AS_exfourer"
 target_dir = "/data/leuven/343/vsc34339/RLData/SarsaLambda_exfourer_AS_results"
-extended_test(SarsaLambdaAfterstates, models_dir, target_dir, 10000)
+extended_test(SarsaLambdaAfterstates, models_dir, target_dir, 10000, nb_parallel_games=1000)
@@ -1,6 +1,11 @@
+import random
 from abc import abstractmethod
-from typing import Callable, Tuple
+from typing import Callable, Tuple, Union
+
+import numpy as np
+
 from tetris_environment.tetris_env import TetrisEnv
+from Models.ValueTables import DenseValueTable
 
 
 class AfterstateModel:
@@ -15,21 +20,64 @@ class AfterstateModel:
         pass
 
     @abstractmethod
-    def predict(self) -> Tuple[tuple, list]:
+    def predict(self) -> Tuple[tuple, list, Union[tuple, None]]:
         """
         Implemented by each model
-        :return: the best action to take according to the model. Does not explore, only exploit.
+        :return: the best action to take according to the model, in the form (afterstate, actions, placement) of
+                TetrisEnv.all_possible_placements(). Does not explore, only exploit.
         """
         pass
 
     @abstractmethod
-    def _epsilon_greedy_actions(self, learning_rate: Callable[[int], float], nb_episodes: int) -> Tuple[tuple, list]:
+    def _epsilon_greedy_actions(self, learning_rate: Callable[[int], float], nb_episodes: int) -> \
+            Tuple[tuple, list, Union[tuple, None]]:
         pass
 
     @abstractmethod
-    def _pick_random_actions(self) -> Tuple[tuple, list]:
+    def _pick_random_actions(self) -> Tuple[tuple, list, Union[tuple, None]]:
         pass
 
+    def _best_placement(self, value_function: dict) -> Union[Tuple[tuple, list, tuple], None]:
+        """
+        Looks up the value of every afterstate of TetrisEnv.all_afterstates() in one pass. Placements leading to the
+        same encoded afterstate are looked up once.
+        :param value_function: a dict mapping afterstates to their value, or a DenseValueTable, in which all
+                afterstates are looked up at once. Unknown afterstates are worth 0.
+        :return: the (afterstate, actions, placement) with the highest value, with ties broken at random, or None if
+                there is no falling piece
+        """
+        placements, _, states, _, _, actions = self.env.all_afterstates()
+        if len(placements) == 0:
+            return None
+        if isinstance(value_function, DenseValueTable):
+            values = value_function.lookup(states)
+            best = random.choice(np.flatnonzero(values == values.max()).tolist())
+            return self.env.encode_states(states[best:best + 1])[0], actions[best], tuple(placements[best].tolist())
+        states = self.env.encode_states(states)
+        known = {state: value_function.get(state, 0) for state in set(states)}
+        values = [known[state] for state in states]
+        best_value = max(values)
+        best = random.choice([i for i, value in enumerate(values) if value == best_value])
+        return states[best], actions[best], tuple(placements[best].tolist())
+
+    def _random_placement(self) -> Union[Tuple[tuple, list, tuple], None]:
+        """
+        Only the placement which is drawn is simulated, see TetrisEnv.sample_placement()
+        :return: a random (afterstate, actions, placement), or None if there is no falling piece
+        """
+        return self.env.sample_placement()
+
+    def _take_placement(self, placement: Union[tuple, None]) -> Tuple[tuple, float, bool, dict]:
+        """
+        Places the falling piece in one call and starts the next piece
+        :param placement: the placement (rotation, x) returned by predict() or _pick_random_actions(). If there is
+                no falling piece, this is None and a single frame without action is taken instead.
+        :return: the 4-tuple of TetrisEnv.step()
+        """
+        if placement is None:
+            return self.env.step(self.env.no_move)
+        return self.env.place(*placement)
+
     @abstractmethod
     def save(self, filename: str) -> None:
         pass
@@ -0,0 +1,121 @@
+from typing import Callable
+
+import numpy as np
+
+
+class EligibilityTraces:
+    """
+    The eligibility traces E(s) of the Sarsa(lambda) models, stored only for the keys with a live trace: a state
+    for the afterstate models, a (state, action) pair for the state-action models. The traces are kept in parallel
+    arrays, so that updating the value function and decaying the traces costs as much as the number of live traces,
+    whatever the size of the value function:
+    - keys: the key of every trace, with a dict giving the position of every key in the arrays;
+    - slots: for every key, the position of its value in a DenseValueTable or a QTable (see their slot()), or -1;
+    - traces: the traces themselves, which are all multiplied by a common factor, scale. decay() only changes this
+      factor and then removes the traces which fell below the threshold.
+    """
+
+    def __init__(self, capacity: int = 64):
+        """
+        :param capacity: the number of traces allocated at first. The arrays double in size when they are full.
+        """
+        if capacity < 1:
+            raise RuntimeError("The capacity should be at least one")
+        self.positions = {}
+        self.keys = []
+        self.slots = np.full(capacity, -1, dtype=np.int64)
+        self.traces = np.zeros(capacity, dtype=np.float64)
+        self.scale = 1.0
+
+    @staticmethod
+    def from_dict(eligibility: dict, slot: Callable = None):
+        """
+        :param eligibility: a dict mapping keys to their trace, as the eligibility of the models used to be
+        :param slot: a function giving the slot of a key. If none is provided, the traces have no slots.
+        :return: EligibilityTraces with the same traces
+        """
+        traces = EligibilityTraces(max(len(eligibility), 1))
+        for key, trace in eligibility.items():
+            traces.set(key, trace, -1 if slot is None else slot(key))
+        return traces
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key) -> bool:
+        return key in self.positions
+
+    def __iter__(self):
+        return iter(list(self.keys))
+
+    def get(self, key, default: float = 0) -> float:
+        position = self.positions.get(key)
+        if position is None:
+            return default
+        return float(self.traces[position]) * self.scale
+
+    def set(self, key, trace: float, slot: int = -1) -> None:
+        """
+        :param slot: the position of the value of key in a DenseValueTable or a QTable, or -1 for a dict value function
+        """
+        position = self.positions.get(key)
+        if position is None:
+            position = len(self.keys)
+            if position == len(self.traces):
+                self.slots = np.concatenate([self.slots, np.full_like(self.slots, -1)])
+                self.traces = np.concatenate([self.traces, np.zeros_like(self.traces)])
+            self.positions[key] = position
+            self.keys.append(key)
+        self.slots[position] = slot
+        self.traces[position] = trace / self.scale
+
+    def pop(self, key) -> None:
+        """
+        Removes the trace of key, if it has one
+        """
+        position = self.positions.pop(key, None)
+        if position is None:
+            return
+        # the last trace takes its place
+        last = len(self.keys) - 1
+        last_key = self.keys.pop()
+        if position != last:
+            self.keys[position] = last_key
+            self.positions[last_key] = position
+            self.slots[position] = self.slots[last]
+            self.traces[position] = self.traces[last]
+
+    def values(self) -> np.ndarray:
+        """
+        :return: the live traces, in the order of keys
+        """
+        return self.traces[:len(self.keys)] * self.scale
+
+    def active_slots(self) -> np.ndarray:
+        """
+        :return: the slots of the live traces, in the order of keys
+        """
+        return self.slots[:len(self.keys)]
+
+    def items(self) -> list:
+        return list(zip(self.keys, self.values().tolist()))
+
+    def decay(self, factor: float, threshold: float) -> None:
+        """
+        Multiplies all traces by factor, then removes the traces whose absolute value is below threshold
+        """
+        self.scale *= factor
+        if self.scale < 1e-100:  # fold the factor into the traces before it underflows
+            self.traces[:len(self.keys)] *= self.scale
+            self.scale = 1.0
+        # the positions are removed from the last one, so the trace which takes the place of a removed one is kept
+        for position in np.flatnonzero(np.abs(self.values()) < threshold)[::-1].tolist():
+            self.pop(self.keys[position])
+
+    def __getstate__(self) -> dict:
+        # the unused part of the arrays is not saved
+        state = dict(self.__dict__)
+        size = max(len(self.keys), 1)
+        state["slots"] = self.slots[:size].copy()
+        state["traces"] = self.traces[:size].copy()
+        return state
@@ -1,19 +1,21 @@
 import pickle
 import random
-from typing import Callable, Tuple
+from typing import Callable, Tuple, Union
 from Models.AfterstateModel import AfterstateModel
+from Models.ValueTables import DenseValueTable
 from tetris_environment.tetris_env import TetrisEnv
+from tetris_environment.state_codec import compact_states_kwargs
 
 
 class OnPolicyMCAfterstates(AfterstateModel):
 
-    def __init__(self, env: TetrisEnv, gamma: float = 1, value_function: dict = None, Q: dict = None, C: dict = None,
-                 first_visit: bool = True) -> None:
+    def __init__(self, env: TetrisEnv, gamma: float = 1, value_function: Union[dict, DenseValueTable] = None,
+                 Q: dict = None, C: dict = None, first_visit: bool = True) -> None:
         """
         Initializes a trainable Monte Carlo model using an afterstate value function.
         The model uses on-policy first-visit or every-visit MC control for epsilon-soft policies. It does not
         require the assumption of exploring starts, but does require epsilon-soft policies.
-        :param value_function: a dict for all states
+        :param value_function: a dict for all states, or a DenseValueTable
         :param Q: parameter in the learning process containing the average returns
         :param C: a kind of counter in the learning process.
         :param first_visit: specifies whether the model is first-visit or every-visit MC (Sutton & Barto, sec. 5.1)
@@ -56,17 +58,15 @@ class OnPolicyMCAfterstates(AfterstateModel):
             done = False
             # play entire episode. To enter while-loop, we use no-op
             total_return = 0
-            actions = [0, ]
+            placement = None
             while not done:
-                reward = 0
-                for action in actions:
-                    # take action a, observe R and s' until the piece has reached the bottom
-                    state, extra_reward, done, obs = self.env.step(action)
-                    reward += extra_reward
+                # take action a, observe R and s' once the piece has reached the bottom
+                state, reward, done, obs = self._take_placement(placement)
 
                 total_return = self.gamma * total_return + reward
 
-                afterstate, actions = self._epsilon_greedy_actions(learning_rate, episode + start_episode)
+                afterstate, actions, placement = self._epsilon_greedy_actions(learning_rate,
+                                                                              episode + start_episode)
                 if not self.first_visit or afterstate not in visited_afterstates:
                     return_so_far = self.Q.get(afterstate, 0)  # Collect Q(s')
 
@@ -84,33 +84,29 @@ class OnPolicyMCAfterstates(AfterstateModel):
                     visited_afterstates.add(afterstate)
 
             for visited_state in visited_afterstates:
-                self.value_function.update({visited_state: self.Q[visited_state]})
+                if visited_state is not None:  # None stands for the frames without falling piece
+                    self.value_function.update({visited_state: self.Q[visited_state]})
 
-    def _epsilon_greedy_actions(self, learning_rate: Callable[[int], float], nb_episodes: int) -> Tuple[tuple, list]:
+    def _epsilon_greedy_actions(self, learning_rate: Callable[[int], float], nb_episodes: int) -> \
+            Tuple[tuple, list, Union[tuple, None]]:
         epsilon = learning_rate(nb_episodes)
         if random.random() <= epsilon:
             return self._pick_random_actions()
         else:
             return self.predict()
 
-    def predict(self) -> Tuple[tuple, list]:
-        possible_placements = self.env.all_possible_placements()
-        # all possible placements for the current piece
-        # return is of the form (afterstate, action)
-        if len(possible_placements) > 0:
-            best_placement = max(possible_placements, key=lambda pl: self.value_function.get(pl[0], 0))
-        else:
+    def predict(self) -> Tuple[tuple, list, Union[tuple, None]]:
+        best_placement = self._best_placement(self.value_function)
+        if best_placement is None:
             # no piece, so no action. State is also irrelevant, so None value to reduce computation
-            best_placement = None, [0, ]
+            best_placement = None, [0, ], None
         return best_placement
 
-    def _pick_random_actions(self) -> Tuple[tuple, list]:
-        possible_placements = self.env.all_possible_placements()
-        if len(possible_placements) > 0:
-            placement = random.choice(possible_placements)
-        else:
+    def _pick_random_actions(self) -> Tuple[tuple, list, Union[tuple, None]]:
+        placement = self._random_placement()
+        if placement is None:
             # no piece, so no action. State is also irrelevant, so None value to reduce computation
-            placement = None, [0, ]
+            placement = None, [0, ], None
         return placement
 
     def save(self, filename: str) -> None:
@@ -128,7 +124,8 @@ class OnPolicyMCAfterstates(AfterstateModel):
     @staticmethod
     def load(filename: str, rendering: bool = False) -> AfterstateModel:
         value_func, C, Q, first_visit, size, gamma = OnPolicyMCAfterstates._load_file(filename)
-        return OnPolicyMCAfterstates(env=TetrisEnv(type=size, render=rendering), gamma=gamma,
+        env = TetrisEnv(type=size, render=rendering, **compact_states_kwargs(value_func))
+        return OnPolicyMCAfterstates(env=env, gamma=gamma,
                                      value_function=value_func, C=C, Q=Q, first_visit=first_visit)
 
     def __str__(self):
@@ -1,19 +1,24 @@
 import pickle
 import random
-from typing import Callable
+from typing import Callable, Union
+
+import numpy as np
+
 from Models.StateActionModel import StateValueModel
+from Models.ValueTables import QTable
 from tetris_environment.tetris_env import TetrisEnv
+from tetris_environment.state_codec import compact_states_kwargs
 
 
 class OnPolicyMCForTetris(StateValueModel):
-    def __init__(self, env: TetrisEnv, gamma: float, value_function: dict = None, Q: dict = None, C: dict = None,
-                 first_visit: bool = True) -> None:
+    def __init__(self, env: TetrisEnv, gamma: float, value_function: Union[dict, QTable] = None, Q: dict = None,
+                 C: dict = None, first_visit: bool = True) -> None:
         """
         Initializes a trainable Monte Carlo model.
         The model uses on-policy first-visit or every-visit MC control for epsilon-soft policies. It does not
         require the assumption of exploring starts, but does require epsilon-soft policies.
-        :param value_function: a dict of dicts for all state-action pairs. If no value function is provided,
-        the values are initialized as zero for all state-action pairs
+        :param value_function: a dict of dicts for all state-action pairs, or a QTable. If no value function is
+        provided, the values are initialized as zero for all state-action pairs
         :param Q: parameter in the learning process containing the average returns
         :param C: a kind of counter in the learning process.
         :param first_visit: specifies whether the model is first-visit or every-visit MC (Sutton & Barto, sec. 5.1)
@@ -55,12 +60,13 @@ class OnPolicyMCForTetris(StateValueModel):
 
         for episode in range(1, nb_episodes + 1):
             # start the new episode
-            state = self.env.reset()
+            state, info = self.env.reset(return_info=True)
             ext_state = (state, self.env.get_falling_piece())
             visited_pairs = set()  # set of every (s,a) visited in the episode
 
             # Take first action
-            action = self._epsilon_greedy_action(learning_rate, episode + start_episode, ext_state)
+            action = self._epsilon_greedy_action(learning_rate, episode + start_episode, ext_state,
+                                                 info["action_mask"])
 
             # play entire episode
             total_return = 0
@@ -97,7 +103,8 @@ class OnPolicyMCForTetris(StateValueModel):
                         return_so_far = return_so_far + (total_return - return_so_far) / cumulative
                         self.Q[old_ext_state].update({old_action: return_so_far})
                     visited_pairs.add((old_ext_state, old_action))
-                    action = self._epsilon_greedy_action(learning_rate, episode + start_episode, ext_state)
+                    action = self._epsilon_greedy_action(learning_rate, episode + start_episode, ext_state,
+                                                         obs["action_mask"])
 
                 else:  # if piece is None, take no-action
                     action = self.env.no_move
@@ -105,28 +112,23 @@ class OnPolicyMCForTetris(StateValueModel):
             # After episode: update value function
             visited_states = {state for state, action in visited_pairs}
             for visited_state in visited_states:
-                if visited_state not in self.value_function.keys():
+                if isinstance(self.value_function, QTable):
+                    self.value_function.update(visited_state, self.Q[visited_state])
+                elif visited_state not in self.value_function:
                     self.value_function.update({visited_state: self.Q[visited_state]})
                 else:
                     self.value_function[visited_state].update(self.Q[visited_state])
 
-    def _epsilon_greedy_action(self, learning_rate: Callable[[int], float], nb_episodes: int, ext_state):
+    def _epsilon_greedy_action(self, learning_rate: Callable[[int], float], nb_episodes: int, ext_state,
+                               action_mask: np.ndarray = None):
         epsilon = learning_rate(nb_episodes)
         if random.random() <= epsilon:
-            return self.env.action_space.sample()
+            return self._sample_action(action_mask)
         else:
-            return self.predict(ext_state)
-
-    def predict(self, state):
-        values_for_state = self.value_function.get(state, {})
-        a_star = self._argmax_dict(values_for_state)
-        return a_star
+            return self.predict(ext_state, action_mask)
 
-    def _argmax_dict(self, dc: dict):
-        if len(dc.keys()) > 0:
-            return max(dc.keys(), key=lambda key: dc.get(key, 0))
-        else:  # in this case all values are zero, so argmax is just as good as a random sample
-            return self.env.action_space.sample()
+    def predict(self, state, action_mask: np.ndarray = None):
+        return self._greedy_action(state, action_mask)
 
     def save(self, filename: str) -> None:
         with open(filename, 'wb') as f:
@@ -138,7 +140,7 @@ class OnPolicyMCForTetris(StateValueModel):
         with open(filename, 'rb') as f:
             value_func, gamma, C, Q, first_visit, size = pickle.load(f)
             f.close()
-        env = TetrisEnv(type=size, render=rendering)
+        env = TetrisEnv(type=size, render=rendering, **compact_states_kwargs(value_func))
         return OnPolicyMCForTetris(env=env, gamma=gamma, value_function=value_func, C=C, Q=Q, first_visit=first_visit)
 
     def __str__(self):
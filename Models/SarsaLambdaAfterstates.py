@@ -1,8 +1,11 @@
 import pickle
-from typing import Callable, Tuple
+from typing import Callable, Tuple, Union
 import random
 from Models.AfterstateModel import AfterstateModel
+from Models.EligibilityTraces import EligibilityTraces
+from Models.ValueTables import DenseValueTable, add_values
 from tetris_environment.tetris_env import TetrisEnv
+from tetris_environment.state_codec import compact_states_kwargs
 
 
 class SarsaLambdaAfterstates(AfterstateModel):
@@ -10,7 +13,8 @@ class SarsaLambdaAfterstates(AfterstateModel):
                  env: TetrisEnv,
                  Lambda: float, alpha: float, gamma: float,
                  traces: str,
-                 value_function: dict = None, eligibility: dict = None,
+                 value_function: Union[dict, DenseValueTable] = None,
+                 eligibility: Union[dict, EligibilityTraces] = None,
                  learned_games: int = 0):
         """
         Initializes a sarsa-control model with a Tetris environment
@@ -20,17 +24,20 @@ class SarsaLambdaAfterstates(AfterstateModel):
         :param gamma: parameter in the update rule
         :param traces: Either accumulating, dutch, replacing. Specifies the update rule for eligibility traces
         :param learned_games: the number of games the agent already learned.
-        :param value_function: a dict containing the value for each state. If none is provided
+        :param value_function: a dict containing the value for each state, or a DenseValueTable. If none is provided
         it is initialized as Q(s) = 0 for all s
-        :param eligibility: a dict containing the eligibility traces for all states. If none is provided,
-        it is initialized as E(s) = 0 for all s
+        :param eligibility: the EligibilityTraces of the states, or a dict containing them. If none are provided,
+        they are initialized as E(s) = 0 for all s
         """
         super().__init__(env)
 
-        if eligibility is None:
-            eligibility = {}
         if value_function is None:
             value_function = {}
+        if eligibility is None:
+            eligibility = EligibilityTraces()
+        elif isinstance(eligibility, dict):
+            slot = value_function.slot if isinstance(value_function, DenseValueTable) else None
+            eligibility = EligibilityTraces.from_dict(eligibility, slot)
 
         if Lambda == 0:
             print("WARNING: If lambda = 0, better use SarsaZeroAfterstates")
@@ -65,25 +72,27 @@ class SarsaLambdaAfterstates(AfterstateModel):
         for episode in range(1, nb_episodes + 1):
             self.learned_episodes += 1
             state = self.env.reset()
-            afterstate, actions = self._epsilon_greedy_actions(learning_rate, episode + start_episode)
+            afterstate, actions, placement = self._epsilon_greedy_actions(learning_rate, episode + start_episode)
 
             done = False
             while not done:
-                reward = 0
-                for action in actions:
-                    # take action a, observe R and s until the piece has reached the bottom
-                    state, extra_reward, done, obs = self.env.step(action)
-                    reward += extra_reward
+                # take action a, observe R and s once the piece has reached the bottom
+                state, reward, done, obs = self._take_placement(placement)
 
-                if state not in self.value_function.keys():
+                if state not in self.value_function:
                     self.value_function.update({state: 0})
 
                 # Determine next action and next state
-                afterstate, actions = self._epsilon_greedy_actions(learning_rate, episode + start_episode)
+                afterstate, actions, placement = self._epsilon_greedy_actions(learning_rate,
+                                                                              episode + start_episode)
 
-                # collect V(s') and V(s)
+                # collect V(s') and V(s). After a game over, V(s') belongs to the next episode and is not used, but a
+                # truncated episode bootstraps from it.
                 value_at_curr_state = self.value_function.get(state, 0)
-                value_at_afterstate = self.value_function.get(afterstate, 0)
+                if done and not obs.get("TimeLimit.truncated", False):
+                    value_at_afterstate = 0
+                else:
+                    value_at_afterstate = self.value_function.get(afterstate, 0)
 
                 # compute delta
                 delta = reward + self.gamma * value_at_afterstate - value_at_curr_state
@@ -102,23 +111,25 @@ class SarsaLambdaAfterstates(AfterstateModel):
 
                 if abs(eleg) < MIN_ELEG:
                     self.eligibility.pop(state)
+                elif isinstance(self.value_function, DenseValueTable):
+                    self.eligibility.set(state, eleg, self.value_function.slot(state))
                 else:
-                    self.eligibility.update({state: eleg})
-
-                # Update Q and E for all s in S, a in A(s) and simultaneously reduce size of E(s) to save on memory
+                    self.eligibility.set(state, eleg)
 
-                # Q(s) <- Q(s) + alpha * delta * E(s)
+                # Update V and E for all s with a trace and simultaneously reduce size of E(s) to save on memory
+                # V(s) <- V(s) + alpha * delta * E(s)
                 # E(s) <- lambda * gamma * E(s)
-                states = {s for s in self.value_function.keys() if s in self.eligibility.keys()}
-                for s in states:
-                    self.value_function[s] += self.alpha * delta * self.eligibility.get(s, 0)
-                    self.eligibility[s] *= (self.gamma * self.Lambda)
-                    if abs(self.eligibility[s]) < MIN_ELEG:
-                        self.eligibility.pop(s)
+                deltas = self.alpha * delta * self.eligibility.values()
+                if isinstance(self.value_function, DenseValueTable):
+                    self.value_function.add_slots(self.eligibility.active_slots(), deltas)
+                else:
+                    add_values(self.value_function, self.eligibility.keys, deltas.tolist())
+                self.eligibility.decay(self.gamma * self.Lambda, MIN_ELEG)
 
         self.learned_episodes += nb_episodes
 
-    def _epsilon_greedy_actions(self, learning_rate: Callable[[int], float], nb_episodes: int) -> Tuple[tuple, list]:
+    def _epsilon_greedy_actions(self, learning_rate: Callable[[int], float], nb_episodes: int) -> \
+            Tuple[tuple, list, Union[tuple, None]]:
         """
         :param nb_episodes: how far into learning is the agent
         :param learning_rate: a function of the number of episodes which goes towards zero at infinity
@@ -135,21 +146,16 @@ class SarsaLambdaAfterstates(AfterstateModel):
     def _nb_actions(self) -> int:
         return len(self.env.game_state.get_action_set())
 
-    def predict(self) -> Tuple[tuple, list]:
-        possible_placements = self.env.all_possible_placements()
-        # possible_placements of form (state, action)
-        if len(possible_placements) > 0:
-            best_placement = max(possible_placements, key=lambda pl: self.value_function.get(pl[0], 0))
-        else:
-            best_placement = (self.env.get_encoded_state(), [0])  # no piece, so no action
+    def predict(self) -> Tuple[tuple, list, Union[tuple, None]]:
+        best_placement = self._best_placement(self.value_function)
+        if best_placement is None:
+            best_placement = (self.env.get_encoded_state(), [0], None)  # no piece, so no action
         return best_placement
 
-    def _pick_random_actions(self) -> Tuple[tuple, list]:
-        possible_placements = self.env.all_possible_placements()
-        if len(possible_placements) > 0:
-            placement = random.choice(possible_placements)  # consists of afterstate and action
-        else:
-            placement = (self.env.get_encoded_state(), [0])  # no piece, so no action
+    def _pick_random_actions(self) -> Tuple[tuple, list, Union[tuple, None]]:
+        placement = self._random_placement()  # consists of afterstate, actions and placement
+        if placement is None:
+            placement = (self.env.get_encoded_state(), [0], None)  # no piece, so no action
         return placement
 
     @staticmethod
@@ -162,7 +168,7 @@ class SarsaLambdaAfterstates(AfterstateModel):
     @staticmethod
     def load(filename: str, rendering: bool = False) -> AfterstateModel:
         gamma, alpha, Lambda, value_function, eligibility, traces, size, learned_eps = SarsaLambdaAfterstates._load_file(filename)
-        env = TetrisEnv(type=size, render=rendering)
+        env = TetrisEnv(type=size, render=rendering, **compact_states_kwargs(value_function))
         return SarsaLambdaAfterstates(env, Lambda, alpha, gamma, traces, value_function, eligibility, learned_eps)
 
     def save(self, filename: str) -> None:
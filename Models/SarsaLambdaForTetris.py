@@ -1,8 +1,14 @@
 import pickle
-from typing import Callable
+from typing import Callable, Union
 import random
+
+import numpy as np
+
+from Models.EligibilityTraces import EligibilityTraces
 from Models.StateActionModel import StateValueModel
+from Models.ValueTables import QTable
 from tetris_environment.tetris_env import TetrisEnv
+from tetris_environment.state_codec import compact_states_kwargs
 
 
 class SarsaLambdaForTetris(StateValueModel):
@@ -10,8 +16,8 @@ class SarsaLambdaForTetris(StateValueModel):
                  env: TetrisEnv,
                  Lambda: float, alpha: float, gamma: float,
                  traces: str,
-                 value_function=None,
-                 eligibility=None):
+                 value_function: Union[dict, QTable] = None,
+                 eligibility: Union[dict, EligibilityTraces] = None):
         """
         Initializes a sarsa-control model with a Tetris environment
         :param env: The Tetris environment in which to use the model/agent
@@ -20,17 +26,21 @@ class SarsaLambdaForTetris(StateValueModel):
         :param alpha: step-size parameter in the update rule
         :param gamma: parameter in the update rule
         :param traces: Either accumulating, dutch, replacing. Specifies the update rule for eligibility traces
-        :param value_function: a dict of dicts containing the value for each state-action pair. If none is provided
-        it is initialized as Q(s,a) = 0 for all s, a
-        :param eligibility: a dict of dicts containing the values for the eligibility traces of each state-action pair.
-        If none are provided, the eligibility traces are initialized as E(s,a)=0 for all s, a
+        :param value_function: a dict of dicts containing the value for each state-action pair, or a QTable. If none
+        is provided it is initialized as Q(s,a) = 0 for all s, a
+        :param eligibility: the EligibilityTraces of the state-action pairs (s, a), or a dict of dicts containing
+        them. If none are provided, the eligibility traces are initialized as E(s,a)=0 for all s, a
         """
         super().__init__(env)
 
-        if eligibility is None:
-            eligibility = {}
         if value_function is None:
             value_function = {}
+        if eligibility is None:
+            eligibility = EligibilityTraces()
+        elif isinstance(eligibility, dict):
+            slot = (lambda pair: value_function.slot(*pair)) if isinstance(value_function, QTable) else None
+            eligibility = EligibilityTraces.from_dict({(s, a): trace for s, traces_s in eligibility.items()
+                                                       for a, trace in traces_s.items()}, slot)
 
         if Lambda == 0:
             print("If lambda = 0, better use SarsaZeroForTetris")
@@ -59,11 +69,12 @@ class SarsaLambdaForTetris(StateValueModel):
         # NOTE: eligibility traces will reset to 0 when their value is less than MIN_ELEG
         MIN_ELEG = 0.01
         for episode in range(1, nb_episodes + 1):
-            state = self.env.reset()
+            state, info = self.env.reset(return_info=True)
             piece = self.env.get_falling_piece()
             ext_state = (piece, state)
 
-            action = self._epsilon_greedy_action(learning_rate, episode + start_episode, ext_state)
+            action = self._epsilon_greedy_action(learning_rate, episode + start_episode, ext_state,
+                                                 info["action_mask"])
             done = False
             while not done:
                 old_ext_state = ext_state
@@ -72,23 +83,25 @@ class SarsaLambdaForTetris(StateValueModel):
                 piece = self.env.get_falling_piece()
                 if piece is not None:
                     ext_state = (piece, state)
-                    action = self._epsilon_greedy_action(learning_rate, episode + start_episode, ext_state)
+                    action = self._epsilon_greedy_action(learning_rate, episode + start_episode, ext_state,
+                                                         obs["action_mask"])
 
-                    if ext_state not in self.value_function.keys():
-                        self.value_function.update({ext_state: {}})
+                    if not self._has_value(ext_state, action):
+                        self._set_value(ext_state, action, 0)
 
-                    if action not in self.value_function[ext_state].keys():
-                        self.value_function[ext_state].update({action: 0})
-
-                    # collect Q(s,a) and Q(s', a')
-                    old_value = self.value_function.get(old_ext_state, {}).get(old_action, 0)
-                    value = self.value_function.get(ext_state, {}).get(action, 0)
+                    # collect Q(s,a) and Q(s', a'). After a game over, (s', a') belongs to the next episode, but a
+                    # truncated episode bootstraps from Q(s', a').
+                    old_value = self._get_value(old_ext_state, old_action)
+                    if done and not obs.get("TimeLimit.truncated", False):
+                        value = 0
+                    else:
+                        value = self._get_value(ext_state, action)
 
                     # compute delta
                     delta = reward + self.gamma * value - old_value
 
                     # Update eligibility traces
-                    eleg = self.eligibility.get(old_ext_state, {}).get(old_action, 0)
+                    eleg = self.eligibility.get((old_ext_state, old_action))
 
                     if self.traces == "accumulating":
                         eleg = eleg + 1
@@ -99,62 +112,54 @@ class SarsaLambdaForTetris(StateValueModel):
                     else:
                         raise RuntimeError
 
-                    if old_ext_state not in self.eligibility:
-                        self.eligibility.update({old_ext_state: {}})
-
                     if abs(eleg) < MIN_ELEG:
-                        if old_action in self.eligibility[old_ext_state].keys():
-                            self.eligibility[old_ext_state].pop(old_action)
+                        self.eligibility.pop((old_ext_state, old_action))
+                    elif isinstance(self.value_function, QTable):
+                        self.eligibility.set((old_ext_state, old_action), eleg,
+                                             self.value_function.slot(old_ext_state, old_action))
                     else:
-                        self.eligibility[old_ext_state].update({old_action: eleg})
+                        self.eligibility.set((old_ext_state, old_action), eleg)
                 else:  # piece is None, so no new piece. Take a no-action
                     action = 0
                     delta = 0
 
-                # Update Q and E for all s in S, a in A(s) and simultaneously reduce size of E(s,a) to save on memory
+                # Update Q and E for all (s, a) with a trace and simultaneously reduce size of E(s,a) to save on memory
                 # Q(s,a) <- Q(s,a) + alpha * delta * E(s,a)
                 # E(s,a) <- lambda * gamma * E(s,a)
-                for s in self.value_function.keys():
-                    eligibility_s = self.eligibility.get(s, {})
-                    for a in self.value_function[s].keys():
-                        if a in eligibility_s.keys():
-                            self.value_function[s][a] += self.alpha * delta * eligibility_s[a]
-                            self.eligibility[s][a] *= (self.gamma * self.Lambda)
-                            if self.eligibility[s][a] < MIN_ELEG:
-                                self.eligibility[s].pop(a)
-                            if len(self.eligibility[s].keys()) == 0:
-                                self.eligibility.pop(s)
-
-    def _epsilon_greedy_action(self, learning_rate: Callable[[int], float], nb_episodes, ext_state):
+                self._add_traces(self.alpha * delta)
+                self.eligibility.decay(self.gamma * self.Lambda, MIN_ELEG)
+
+    def _epsilon_greedy_action(self, learning_rate: Callable[[int], float], nb_episodes, ext_state,
+                               action_mask: np.ndarray = None):
         """
         :param ext_state: the state for which to choose the epsilon greedy action
         :param nb_episodes: how far into learning is the agent
         :param learning_rate: a function of the number of episodes which goes towards zero at infinity
+        :param action_mask: the action mask of the current step. If provided, only legal actions are chosen.
         :return: the action according to the epsilon greedy policy
         """
         epsilon = learning_rate(nb_episodes)
         if random.random() <= epsilon:
-            action = self.env.action_space.sample()
+            action = self._sample_action(action_mask)
             return action
         else:
-            action = self.predict(ext_state)
+            action = self.predict(ext_state, action_mask)
             return action
 
-    def predict(self, ext_state):
-        values_for_state = self.value_function.get(ext_state, {})
-        a_star = self._argmax_dict(values_for_state)  # A_star is the optimal action in state A
-        return a_star
+    def predict(self, ext_state, action_mask: np.ndarray = None):
+        return self._greedy_action(ext_state, action_mask)  # the optimal action in state ext_state
 
-    def _argmax_dict(self, dc: dict):
+    def _add_traces(self, step: float) -> None:
         """
-        Returns the / a key associated with the / a maximum value.
-        :param dc: the dictionary to search
-        :return: a key associated with a maximum value
+        Adds step * E(s, a) to Q(s, a) for every pair (s, a) with a trace, all at once for a QTable. A pair without
+        value starts from 0.
         """
-        if len(dc.keys()) > 0:
-            return max(dc.keys(), key=lambda key: dc.get(key, 0))
-        else:  # in this case all values are zero, so argmax is the same as a random sample
-            return self.env.action_space.sample()
+        deltas = step * self.eligibility.values()
+        if isinstance(self.value_function, QTable):
+            self.value_function.add_slots(self.eligibility.active_slots(), deltas)
+            return
+        for (s, a), delta in zip(self.eligibility.keys, deltas.tolist()):
+            self._set_value(s, a, self._get_value(s, a) + delta)
 
     def save(self, filename: str):
         with open(filename, 'wb') as f:
@@ -168,7 +173,7 @@ class SarsaLambdaForTetris(StateValueModel):
         with open(filename, 'rb') as f:
             gamma, alpha, Lambda, value_function, eligibility, traces, size = pickle.load(f)
             f.close()
-        env = TetrisEnv(size, rendering)
+        env = TetrisEnv(size, rendering, **compact_states_kwargs(value_function))
         return SarsaLambdaForTetris(env, Lambda, alpha, gamma, traces, value_function, eligibility)
 
     def __str__(self):
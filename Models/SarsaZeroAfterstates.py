@@ -1,8 +1,10 @@
 import random
-from typing import Callable, Tuple
+from typing import Callable, Tuple, Union
 import pickle
 from tetris_environment.tetris_env import TetrisEnv
+from tetris_environment.state_codec import compact_states_kwargs
 from Models.AfterstateModel import AfterstateModel
+from Models.ValueTables import DenseValueTable
 
 
 class SarsaZeroAfterStates(AfterstateModel):
@@ -10,11 +12,13 @@ class SarsaZeroAfterStates(AfterstateModel):
     A Sarsa model working with an afterstate value function V(S')
     """
 
-    def __init__(self, env: TetrisEnv, alpha: float = 1, gamma: float = 1, value_function: dict = None):
+    def __init__(self, env: TetrisEnv, alpha: float = 1, gamma: float = 1,
+                 value_function: Union[dict, DenseValueTable] = None):
         """
 
         :param alpha: step-size-parameter in the update rule
         :param gamma: parameter in the update rule
+        :param value_function: a dict of the values of the afterstates, or a DenseValueTable
         """
         super().__init__(env)
 
@@ -39,26 +43,28 @@ class SarsaZeroAfterStates(AfterstateModel):
         """
         for episode in range(1, nb_episodes + 1):
             state = self.env.reset()
-            afterstate, actions = self._epsilon_greedy_actions(learning_rate, episode + start_episode)
+            afterstate, actions, placement = self._epsilon_greedy_actions(learning_rate, episode + start_episode)
 
             done = False
             while not done:
-                reward = 0
-                for action in actions:
-                    # take action a, observe R and s' until the piece has reached the bottom
-                    state, reward, done, obs = self.env.step(action)
-                    self.env.render()
-
-                afterstate, actions = self._epsilon_greedy_actions(learning_rate, episode + start_episode)
-
-                # update value function at V(s)
-                value_at_next_state = self.value_function.get(afterstate, 0)
+                # take action a, observe R and s' once the piece has reached the bottom
+                state, reward, done, obs = self._take_placement(placement)
+                self.env.render()
+
+                afterstate, actions, placement = self._epsilon_greedy_actions(learning_rate, episode + start_episode)
+
+                # update value function at V(s). After a game over, the next afterstate belongs to the next episode,
+                # so there is nothing to bootstrap from. A truncated episode could have gone on, so it bootstraps.
+                if done and not obs.get("TimeLimit.truncated", False):
+                    value_at_next_state = 0
+                else:
+                    value_at_next_state = self.value_function.get(afterstate, 0)
                 old_value = self.value_function.get(state, 0)
                 new_value = old_value + self.alpha * (reward + self.gamma * value_at_next_state - old_value)
                 self.value_function.update({state: new_value})
 
     def _epsilon_greedy_actions(self, learning_rate: Callable[[int], float], nb_episodes: int) -> \
-            Tuple[tuple, list]:
+            Tuple[tuple, list, Union[tuple, None]]:
         """
         Returns either a random set of actions leading to a random next board state, or a sequence of actions
         leading to the most favourable afterstate.
@@ -74,21 +80,16 @@ class SarsaZeroAfterStates(AfterstateModel):
     def _nb_actions(self) -> int:
         return len(self.env.game_state.get_action_set())
 
-    def _pick_random_actions(self) -> Tuple[tuple, list]:
-        possible_placements = self.env.all_possible_placements()
-        if len(possible_placements) > 0:
-            placement = random.choice(possible_placements)  # consists of afterstate and action
-        else:
-            placement = (self.env.get_encoded_state(), [0])  # no piece, so no action
+    def _pick_random_actions(self) -> Tuple[tuple, list, Union[tuple, None]]:
+        placement = self._random_placement()  # consists of afterstate, actions and placement
+        if placement is None:
+            placement = (self.env.get_encoded_state(), [0], None)  # no piece, so no action
         return placement
 
-    def predict(self) -> Tuple[tuple, list]:
-        possible_placements = self.env.all_possible_placements()
-        # possible_placements of form (state, action)
-        if len(possible_placements) > 0:
-            best_placement = max(possible_placements, key=lambda pl: self.value_function.get(pl[0], 0))
-        else:
-            best_placement = (self.env.get_encoded_state(), [0])  # no piece, so no action
+    def predict(self) -> Tuple[tuple, list, Union[tuple, None]]:
+        best_placement = self._best_placement(self.value_function)
+        if best_placement is None:
+            best_placement = (self.env.get_encoded_state(), [0], None)  # no piece, so no action
         return best_placement
 
     @staticmethod
@@ -100,7 +101,7 @@ class SarsaZeroAfterStates(AfterstateModel):
     @staticmethod
     def load(filename: str, rendering: bool = False):
         alpha, gamma, value_function, size = SarsaZeroAfterStates._load_file(filename)
-        env = TetrisEnv(type=size, render=rendering)
+        env = TetrisEnv(type=size, render=rendering, **compact_states_kwargs(value_function))
         return SarsaZeroAfterStates(alpha=alpha, gamma=gamma, value_function=value_function, env=env)
 
     def save(self, filename: str):
@@ -1,9 +1,13 @@
 import random
-from typing import Callable
+from typing import Callable, Union
 from Models.StateActionModel import StateValueModel
+from Models.ValueTables import QTable
 import pickle
 
+import numpy as np
+
 from tetris_environment.tetris_env import TetrisEnv
+from tetris_environment.state_codec import compact_states_kwargs
 
 
 class SarsaZeroForTetris(StateValueModel):
@@ -11,11 +15,12 @@ class SarsaZeroForTetris(StateValueModel):
     A Sarsa model working with a state-action value function Q(s,a)
     """
 
-    def __init__(self, env: TetrisEnv, alpha=1, gamma=1, value_function: dict = None):
+    def __init__(self, env: TetrisEnv, alpha=1, gamma=1, value_function: Union[dict, QTable] = None):
         """
 
         :param alpha: step-size-parameter in the update rule
         :param gamma: parameter in the update rule
+        :param value_function: a dict of dicts, see below, or a QTable
         """
         super().__init__(env)
 
@@ -42,11 +47,12 @@ class SarsaZeroForTetris(StateValueModel):
         """
 
         for episode in range(nb_episodes):  # for each episode
-            state = self.env.reset()
+            state, info = self.env.reset(return_info=True)
             piece = self.env.get_falling_piece()
 
             ext_state = (state, piece)
-            action = self._epsilon_greedy_action(learning_rate, episode + start_episode, ext_state)
+            action = self._epsilon_greedy_action(learning_rate, episode + start_episode, ext_state,
+                                                 info["action_mask"])
             done = False
 
             while not done:
@@ -56,54 +62,44 @@ class SarsaZeroForTetris(StateValueModel):
                 piece = self.env.get_falling_piece()
                 if piece is not None:
                     ext_state = (state, piece)
-                    action = self._epsilon_greedy_action(learning_rate, episode + start_episode, ext_state)
-
-                    # update value function at Q(s,a)
-                    value_at_next_state = self.value_function.get(ext_state, {}).get(action, 0)
-                    old_value = self.value_function.get(old_ext_state, {}).get(old_action, 0)
+                    action = self._epsilon_greedy_action(learning_rate, episode + start_episode, ext_state,
+                                                         obs["action_mask"])
+
+                    # update value function at Q(s,a). After a game over, (s', a') belongs to the next episode, but a
+                    # truncated episode bootstraps from Q(s', a').
+                    if done and not obs.get("TimeLimit.truncated", False):
+                        value_at_next_state = 0
+                    else:
+                        value_at_next_state = self._get_value(ext_state, action)
+                    old_value = self._get_value(old_ext_state, old_action)
                     new_value = old_value + self.alpha * (reward + self.gamma * value_at_next_state - old_value)
                     if new_value != 0:
-                        if old_ext_state not in self.value_function.keys():
-                            self.value_function.update({old_ext_state: {}})
-                        self.value_function[old_ext_state].update({old_action: new_value})
-                        print(self.value_function)
+                        self._set_value(old_ext_state, old_action, new_value)
                 else:  # if piece is None, there is no falling piece. Make no move
                     action = self.env.no_move
 
-    def _epsilon_greedy_action(self, learning_rate: Callable[[int], float], nb_episodes, ext_state):
+    def _epsilon_greedy_action(self, learning_rate: Callable[[int], float], nb_episodes, ext_state,
+                               action_mask: np.ndarray = None):
         """
         :param ext_state: the state for which to choose the epsilon greedy action
         :param nb_episodes: how far into learning is the agent
         :param learning_rate: a function of the number of episodes which goes towards zero at infinity
+        :param action_mask: the action mask of the current step. If provided, only legal actions are chosen.
         :return: the action according to the epsilon greedy policy
         """
         epsilon = learning_rate(nb_episodes)
         if random.random() <= epsilon:
-            action = self.env.action_space.sample()
+            action = self._sample_action(action_mask)
             return action
         else:
-            action = self.predict(ext_state)
+            action = self.predict(ext_state, action_mask)
             return action
 
     def _nb_actions(self) -> int:
         return len(self.env.game_state.get_action_set())
 
-    def predict(self, ext_state):
-
-        values_for_state = self.value_function.get(ext_state, {})
-        a_star = self._argmax_dict(values_for_state)  # A_star is the optimal action in state A
-        return a_star
-
-    def _argmax_dict(self, dc: dict):
-        """
-        Returns the / a key associated with the / a maximum value.
-        :param dc:
-        :return:
-        """
-        if len(dc.keys()) > 0:
-            return max(dc.keys(), key=lambda key: dc.get(key, 0))
-        else:  # in this case all values are zero, so argmax is the same as a random sample
-            return self.env.action_space.sample()
+    def predict(self, ext_state, action_mask: np.ndarray = None):
+        return self._greedy_action(ext_state, action_mask)  # the optimal action in state ext_state
 
     @staticmethod
     def _load_file(filename: str):
@@ -114,7 +110,8 @@ class SarsaZeroForTetris(StateValueModel):
     @staticmethod
     def load(filename: str, rendering: bool = False):
         alpha, gamma, type, value_function = SarsaZeroForTetris._load_file(filename)
-        return SarsaZeroForTetris(TetrisEnv(type, rendering), alpha, gamma, value_function)
+        env = TetrisEnv(type, rendering, **compact_states_kwargs(value_function))
+        return SarsaZeroForTetris(env, alpha, gamma, value_function)
 
     def save(self, filename: str):
         with open(filename, 'wb') as f:
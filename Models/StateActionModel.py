@@ -1,9 +1,19 @@
+import random
 from abc import abstractmethod
 from typing import Callable
+
+import numpy as np
+
 from tetris_environment.tetris_env import TetrisEnv
+from Models.ValueTables import QTable
 
 
 class StateValueModel:
+    """
+    The value function of a state-action model is either a dict of dicts {state: {action: value}} or a QTable. The
+    models go through _get_value(), _set_value() and _greedy_action(), which work with both.
+    """
+
     def __init__(self, env: TetrisEnv):
         self.env = env
 
@@ -15,17 +25,71 @@ class StateValueModel:
         pass
 
     @abstractmethod
-    def predict(self, state):
+    def predict(self, state, action_mask: np.ndarray = None):
         """
         Implemented by each model
+        :param action_mask: the action mask of the current step, see TetrisEnv.step. If provided, only legal actions
+                are returned.
         :return: the best action to take according to the model. Does not explore, only exploit.
         """
         pass
 
     @abstractmethod
-    def _epsilon_greedy_action(self, learning_rate: Callable[[int], float], nb_episodes, state):
+    def _epsilon_greedy_action(self, learning_rate: Callable[[int], float], nb_episodes, state,
+                               action_mask: np.ndarray = None):
         pass
 
+    def _sample_action(self, action_mask: np.ndarray = None) -> int:
+        """
+        :param action_mask: the action mask of the current step, see TetrisEnv.step
+        :return: an action drawn uniformly at random, among the legal actions if an action mask is provided
+        """
+        if action_mask is None:
+            return self.env.action_space.sample()
+        return random.choice(np.flatnonzero(action_mask).tolist())
+
+    def _argmax_dict(self, dc: dict, action_mask: np.ndarray = None):
+        """
+        Returns the / a key associated with the / a maximum value.
+        :param dc: a dict mapping actions to their value
+        :param action_mask: the action mask of the current step. If provided, illegal actions are skipped.
+        :return: a key associated with a maximum value, or a random (legal) action if there is none
+        """
+        actions = [action for action in dc.keys() if action_mask is None or action_mask[action]]
+        if len(actions) > 0:
+            return max(actions, key=lambda key: dc.get(key, 0))
+        else:  # in this case all values are zero, so argmax is the same as a random sample
+            return self._sample_action(action_mask)
+
+    def _get_value(self, state, action: int) -> float:
+        """
+        :return: Q(state, action), 0 if the pair has no value
+        """
+        if isinstance(self.value_function, QTable):
+            return self.value_function.get(state, action)
+        return self.value_function.get(state, {}).get(action, 0)
+
+    def _has_value(self, state, action: int) -> bool:
+        if isinstance(self.value_function, QTable):
+            return self.value_function.has_value(state, action)
+        return action in self.value_function.get(state, {})
+
+    def _set_value(self, state, action: int, value: float) -> None:
+        if isinstance(self.value_function, QTable):
+            self.value_function.set(state, action, value)
+        else:
+            self.value_function.setdefault(state, {})[action] = value
+
+    def _greedy_action(self, state, action_mask: np.ndarray = None) -> int:
+        """
+        :param action_mask: the action mask of the current step. If provided, illegal actions are skipped.
+        :return: the action with the highest value in state, or a random (legal) action if none has a value
+        """
+        if isinstance(self.value_function, QTable):
+            action = self.value_function.best_action(state, action_mask)
+            return self._sample_action(action_mask) if action is None else action
+        return self._argmax_dict(self.value_function.get(state, {}), action_mask)
+
     @abstractmethod
     def save(self, filename: str):
         pass
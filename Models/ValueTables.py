@@ -0,0 +1,308 @@
+import os
+from typing import Iterable, Union
+
+import numpy as np
+
+from tetris_environment.state_codec import StateCodec
+from tetris_environment.tetris_env import TetrisEnv
+
+
+class DenseValueTable:
+    """
+    An afterstate value function stored in a dense NumPy array with one entry for every encoded state, indexed by
+    the code of the state (see StateCodec). It can replace the dict value function of the afterstate models: it
+    supports get(), update(), item access, `in` and iteration over the states which were given a value, with states
+    as tuples or as codes. On top of that, lookup() finds the values of a whole array of afterstates at once and
+    add() changes many values at once.
+    States which were never given a value are stored as NaN and are worth 0, as missing keys of a dict. For
+    'fourer' and 'extended fourer' the table holds 343 values, for 'regular' about 40 million, which is why it can be
+    kept in a memory-mapped .npy file instead.
+    """
+
+    def __init__(self, codec: StateCodec, compact_keys: bool = False, filename: str = None, dtype=np.float32):
+        """
+        :param codec: the StateCodec of the states, see TetrisEnv.codec
+        :param compact_keys: whether keys() and items() return the codes of the states, as in a TetrisEnv with
+                compact_states, rather than tuples
+        :param filename: if provided, the table is a memory-mapped .npy file. An existing file is opened, with the
+                values it holds, otherwise a new one is created.
+        :param dtype: the floating point type of the values
+        """
+        self.codec = codec
+        self.compact_keys = compact_keys
+        self.filename = filename
+        if filename is None:
+            self.table = np.full(codec.nb_states, np.nan, dtype=dtype)
+        elif os.path.exists(filename):
+            self.table = np.load(filename, mmap_mode='r+')
+            if self.table.shape != (codec.nb_states,):
+                raise RuntimeError("The file does not hold a value table for these states")
+        else:
+            self.table = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=(codec.nb_states,))
+            self.table[:] = np.nan
+
+    @staticmethod
+    def for_env(env: TetrisEnv, filename: str = None, dtype=np.float32):
+        """
+        :return: an empty DenseValueTable for the states of env, with keys as its encoded states
+        """
+        return DenseValueTable(env.codec, env.compact_states, filename, dtype)
+
+    @staticmethod
+    def from_dict(value_function: dict, codec: StateCodec, compact_keys: bool = False, filename: str = None,
+                  dtype=np.float32):
+        """
+        :param value_function: a dict value function, with states as tuples or as codes. Other keys are left out.
+        :return: a DenseValueTable with the same values
+        """
+        table = DenseValueTable(codec, compact_keys, filename, dtype)
+        table.update({key: value for key, value in value_function.items()
+                      if isinstance(key, (int, np.integer)) or codec.is_state(key)})
+        return table
+
+    def _code(self, key) -> int:
+        if isinstance(key, tuple):
+            return self.codec.encode(key)
+        return key
+
+    def _key(self, code: int):
+        return code if self.compact_keys else self.codec.decode(code)
+
+    def get(self, key, default: float = None):
+        value = self.table[self._code(key)]
+        return default if value != value else float(value)  # NaN is the only value which differs from itself
+
+    def __getitem__(self, key) -> float:
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value: float) -> None:
+        self.table[self._code(key)] = value
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        return int(np.count_nonzero(~np.isnan(self.table)))
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self) -> list:
+        """
+        :return: the states which were given a value
+        """
+        return [self._key(code) for code in np.flatnonzero(~np.isnan(self.table)).tolist()]
+
+    def items(self) -> list:
+        codes = np.flatnonzero(~np.isnan(self.table))
+        return [(self._key(code), value) for code, value in zip(codes.tolist(), self.table[codes].tolist())]
+
+    def update(self, values: dict) -> None:
+        for key, value in values.items():
+            self.table[self._code(key)] = value
+
+    def lookup(self, states: np.ndarray, default: float = 0) -> np.ndarray:
+        """
+        :param states: an integer array of encoded states, of shape (..., length), as in TetrisEnv.all_afterstates
+        :return: an array of shape states.shape[:-1] with the value of every state, default if it has none
+        """
+        return self.lookup_codes(self.codec.encode_array(states), default)
+
+    def lookup_codes(self, codes: np.ndarray, default: float = 0) -> np.ndarray:
+        """
+        :return: an array of the shape of codes with the value of every code, default if it has none
+        """
+        values = self.table[codes]
+        return np.where(np.isnan(values), default, values)
+
+    def add(self, keys: Iterable, deltas) -> None:
+        """
+        Adds deltas[i] to the value of state keys[i], for example the TD errors times the eligibility traces of the
+        states. A state without value starts from 0. Every state may only appear once.
+        """
+        self.add_slots(np.fromiter((self._code(key) for key in keys), dtype=np.int64), deltas)
+
+    def slot(self, key) -> int:
+        """
+        :return: the position of the value of a state in the table, i.e. its code
+        """
+        return self._code(key)
+
+    def add_slots(self, slots: np.ndarray, deltas) -> None:
+        """
+        As add(), with the states given by their slot(), e.g. the slots of EligibilityTraces
+        """
+        self.table[slots] = self.lookup_codes(slots) + deltas
+
+    def flush(self) -> None:
+        """
+        Writes the values to the file of a memory-mapped table
+        """
+        if isinstance(self.table, np.memmap):
+            self.table.flush()
+
+    def __getstate__(self) -> dict:
+        # a memory-mapped table is saved with its values, so the model can be loaded without the file
+        state = dict(self.__dict__)
+        state["table"] = np.array(self.table)
+        state["filename"] = None
+        return state
+
+
+def add_values(value_function: Union[dict, DenseValueTable], keys: list, deltas: list) -> None:
+    """
+    Adds deltas[i] to the value of state keys[i] of a dict value function or a DenseValueTable, the latter all at
+    once. States without value start from 0.
+    """
+    if isinstance(value_function, DenseValueTable):
+        value_function.add(keys, deltas)
+        return
+    for key, delta in zip(keys, deltas):
+        value_function[key] = value_function.get(key, 0) + delta
+
+
+class QTable:
+    """
+    A state-action value function Q(s, a) stored in a 2-D NumPy array with a row for every extended state and a
+    column for every action. A dict, the index, gives the row of every extended state which was visited, and rows
+    are added as new states come up. It can replace the dict of dicts of the state-action models, see
+    StateValueModel: a row takes nb_actions floats instead of a dict of its own, and the greedy action of a state is
+    a single argmax over its row.
+    Pairs which were never given a value are stored as NaN, as pairs missing from a dict of dicts.
+    """
+
+    def __init__(self, nb_actions: int = 6, capacity: int = 1024, dtype=np.float32):
+        """
+        :param nb_actions: the number of actions, i.e. of columns
+        :param capacity: the number of rows allocated at first. The array doubles in size when it is full.
+        :param dtype: the floating point type of the values
+        """
+        if capacity < 1:
+            raise RuntimeError("The capacity should be at least one")
+        self.index = {}
+        self.table = np.full((capacity, nb_actions), np.nan, dtype=dtype)
+
+    @staticmethod
+    def for_env(env: TetrisEnv, capacity: int = 1024, dtype=np.float32):
+        """
+        :return: an empty QTable for the actions of env
+        """
+        return QTable(env.n_actions, capacity, dtype)
+
+    @staticmethod
+    def from_dict(value_function: dict, nb_actions: int = 6, dtype=np.float32):
+        """
+        :param value_function: a dict of dicts {state: {action: value}}
+        :return: a QTable with the same values
+        """
+        table = QTable(nb_actions, max(len(value_function), 1), dtype)
+        for state, values in value_function.items():
+            table.update(state, values)
+        return table
+
+    def _row(self, state) -> int:
+        """
+        :return: the row of a state, which is added if it is new
+        """
+        row = self.index.get(state)
+        if row is None:
+            row = len(self.index)
+            if row == len(self.table):
+                grown = np.full_like(self.table, np.nan)
+                self.table = np.concatenate([self.table, grown])
+            self.index[state] = row
+        return row
+
+    def get(self, state, action: int, default: float = 0) -> float:
+        row = self.index.get(state)
+        if row is None:
+            return default
+        value = self.table[row, action]
+        return default if value != value else float(value)  # NaN is the only value which differs from itself
+
+    def set(self, state, action: int, value: float) -> None:
+        row = self._row(state)  # first, as it may replace the table
+        self.table[row, action] = value
+
+    def has_value(self, state, action: int) -> bool:
+        return self.get(state, action, None) is not None
+
+    def update(self, state, values: dict) -> None:
+        """
+        :param values: a dict mapping actions to their new value in state
+        """
+        row = self._row(state)
+        for action, value in values.items():
+            self.table[row, action] = value
+
+    def add(self, pairs: list, deltas) -> None:
+        """
+        Adds deltas[i] to the value of the (state, action) pair pairs[i] all at once. A pair without value starts
+        from 0. Every pair may only appear once.
+        """
+        if len(pairs) == 0:
+            return
+        rows = np.fromiter((self._row(state) for state, _ in pairs), dtype=np.int64, count=len(pairs))
+        actions = np.fromiter((action for _, action in pairs), dtype=np.int64, count=len(pairs))
+        self.add_slots(rows * self.table.shape[1] + actions, deltas)
+
+    def slot(self, state, action: int) -> int:
+        """
+        :return: the position of Q(state, action) in the flattened table, which does not change when the table grows.
+                The row of the state is added if it is new.
+        """
+        return self._row(state) * self.table.shape[1] + action
+
+    def add_slots(self, slots: np.ndarray, deltas) -> None:
+        """
+        As add(), with the pairs given by their slot(), e.g. the slots of EligibilityTraces
+        """
+        values = self.table.reshape(-1)  # a view, as the table is contiguous
+        old = values[slots]
+        values[slots] = np.where(np.isnan(old), 0, old) + deltas
+
+    def best_action(self, state, action_mask: np.ndarray = None) -> Union[int, None]:
+        """
+        :param action_mask: if provided, only the actions with a nonzero mask are considered
+        :return: the action with the highest value in state, the lowest one in case of ties, or None if no (legal)
+                action of the state has a value
+        """
+        row = self.index.get(state)
+        if row is None:
+            return None
+        values = self.table[row]
+        legal = values == values  # NaN is the only value which differs from itself
+        if action_mask is not None:
+            legal &= action_mask != 0
+        values = np.where(legal, values, -np.inf)
+        best = values.argmax()
+        return None if values[best] == -np.inf else int(best)
+
+    def __contains__(self, state) -> bool:
+        return state in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def keys(self):
+        return self.index.keys()
+
+    def items(self) -> list:
+        """
+        :return: the (state, {action: value}) of every state, as in a dict of dicts
+        """
+        values = self.table[:len(self.index)].tolist()
+        return [(state, {action: value for action, value in enumerate(values[row]) if value == value})
+                for state, row in self.index.items()]
+
+    def __getstate__(self) -> dict:
+        # the unused rows are not saved
+        state = dict(self.__dict__)
+        state["table"] = self.table[:max(len(self.index), 1)].copy()
+        return state
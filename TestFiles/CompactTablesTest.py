@@ -0,0 +1,64 @@
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Models.OnPolicyMCForTetris import OnPolicyMCForTetris
+from Models.SarsaLambdaForTetris import SarsaLambdaForTetris
+from tetris_environment.state_codec import compact_pickled_tables, is_compact_table
+from tetris_environment.tetris_env import TetrisEnv
+
+# Saves and loads state-action models trained with compact states, and converts models trained with tuple states,
+# to check that the loaded models play with compact states and the same values, and that a model without values
+# plays with the default states. SarsaLambdaForTetris keys its
+# values by (piece, state), the other models by (state, piece). Run from the root of the repository.
+variant = "fourer"
+directory = tempfile.mkdtemp()
+models = [("SarsaLambdaForTetris", lambda env: SarsaLambdaForTetris(env, 0.5, 0.1, 0.9, "accumulating")),
+          ("OnPolicyMCForTetris", lambda env: OnPolicyMCForTetris(env, 0.9))]
+
+failed = []
+for name, make_model in models:
+    # a model trained with compact states
+    random.seed(0)
+    model = make_model(TetrisEnv(variant, seed=0, compact_states=True))
+    model.train(lambda n: 0.2, 20)
+    filename = os.path.join(directory, name + ".pickle")
+    model.save(filename)
+    loaded = model.__class__.load(filename)
+    if not loaded.env.compact_states:
+        failed.append(f"{name}: a saved compact model is loaded without compact states")
+    if dict(loaded.value_function) != dict(model.value_function):
+        failed.append(f"{name}: the loaded values differ from the saved ones")
+
+    # a model trained with tuple states, converted afterwards
+    random.seed(0)
+    model = make_model(TetrisEnv(variant, seed=0))
+    model.train(lambda n: 0.2, 20)
+    model.save(filename)
+    compact_filename = os.path.join(directory, name + "_compact.pickle")
+    compact_pickled_tables(filename, compact_filename, model.env.game_state.variant.board_width - 1)
+    loaded = model.__class__.load(compact_filename)
+    codec = loaded.env.codec
+    if not loaded.env.compact_states or not is_compact_table(loaded.value_function):
+        failed.append(f"{name}: a converted model is loaded without compact states")
+    if codec.compact_table(dict(model.value_function)) != dict(loaded.value_function):
+        failed.append(f"{name}: the converted values differ from the original ones")
+    print(f"{name:25} {len(model.value_function)} states checked")
+
+# an empty table may hold either kind of state, so a model without values keeps the default of TetrisEnv
+if is_compact_table({}) is not None:
+    failed.append("an empty table is taken for one kind of states")
+model = SarsaLambdaForTetris(TetrisEnv(variant), 0.5, 0.1, 0.9, "accumulating")
+model.save(filename)
+if SarsaLambdaForTetris.load(filename).env.compact_states != TetrisEnv(variant).compact_states:
+    failed.append("a model without values is not loaded with the default states")
+
+print("-------------------------")
+for message in failed:
+    print(message)
+if failed:
+    sys.exit(1)
+print("Compact models are saved, converted and loaded correctly")
@@ -0,0 +1,226 @@
+import copy
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tetris_environment.batched_tetris_engine import BatchedTetrisGame, X_OFFSET
+from tetris_environment.bitboard_tetris_engine import BitboardTetrisGame
+from tetris_environment.piece_source import PieceSource
+from tetris_environment.tetris_engine import UnrenderedTetrisGame, get_variant
+from tetris_environment.tetris_env import TetrisEnv
+
+# Plays the same games on the engines which claim to follow the rules of UnrenderedTetrisGame exactly, and reports
+# every difference. Run from the root of the repository.
+variants = ["fourer", "extended fourer", "regular"]
+seeds = range(3)
+nb_frames = 3000
+nb_pieces = 300
+
+failed = []
+
+
+def report(test: str, variant: str, seed: int, step: int, message: str) -> None:
+    # only the first difference of every game is kept, the following ones usually stem from it
+    failed.append(f"{test} ({variant}, seed {seed}, step {step}): {message}")
+
+
+def one_hot(action: int) -> list:
+    return [1 if index == action else 0 for index in range(6)]
+
+
+def new_game(game_class, variant: str, seed: int):
+    return game_class(variant, piece_source=PieceSource(get_variant(variant), 'uniform', seed))
+
+
+def compare_bitboard(variant: str, seed: int) -> None:
+    """
+    Plays random frames on the list engine and the bitboard engine and compares them after every frame
+    """
+    game = new_game(UnrenderedTetrisGame, variant, seed)
+    bitboard_game = new_game(BitboardTetrisGame, variant, seed)
+    rng = np.random.default_rng(seed)
+    for frame in range(nb_frames):
+        action = one_hot(int(rng.integers(6)))
+        result = game.frame_step(action)[1:]
+        bitboard_result = bitboard_game.frame_step(action)[1:]
+        if result != bitboard_result:
+            return report("bitboard", variant, seed, frame, f"{result} != {bitboard_result}")
+        if not np.array_equal(game.get_board_array(), bitboard_game.get_board_array()):
+            return report("bitboard", variant, seed, frame, "the boards differ")
+        if game.get_falling_piece() != bitboard_game.get_falling_piece() or \
+                game.get_column_heights() != bitboard_game.get_column_heights():
+            return report("bitboard", variant, seed, frame, "the falling pieces or column heights differ")
+
+
+def copy_to_batch(game: UnrenderedTetrisGame, batch: BatchedTetrisGame) -> None:
+    """
+    Copies the state of game into game 0 of a batch, which draws its pieces differently
+    """
+    batch.boards[0] = game.get_board_array()
+    piece = game.fallingPiece
+    batch.has_piece[0] = piece is not None
+    if piece is not None:
+        batch.shape[0] = batch.shapes.index(piece['shape'])
+        batch.rotation[0], batch.x[0], batch.y[0] = piece['rotation'], piece['x'], piece['y']
+    batch.next_shape[0] = batch.shapes.index(game.nextPiece['shape'])
+    batch.next_rotation[0] = game.nextPiece['rotation']
+    batch.avg_height[0], batch.holes[0], batch.bumpiness[0] = game.avg_height, game.holes, game.bumpiness
+    batch.score[0], batch.lines[0], batch.level[0] = game.score, game.lines, game.level
+
+
+def compare_batched(variant: str, seed: int) -> None:
+    """
+    Plays random frames on the list engine and on a batch of one game, which starts every frame from the state of
+    the list engine, and compares them after every frame
+    """
+    game = new_game(UnrenderedTetrisGame, variant, seed)
+    batch = BatchedTetrisGame(variant, 1, seed)
+    rng = np.random.default_rng(seed)
+    for frame in range(nb_frames):
+        action = int(rng.integers(6))
+        copy_to_batch(game, batch)
+        _, reward, terminal, data = game.frame_step(one_hot(action))
+        _, rewards, terminals, batch_data = batch.frame_step([action])
+        if terminals[0] != terminal or abs(rewards[0] - reward) > 1e-9:
+            return report("batched", variant, seed, frame, f"{reward, terminal} != {rewards[0], terminals[0]}")
+        if any(batch_data[key][0] != data[key] for key in ("lines_cleared", "new_piece")):
+            return report("batched", variant, seed, frame, f"{data} != {batch_data}")
+        if terminal:
+            continue  # the batch starts its next game with pieces of its own
+        piece = game.fallingPiece
+        batch_piece = (batch.rotation[0], batch.x[0], batch.y[0]) if batch.has_piece[0] else None
+        if batch_data["score"][0] != data["score"] or not np.array_equal(batch.boards[0], game.get_board_array()):
+            return report("batched", variant, seed, frame, "the scores or boards differ")
+        if batch_piece != (None if piece is None else (piece['rotation'], piece['x'], piece['y'])):
+            return report("batched", variant, seed, frame, "the falling pieces differ")
+
+
+def game_result(game: UnrenderedTetrisGame, reward: float, terminal: bool, data: dict) -> tuple:
+    return (round(reward, 9), terminal, data["score"], data["lines_cleared"], game.get_board_array().tobytes(),
+            game.fallingPiece, game.nextPiece, game.score, game.lines)
+
+
+def play_actions(game: UnrenderedTetrisGame, actions: list, rotation: int, x: int):
+    """
+    Plays the frames of the actions of a placement, followed by a frame without action to start the next piece
+    :return: the game_result() of these frames, or None if the piece landed before it reached its rotation and x or
+            did not land with the final drop
+    """
+    piece = game.fallingPiece
+    reward, score, lines = 0, 0, 0
+    for index, action in enumerate(actions + [0]):
+        _, frame_reward, terminal, data = game.frame_step(one_hot(action))
+        reward, score, lines = reward + frame_reward, score + data["score"], lines + data["lines_cleared"]
+        if index < len(actions) - 1 and (game.fallingPiece is not piece or terminal):
+            return None
+        if index == len(actions) - 1:
+            if game.fallingPiece is not None or (piece['rotation'], piece['x']) != (rotation, x):
+                return None
+    return game_result(game, reward, terminal, {"score": score, "lines_cleared": lines})
+
+
+def compare_place(variant: str, seed: int) -> None:
+    """
+    Places random pieces with place() and checks on both engines that
+    - the frames of the actions of the placement give the same result;
+    - make_placement() gives the same board, and unmake_placement() restores the game exactly;
+    - the batched engine finds the same legal placements.
+    """
+    for game_class in (UnrenderedTetrisGame, BitboardTetrisGame):
+        test = f"place ({game_class.__name__})"
+        game = new_game(game_class, variant, seed)
+        batch = BatchedTetrisGame(variant, 1, seed)
+        rng = np.random.default_rng(seed)
+        for piece in range(nb_pieces):
+            if game.fallingPiece is None:
+                game.frame_step(one_hot(0))
+                continue
+            snapshot, piece_source = game.snapshot(), copy.deepcopy(game.piece_source)
+            placements = game.legal_placements()
+            copy_to_batch(game, batch)
+            legal = batch.afterstates()[0][0]
+            if sorted(placements) != [(rotation, x - X_OFFSET) for rotation, x in zip(*np.nonzero(legal))]:
+                return report(test, variant, seed, piece, "the batched engine finds other legal placements")
+            if not placements:
+                game.frame_step(one_hot(0))
+                continue
+            rotation, x = placements[rng.integers(len(placements))]
+
+            actions = game.placement_actions(rotation, x)
+            path_result = play_actions(game, actions, rotation, x)
+            game.restore(snapshot)
+            game.piece_source = copy.deepcopy(piece_source)
+
+            game.make_placement(rotation, x)
+            board = game.get_board_array()
+            game.unmake_placement()
+            if game.snapshot() != snapshot:
+                return report(test, variant, seed, piece, "unmake_placement() does not restore the game")
+
+            result = game_result(game, *game.place(rotation, x))
+            if path_result is None:
+                return report(test, variant, seed, piece, f"the frames of {actions} do not reach {rotation, x}")
+            if path_result != result:
+                return report(test, variant, seed, piece, f"the frames of {actions} give another result")
+            # a game over starts a new board, and the next piece may have landed in its first frame
+            terminal = result[1]
+            if not terminal and game.fallingPiece is not None and not np.array_equal(game.get_board_array(), board):
+                return report(test, variant, seed, piece, "make_placement() gives another board")
+
+
+def compare_afterstates(variant: str, seed: int) -> None:
+    """
+    Plays random placements in a TetrisEnv on both engines and checks that all_afterstates() finds the same
+    placements, afterstates, boards, rewards, cleared lines and actions as all_possible_placements() with
+    make_placement()
+    """
+    for bitboard in (False, True):
+        test = f"all_afterstates ({'bitboard' if bitboard else 'list'} engine)"
+        env = TetrisEnv(variant, bitboard=bitboard, cache_size=0, piece_mode='uniform', seed=seed)
+        env.reset()
+        game = env.game_state
+        rng = np.random.default_rng(seed)
+        for piece in range(nb_pieces):
+            expected = {}
+            for state, actions, placement in env.all_possible_placements():
+                reward, lines_cleared = game.make_placement(*placement)
+                expected[placement] = (state, actions, round(reward, 9), lines_cleared,
+                                       game.get_board_array().tobytes())
+                game.unmake_placement()
+            placements, boards, states, rewards, lines_cleared, actions = env.all_afterstates()
+            found = {tuple(placement): (tuple(state), placement_actions, round(reward, 9), cleared, board.tobytes())
+                     for placement, state, placement_actions, reward, cleared, board
+                     in zip(placements.tolist(), states.tolist(), actions, rewards.tolist(), lines_cleared.tolist(),
+                            boards)}
+            if found.keys() != expected.keys():
+                return report(test, variant, seed, piece, f"placements {sorted(found.keys() ^ expected.keys())} "
+                                                          f"are found by only one of them")
+            differences = [placement for placement in expected if found[placement] != expected[placement]]
+            if differences:
+                return report(test, variant, seed, piece, f"the afterstate of placement {differences[0]} differs")
+            if expected:
+                env.place(*sorted(expected)[rng.integers(len(expected))])
+            else:
+                env.step(env.no_move)
+
+
+if __name__ == "__main__":
+    checks = [("list and bitboard engines, frame by frame", compare_bitboard),
+              ("list and batched engines, frame by frame", compare_batched),
+              ("place() against frames and make_placement()", compare_place),
+              ("all_afterstates() against make_placement()", compare_afterstates)]
+    for name, run in checks:
+        for variant in variants:
+            for seed in seeds:
+                run(variant, seed)
+        print(f"{name:55} {len(variants) * len(seeds)} games")
+
+    print("-------------------------")
+    for message in failed:
+        print(message)
+    if failed:
+        sys.exit(1)
+    print("All engines agree")
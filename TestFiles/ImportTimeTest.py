@@ -0,0 +1,41 @@
+import json
+import os
+import subprocess
+import sys
+from statistics import median
+
+# Measures how long the headless modules take to import in a fresh interpreter, as every short-lived worker has to,
+# and checks that they do not import rendering, plotting or pandas. Run from the root of the repository.
+upper_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+nb_runs = 5
+heavy_modules = ["pygame", "matplotlib", "pandas"]
+headless_modules = ["tetris_environment.tetris_env", "tetris_environment.tetris_vector_env",
+                    "Evaluation.Evaluate_policy", "Models.SarsaZeroAfterstates", "Models.SarsaLambdaForTetris"]
+
+# the import is timed inside the interpreter, so the start-up of python itself is not counted
+script = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"time": elapsed, "heavy": [name for name in {heavy} if name in sys.modules]}}))
+"""
+
+failed = []
+for module in ["gym"] + headless_modules:
+    times = []
+    for _ in range(nb_runs):
+        output = subprocess.run([sys.executable, "-c", script.format(module=module, heavy=heavy_modules)],
+                                cwd=upper_dir, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        times.append(result["time"])
+    print(f"{module:40} {1000 * median(times):8.1f} ms")
+    if result["heavy"]:
+        failed.append((module, result["heavy"]))
+
+print("-------------------------")
+for module, heavy in failed:
+    print(f"{module} imports {', '.join(heavy)}")
+if failed:
+    sys.exit(1)
+print("No headless module imports " + ", ".join(heavy_modules))
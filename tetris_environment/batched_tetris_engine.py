@@ -0,0 +1,441 @@
+import numpy as np
+
+from tetris_environment.tetris_engine import get_variant, get_placement_actions, MOVE_LEFT, MOVE_RIGHT, \
+    ROTATE_CLOCKWISE, ROTATE_COUNTERCLOCKWISE
+from tetris_environment.board_arrays import LINE_SCORES, ALPHA, BETA, GAMMA, clear_lines, board_features, \
+    encode_heights
+
+# piece['x'] of a placement ranges over [-X_OFFSET, board_width + X_OFFSET), as in TetrisEnv.all_possible_placements
+X_OFFSET = 4
+
+
+class BatchedTetrisGame:
+    """
+    Plays nb_games games of Tetris in lockstep. All boards are stored in one boolean array of shape
+    (nb_games, board_height, board_width) with row 0 at the top, and the falling pieces in arrays of length nb_games.
+    Every call applies a vector of actions or placements to all games at once. Games which end are reset
+    automatically.
+
+    The rules are those of UnrenderedTetrisGame. Colors are not stored.
+    """
+
+    def __init__(self, type, nb_games: int, seed: int = None):
+        """
+        :param type: the Tetris variant, see UnrenderedTetrisGame
+        :param nb_games: the number of games played simultaneously
+        :param seed: seed for the random piece generator
+        """
+        variant = get_variant(type)
+
+        self.type = variant.name
+        self.board_width = variant.board_width
+        self.board_height = variant.board_height
+        self.nb_games = nb_games
+        self.shapes = list(variant.shapes)
+        self.rng = np.random.default_rng(seed)
+
+        # the cells of every piece, indexed by [shape, rotation, cell]. Shapes with fewer rotations or cells are
+        # padded by repeating their rotations and cells, which does not change collisions or locking.
+        geometry = variant.geometry
+        self.nb_rotations = np.array([len(geometry[shape]) for shape in self.shapes])
+        max_rotations = self.nb_rotations.max()
+        max_cells = max(len(rotation.cells) for shape in self.shapes for rotation in geometry[shape])
+        self.cells_x = np.zeros((len(self.shapes), max_rotations, max_cells), dtype=int)
+        self.cells_y = np.zeros((len(self.shapes), max_rotations, max_cells), dtype=int)
+        for s, shape in enumerate(self.shapes):
+            for r in range(max_rotations):
+                cells = geometry[shape][r % len(geometry[shape])].cells
+                for c in range(max_cells):
+                    self.cells_x[s, r, c], self.cells_y[s, r, c] = cells[c % len(cells)]
+        self.spawn_x = variant.spawn_x
+        self.geometry = variant.geometry
+
+        # the actions of the placements of every (shape, rotation, x) a piece started from, see _plans()
+        self.plans = {}
+        self.plan_length = max_rotations // 2 + self.board_width + 2 * X_OFFSET
+
+        self.boards = np.zeros((nb_games, self.board_height, self.board_width), dtype=bool)
+        self.shape = np.zeros(nb_games, dtype=int)
+        self.rotation = np.zeros(nb_games, dtype=int)
+        self.x = np.zeros(nb_games, dtype=int)
+        self.y = np.zeros(nb_games, dtype=int)
+        self.has_piece = np.zeros(nb_games, dtype=bool)
+        self.next_shape = np.zeros(nb_games, dtype=int)
+        self.next_rotation = np.zeros(nb_games, dtype=int)
+
+        # For calculation of reward
+        self.avg_height = np.zeros(nb_games)
+        self.holes = np.zeros(nb_games, dtype=int)
+        self.bumpiness = np.zeros(nb_games)
+
+        # statistics of the current episode of every game
+        self.score = np.zeros(nb_games, dtype=int)
+        self.lines = np.zeros(nb_games, dtype=int)
+        self.level = np.ones(nb_games, dtype=int)
+        self.pieces = np.zeros(nb_games, dtype=int)
+
+        # games which are not active are left untouched by every step
+        self.active = np.ones(nb_games, dtype=bool)
+
+        self.reset()
+
+    def reset(self) -> np.ndarray:
+        """
+        Resets all games to an empty board
+        :return: the encoded states of all games
+        """
+        self._reinit(np.arange(self.nb_games))
+        return self.get_encoded_states()
+
+    def _reinit(self, games: np.ndarray) -> None:
+        """
+        Re-initializes the given games to an empty board with a new falling piece, which has already fallen one row
+        """
+        self.boards[games] = False
+        self.avg_height[games] = 0
+        self.holes[games] = 0
+        self.bumpiness[games] = 0
+        self.score[games] = 0
+        self.lines[games] = 0
+        self.level[games] = 1
+        self.pieces[games] = 0
+
+        self._new_pieces(games)
+        self._spawn(games)
+        self.y[games] = 1  # there is always room to fall on an empty board
+
+    def _new_pieces(self, games: np.ndarray) -> None:
+        # a random new piece in a random rotation
+        self.next_shape[games] = self.rng.integers(0, len(self.shapes), size=len(games))
+        self.next_rotation[games] = (self.rng.random(len(games)) *
+                                     self.nb_rotations[self.next_shape[games]]).astype(int)
+
+    def _spawn(self, games: np.ndarray) -> np.ndarray:
+        """
+        Starts the next piece at the top of the given games
+        :return: a boolean array indicating for every given game whether the new piece collides, i.e. game over
+        """
+        self.shape[games] = self.next_shape[games]
+        self.rotation[games] = self.next_rotation[games]
+        self.x[games] = self.spawn_x
+        self.y[games] = 0
+        self.has_piece[games] = True
+        self._new_pieces(games)
+        return self._collides(games, self.shape[games], self.rotation[games], self.x[games], self.y[games])
+
+    def _collides(self, games, shape, rotation, x, y) -> np.ndarray:
+        """
+        Array version of (not UnrenderedTetrisGame.is_valid_position). All arguments are broadcast together.
+        :param games: the indices of the games whose boards are checked
+        :return: a boolean array, True where the piece is outside the board or overlaps a filled cell
+        """
+        games, shape, rotation, x, y = np.broadcast_arrays(games, shape, rotation, x, y)
+        xs = x[..., None] + self.cells_x[shape, rotation]
+        ys = y[..., None] + self.cells_y[shape, rotation]
+        on_board = ys >= 0  # cells above the board never collide
+        outside = (xs < 0) | (xs >= self.board_width) | (ys >= self.board_height)
+        filled = self.boards[games[..., None],
+                             np.clip(ys, 0, self.board_height - 1), np.clip(xs, 0, self.board_width - 1)]
+        return ((outside | filled) & on_board).any(axis=-1)
+
+    def _drop_distance(self, games, shape, rotation, x, y) -> np.ndarray:
+        """
+        Computes how many rows every given piece can move down before it lands. Pieces above the stack in all of
+        their columns land as follows from the column heights, pieces below an overhang are moved down row by row.
+        :return: an array with the drop distance of every given piece
+        """
+        games, shape, rotation, x, y = np.broadcast_arrays(games, shape, rotation, x, y)
+        heights = self.get_column_heights()
+        columns = np.clip(x[..., None] + self.cells_x[shape, rotation], 0, self.board_width - 1)
+        landing_y = (self.board_height - 1 - heights[games[..., None], columns] -
+                     self.cells_y[shape, rotation]).min(axis=-1)
+        distance = landing_y - y
+
+        under = distance < 0
+        if under.any():
+            distance[under] = 0
+            falling = under
+            for i in range(1, self.board_height):
+                falling &= ~self._collides(games, shape, rotation, x, y + i)
+                if not falling.any():
+                    break
+                distance += falling
+        return distance
+
+    def _lock(self, games: np.ndarray) -> tuple:
+        """
+        Adds the falling pieces of the given games to their boards, removes complete lines and updates the
+        statistics of those games
+        :return: a tuple (reward, lines_cleared, score) of arrays for the given games
+        """
+        xs = self.x[games, None] + self.cells_x[self.shape[games], self.rotation[games]]
+        ys = self.y[games, None] + self.cells_y[self.shape[games], self.rotation[games]]
+        self.boards[games[:, None], ys, xs] = True
+        self.has_piece[games] = False
+
+        boards, cleared = clear_lines(self.boards[games])
+        self.boards[games] = boards
+        score = LINE_SCORES[cleared] * self.level[games] + self.y[games]
+        self.score[games] += score
+        self.lines[games] += cleared
+        self.level[games] = np.minimum(self.lines[games] // 10 + 1, 10)
+        self.pieces[games] += 1
+
+        _, holes, avg_height, bumpiness = board_features(boards)
+        reward = ALPHA * (self.avg_height[games] - avg_height) + BETA * (self.holes[games] - holes) + \
+            GAMMA * (self.bumpiness[games] - bumpiness)
+        self.avg_height[games] = avg_height
+        self.holes[games] = holes
+        self.bumpiness[games] = bumpiness
+        return reward, cleared, score
+
+    def truncate(self, games) -> dict:
+        """
+        Ends the episodes of the given games without game over, e.g. because they reached a limit on their length,
+        and starts them over on an empty board
+        :param games: the indices of the games to truncate
+        :return: a dict as the data of frame_step, in which "episode_score", "episode_lines" and "episode_pieces"
+                hold the statistics of the truncated episodes
+        """
+        data = self._new_data()
+        self._end_episodes(np.asarray(games, dtype=int), data)
+        return data
+
+    def _end_episodes(self, games: np.ndarray, data: dict) -> None:
+        # store the statistics of the finished episodes, then start over
+        data["episode_score"][games] = self.score[games]
+        data["episode_lines"][games] = self.lines[games]
+        data["episode_pieces"][games] = self.pieces[games]
+        self._reinit(games)
+
+    def _new_data(self) -> dict:
+        return {"score": np.zeros(self.nb_games, dtype=int),
+                "lines_cleared": np.zeros(self.nb_games, dtype=int),
+                "new_piece": np.zeros(self.nb_games, dtype=bool),
+                "episode_score": np.zeros(self.nb_games, dtype=int),
+                "episode_lines": np.zeros(self.nb_games, dtype=int),
+                "episode_pieces": np.zeros(self.nb_games, dtype=int)}
+
+    def frame_step(self, actions) -> tuple:
+        """
+        Array version of UnrenderedTetrisGame.frame_step
+        :param actions: an array of nb_games action numbers, using the numbering of TetrisEnv
+        :return: a 4-tuple (None, rewards, terminals, data). data holds the arrays "score", "lines_cleared" and
+                "new_piece" as in UnrenderedTetrisGame. For terminal games, "episode_score", "episode_lines" and
+                "episode_pieces" hold the statistics of the episode which just ended.
+        """
+        actions = np.asarray(actions)
+        rewards = np.zeros(self.nb_games)
+        terminals = np.zeros(self.nb_games, dtype=bool)
+        data = self._new_data()
+
+        # No falling piece in play, so start a new piece at the top
+        games = np.flatnonzero(self.active & ~self.has_piece)
+        data["new_piece"][games] = True
+        over = games[self._spawn(games)]
+        terminals[over] = True
+        rewards[over] = -1000  # penalty for game over
+        self._end_episodes(over, data)
+
+        playing = self.active & ~terminals
+
+        # moving the piece sideways. A move is repeated once if there is room for it.
+        for action, step in ((1, -1), (3, 1)):
+            games = np.flatnonzero(playing & (actions == action))
+            for _ in range(2):
+                games = games[~self._collides(games, self.shape[games], self.rotation[games],
+                                              self.x[games] + step, self.y[games])]
+                self.x[games] += step
+
+        # rotating the piece (if there is room to rotate)
+        for action, step in ((2, 1), (5, -1)):
+            games = np.flatnonzero(playing & (actions == action))
+            rotation = (self.rotation[games] + step) % self.nb_rotations[self.shape[games]]
+            fits = ~self._collides(games, self.shape[games], rotation, self.x[games], self.y[games])
+            self.rotation[games[fits]] = rotation[fits]
+
+        # move the current piece all the way down. A piece never drops more than board_height - 2 rows at once.
+        games = np.flatnonzero(playing & (actions == 4))
+        distance = self._drop_distance(games, self.shape[games], self.rotation[games], self.x[games], self.y[games])
+        self.y[games] += np.minimum(distance, self.board_height - 2)
+
+        # let the piece fall, or set it on the board if it has landed
+        games = np.flatnonzero(playing)
+        landed = self._collides(games, self.shape[games], self.rotation[games], self.x[games], self.y[games] + 1)
+        self.y[games[~landed]] += 1
+        games = games[landed]
+        rewards[games], data["lines_cleared"][games], data["score"][games] = self._lock(games)
+
+        return None, rewards, terminals, data
+
+    def place(self, rotations, xs) -> tuple:
+        """
+        Drops the falling piece of every active game with the given rotation and x and locks it, then starts the
+        next piece. A new piece which has no room to fall is locked immediately, as it would be in its first
+        frame, and the next piece is started.
+        :param rotations: an array of nb_games rotations
+        :param xs: an array of nb_games values for piece['x']
+        :return: a 4-tuple (states, rewards, terminals, data) as in frame_step, where states are the encoded
+                states after every placement. Rewards include the game over penalty of games which ended.
+        :raise RuntimeError if a placement is illegal for the current piece of its game, see afterstates()
+        """
+        rotations = np.asarray(rotations)
+        xs = np.asarray(xs)
+        rewards = np.zeros(self.nb_games)
+        terminals = np.zeros(self.nb_games, dtype=bool)
+        data = self._new_data()
+
+        games = np.flatnonzero(self.active & ~self.has_piece)
+        self._start_pieces(games, rewards, terminals, data)
+
+        games = np.flatnonzero(self.active & ~terminals)
+        shape = self.shape[games]
+        if np.any(rotations[games] >= self.nb_rotations[shape]) or \
+                np.any(self._collides(games, shape, rotations[games], xs[games], self.y[games])):
+            raise RuntimeError("Illegal placement")
+        ys = self.y[games] + self._drop_distance(games, shape, rotations[games], xs[games], self.y[games])
+        if not self._reached(games, rotations[games], xs[games], ys).all():
+            raise RuntimeError("Illegal placement")
+        self.rotation[games] = rotations[games]
+        self.x[games] = xs[games]
+        self.y[games] = ys
+        rewards[games], data["lines_cleared"][games], data["score"][games] = self._lock(games)
+
+        states = self.get_encoded_states()
+        self._start_pieces(games, rewards, terminals, data)
+        return states, rewards, terminals, data
+
+    def _start_pieces(self, games: np.ndarray, rewards, terminals, data) -> None:
+        """
+        Starts the next piece in the given games and lets it fall one row, locking it where it is if it has no room
+        to fall. Games which end are reset. Rewards, terminals and data are updated in place.
+        """
+        while len(games) > 0:
+            data["new_piece"][games] = True
+            over = self._spawn(games)
+            terminals[games[over]] = True
+            rewards[games[over]] += -1000  # penalty for game over
+            self._end_episodes(games[over], data)
+
+            games = games[~over]
+            landed = self._collides(games, self.shape[games], self.rotation[games], self.x[games], self.y[games] + 1)
+            self.y[games[~landed]] += 1
+            games = games[landed]
+            reward, cleared, score = self._lock(games)
+            rewards[games] += reward
+            data["lines_cleared"][games] += cleared
+            data["score"][games] += score
+
+    def afterstates(self) -> tuple:
+        """
+        Simulates every placement (rotation, x) of the falling piece of every active game
+        :return: a 4-tuple of arrays (legal, states, rewards, lines_cleared), indexed by [game, rotation, x + X_OFFSET].
+                legal indicates which placements are legal, see UnrenderedTetrisGame.is_legal_placement, states holds the encoded afterstates, rewards the
+                reward of every placement and lines_cleared the number of lines it clears. Values for illegal
+                placements are zero.
+        """
+        nb_rotations = self.cells_x.shape[1]
+        nb_xs = self.board_width + 2 * X_OFFSET
+        grid = (self.nb_games, nb_rotations, nb_xs)
+        games, rotations, xs = np.indices(grid)
+        xs -= X_OFFSET
+        shape = self.shape[games]
+
+        legal = (self.active & self.has_piece)[games] & (rotations < self.nb_rotations[shape])
+        legal[legal] = ~self._collides(games[legal], shape[legal], rotations[legal], xs[legal],
+                                       self.y[games[legal]])
+
+        # of these, only the placements which the frames of their actions reach are legal
+        games, shape, rotations, xs = games[legal], shape[legal], rotations[legal], xs[legal]
+        ys = self.y[games] + self._drop_distance(games, shape, rotations, xs, self.y[games])
+        reached = self._reached(games, rotations, xs, ys)
+        legal[legal] = reached
+
+        # simulate only the legal placements
+        games, shape, rotations, xs, ys = games[reached], shape[reached], rotations[reached], xs[reached], ys[reached]
+        boards = self.boards[games]
+        cells = np.arange(len(games))[:, None]
+        boards[cells, ys[:, None] + self.cells_y[shape, rotations], xs[:, None] + self.cells_x[shape, rotations]] = True
+        boards, cleared = clear_lines(boards)
+        heights, holes, avg_height, bumpiness = board_features(boards)
+
+        states = np.zeros(grid + (self.board_width - 1,), dtype=np.int8)
+        rewards = np.zeros(grid)
+        lines_cleared = np.zeros(grid, dtype=int)
+        states[legal] = encode_heights(heights)
+        rewards[legal] = ALPHA * (self.avg_height[games] - avg_height) + BETA * (self.holes[games] - holes) + \
+            GAMMA * (self.bumpiness[games] - bumpiness)
+        lines_cleared[legal] = cleared
+        return legal, states, rewards, lines_cleared
+
+    def _plans(self, shape: int, rotation: int, x: int) -> np.ndarray:
+        """
+        :return: the actions of every placement of a piece of the given shape, which starts at rotation and x, up to
+                the final drop (see UnrenderedTetrisGame.placement_actions). The array is indexed by
+                [rotation, x + X_OFFSET, frame] and padded with -1.
+        """
+        key = (shape, rotation, x)
+        if key not in self.plans:
+            geometries = self.geometry[self.shapes[shape]]
+            piece = {'shape': self.shapes[shape], 'rotation': rotation, 'x': x}
+            plans = np.full((self.cells_x.shape[1], self.board_width + 2 * X_OFFSET, self.plan_length), -1)
+            for target_rotation, geometry in enumerate(geometries):
+                for target_x in range(-X_OFFSET, self.board_width + X_OFFSET):
+                    actions = get_placement_actions(piece, dict(piece, rotation=target_rotation, x=target_x),
+                                                    len(geometries), geometry.x_range(self.board_width))[:-1]
+                    plans[target_rotation, target_x + X_OFFSET, :len(actions)] = actions
+            self.plans[key] = plans
+        return self.plans[key]
+
+    def _reached(self, games: np.ndarray, rotations: np.ndarray, xs: np.ndarray, landing_ys: np.ndarray) -> np.ndarray:
+        """
+        Array version of UnrenderedTetrisGame.is_legal_placement: follows the falling pieces through the frames of
+        the actions of the given placements, as frame_step plays them
+        :param games, rotations, xs: the placements, in which the falling piece of every game fits at its height
+        :param landing_ys: the y where every piece lands when dropped from its height with the rotation and x
+        :return: a boolean array indicating for every placement whether the piece gets there without landing on the
+                way, above landing_ys
+        """
+        if len(games) == 0:
+            return np.zeros(0, dtype=bool)
+        unique, inverse = np.unique(games, return_inverse=True)
+        plans = np.stack([self._plans(*start) for start in zip(self.shape[unique].tolist(),
+                                                                self.rotation[unique].tolist(),
+                                                                self.x[unique].tolist())])
+        plans = plans[inverse, rotations, xs + X_OFFSET]
+
+        shape = self.shape[games]
+        rotation, x, y = self.rotation[games], self.x[games], self.y[games]
+        moving = np.ones(len(games), dtype=bool)
+        blocked = np.zeros(len(games), dtype=bool)
+        for frame in range(int((plans >= 0).sum(axis=1).max(initial=0))):
+            actions = plans[:, frame]
+            moving &= actions >= 0
+            for action, step in ((MOVE_LEFT, -1), (MOVE_RIGHT, 1)):
+                pressed = np.flatnonzero(moving & (actions == action))
+                for _ in range(2):
+                    pressed = pressed[~self._collides(games[pressed], shape[pressed], rotation[pressed],
+                                                      x[pressed] + step, y[pressed])]
+                    x[pressed] += step
+            for action, step in ((ROTATE_CLOCKWISE, 1), (ROTATE_COUNTERCLOCKWISE, -1)):
+                pressed = np.flatnonzero(moving & (actions == action))
+                turned = (rotation[pressed] + step) % self.nb_rotations[shape[pressed]]
+                fits = ~self._collides(games[pressed], shape[pressed], turned, x[pressed], y[pressed])
+                rotation[pressed[fits]] = turned[fits]
+
+            # the piece falls a row every frame, unless it lands on the way
+            falling = np.flatnonzero(moving)
+            landed = self._collides(games[falling], shape[falling], rotation[falling], x[falling], y[falling] + 1)
+            y[falling[~landed]] += 1
+            blocked[falling[landed]] = True
+            moving &= ~blocked
+        return ~blocked & (rotation == rotations) & (x == xs) & (y <= landing_ys)
+
+    def get_column_heights(self) -> np.ndarray:
+        return board_features(self.boards)[0]
+
+    def get_encoded_states(self) -> np.ndarray:
+        """
+        :return: the encoded state (see TetrisEnv.get_encoded_state) of every game, of shape (nb_games, board_width - 1)
+        """
+        return encode_heights(self.get_column_heights())
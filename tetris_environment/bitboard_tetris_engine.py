@@ -0,0 +1,159 @@
+from array import array
+
+import numpy as np
+
+from tetris_environment.tetris_engine import *
+
+
+def row_typecode(board_width: int) -> str:
+    """
+    :return: the array typecode of the rows of a bitboard of the given width
+    :raise RuntimeError if the rows do not fit in 16 bits
+    """
+    if board_width > 16:
+        raise RuntimeError("The bitboard engine only supports boards of at most 16 columns")
+    return 'B' if board_width <= 8 else 'H'
+
+
+class BitboardTetrisGame(UnrenderedTetrisGame):
+    """
+    A Tetris game storing every row of the board as an integer bitmask: bit x of self.board[y] is set when the cell
+    in column x and row y is filled. Colors are not stored. Collision is a shifted AND, a complete line equals the
+    full mask and copying the board is a single array copy.
+    Only these operations are faster. Most of the time of a frame goes to the logic of frame_step and to the reward
+    features, which are shared with UnrenderedTetrisGame, so a frame is only about 1.1 to 1.3 times faster than with
+    the list engine, on the 4-wide boards as well, and place() with all_possible_placements() about 1.1 to 1.2 times.
+    The order of magnitude once aimed for on the 4-wide boards is not reached.
+    """
+
+    def __init__(self, type: str, board=None, headless: bool = True, piece_source: PieceSource = None):
+        """
+        :param type: see UnrenderedTetrisGame
+        :param board: either an array of row bitmasks or a column-major board as used by UnrenderedTetrisGame
+        :param headless: see UnrenderedTetrisGame
+        :param piece_source: see UnrenderedTetrisGame
+        :raise RuntimeError if the board is wider than 16 columns
+        """
+        if board is not None and not isinstance(board, array):
+            board = self.rows_from_columns(board)
+        super().__init__(type, board, headless, piece_source)
+
+    def reinit(self, board=None):
+        """
+        See UnrenderedTetrisGame.reinit. The board can be given in either format of the constructor.
+        """
+        if board is not None and not isinstance(board, array):
+            board = self.rows_from_columns(board)
+        super().reinit(board)
+
+    def _compile_pieces(self):
+        super()._compile_pieces()
+        self.full_row = (1 << self.board_width) - 1
+        self.typecode = row_typecode(self.board_width)
+
+    @staticmethod
+    def rows_from_columns(columns) -> array:
+        """
+        Converts a column-major board of BLANK/color cells to an array of row bitmasks
+        """
+        rows = array(row_typecode(len(columns)), [0] * len(columns[0]))
+        for x, column in enumerate(columns):
+            for y, cell in enumerate(column):
+                if cell != BLANK:
+                    rows[y] |= 1 << x
+        return rows
+
+    def get_board_columns(self) -> list:
+        """
+        :return: the board in the column-major format of UnrenderedTetrisGame, with every filled cell colored 0
+        """
+        return [[0 if row >> x & 1 else BLANK for row in self.board] for x in range(self.board_width)]
+
+    def get_board_array(self) -> np.ndarray:
+        rows = np.frombuffer(self.board, dtype=np.uint8 if self.typecode == 'B' else np.uint16)
+        return (rows[:, None] >> np.arange(self.board_width) & 1).astype(bool)
+
+    def copy_board(self) -> array:
+        return array(self.typecode, self.board)
+
+    def restore_board(self, board) -> None:
+        self.board[:] = board
+
+    def get_blank_board(self):
+        self.board = array(self.typecode, [0] * self.board_height)
+        return self.board
+
+    def is_valid_position(self, adjX=0, adjY=0, piece=None):
+        if piece is None:
+            piece = self.fallingPiece
+        geometry = self.geometry[piece['shape']][piece['rotation']]
+        x = piece['x'] + adjX
+        if x + geometry.min_x < 0 or x + geometry.max_x >= self.board_width:
+            return False
+        shift = x + geometry.min_x
+        top = piece['y'] + adjY
+        board = self.board
+        for y, mask in geometry.row_masks:
+            y += top
+            if y < 0:
+                continue
+            if y >= self.board_height or board[y] & (mask << shift):
+                return False
+        return True
+
+    def _translation_bits(self, piece: dict) -> int:
+        # checks the moves to the left, to the right and down in one pass over the rows of the piece
+        geometry = self.geometry[piece['shape']][piece['rotation']]
+        shift = piece['x'] + geometry.min_x
+        left = shift > 0
+        right = piece['x'] + geometry.max_x < self.board_width - 1
+        down = True
+        top = piece['y']
+        board = self.board
+        for y, mask in geometry.row_masks:
+            y += top
+            row = mask << shift
+            if y >= 0:
+                filled = board[y]
+                if filled & row >> 1:
+                    left = False
+                if filled & row << 1:
+                    right = False
+            if y + 1 >= self.board_height or (y >= -1 and board[y + 1] & row):
+                down = False
+        return left << 1 | right << 3 | down << 4
+
+    def add_to_board(self):
+        geometry = self.geometry[self.fallingPiece['shape']][self.fallingPiece['rotation']]
+        shift = self.fallingPiece['x'] + geometry.min_x
+        top = self.fallingPiece['y']
+        for y, mask in geometry.row_masks:
+            self.board[top + y] |= mask << shift
+
+    def is_complete_line(self, y):
+        return self.board[y] == self.full_row
+
+    def remove_complete_lines(self):
+        kept = [row for row in self.board if row != self.full_row]
+        num_lines_removed = self.board_height - len(kept)
+        if num_lines_removed > 0:
+            self.board[:] = array(self.typecode, [0] * num_lines_removed + kept)
+        return num_lines_removed
+
+    def compute_features(self):
+        self.column_heights = [0] * self.board_width
+        self.column_cells = [0] * self.board_width
+        self.board_hash = 0
+        for y, row in enumerate(self.board):
+            while row:
+                lowest = row & -row
+                x = lowest.bit_length() - 1
+                if self.column_heights[x] == 0:
+                    self.column_heights[x] = self.board_height - y
+                self.column_cells[x] += 1
+                self.board_hash ^= self.variant.zobrist_keys[x][y]
+                row ^= lowest
+        self.features_changed = True
+
+    def is_on_board(self, x, y):
+        return 0 <= x < self.board_width and y < self.board_height
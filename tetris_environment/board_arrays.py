@@ -0,0 +1,99 @@
+import numpy as np
+
+# score for clearing 0, 1, 2, 3 or 4 lines at once, before multiplying with the level
+LINE_SCORES = np.array([0, 40, 100, 300, 1200])
+
+# Parameters of the reward as used in UnrenderedTetrisGame.get_reward
+ALPHA = 5
+BETA = 10
+GAMMA = 1
+
+
+def clear_lines(boards: np.ndarray) -> tuple:
+    """
+    Removes all complete lines and moves everything above them down.
+    :param boards: a boolean array of shape (..., board_height, board_width)
+    :return: the new boards and the number of lines cleared on every board
+    """
+    full = boards.all(axis=-1)
+    cleared = full.sum(axis=-1)
+    changed = cleared > 0
+    if not changed.any():
+        return boards, cleared
+
+    # sort the complete lines to the top, keeping the order of all other lines, then blank them
+    height = boards.shape[-2]
+    order = np.argsort(np.where(full[changed], -1, np.arange(height)), axis=-1, kind='stable')
+    sorted_boards = np.take_along_axis(boards[changed], order[..., None], axis=-2)
+    sorted_boards &= (np.arange(height) >= cleared[changed][..., None])[..., None]
+    boards = boards.copy()
+    boards[changed] = sorted_boards
+    return boards, cleared
+
+
+def board_features(boards: np.ndarray) -> tuple:
+    """
+    :param boards: a boolean array of shape (..., board_height, board_width)
+    :return: a tuple (heights, holes, avg_height, bumpiness) with the same meaning as in UnrenderedTetrisGame
+    """
+    height = boards.shape[-2]
+    used = boards.any(axis=-2)
+    heights = np.where(used, height - boards.argmax(axis=-2), 0)
+    holes = np.minimum(heights - boards.sum(axis=-2), 3).sum(axis=-1)  # use to limit hole penalty
+    # without used columns, the total height is zero as well
+    avg_height = heights.sum(axis=-1) / np.maximum(used.sum(axis=-1), 1)
+    differences = heights[..., 1:] - heights[..., :-1]
+    bumpiness = np.sqrt((differences * differences).sum(axis=-1))
+    return heights, holes, avg_height, bumpiness
+
+
+def encode_heights(heights: np.ndarray, low: int = -3, high: int = 3) -> np.ndarray:
+    """
+    Array version of TetrisEnv.get_encoded_state
+    :param heights: the column heights, of shape (..., board_width)
+    :return: the clipped height differences between adjacent columns, of shape (..., board_width - 1)
+    """
+    differences = heights[..., 1:] - heights[..., :-1]
+    return np.minimum(np.maximum(differences, low), high).astype(np.int8)
+
+
+def piece_cells(geometries: list) -> tuple:
+    """
+    :param geometries: the PieceGeometry of every rotation of a piece
+    :return: two integer arrays (cells_x, cells_y) of shape (nb_rotations, nb_cells) with the template coordinates of
+            the cells of every rotation
+    """
+    cells_x = np.array([[x for x, _ in geometry.cells] for geometry in geometries])
+    cells_y = np.array([[y for _, y in geometry.cells] for geometry in geometries])
+    return cells_x, cells_y
+
+
+def collision_index(cells_x: np.ndarray, cells_y: np.ndarray, board_height: int, board_width: int,
+                    x_offset: int) -> tuple:
+    """
+    Precomputes which cells of a padded board a piece covers in every rotation and position, for collisions()
+    :param cells_x, cells_y: the cells of the piece, see piece_cells()
+    :param x_offset: the smallest value of piece['x'] considered is -x_offset
+    :return: a tuple (index, padded_shape). index holds the flat indices into a board of padded_shape, indexed by
+            [rotation, cell, y, x + x_offset]
+    """
+    padded_shape = (board_height + cells_y.max() + 1, board_width + 2 * x_offset + cells_x.max())
+    ys = np.arange(board_height + 1)[:, None] + cells_y[:, :, None, None]
+    xs = np.arange(board_width + 2 * x_offset) + cells_x[:, :, None, None]
+    return ys * padded_shape[1] + xs, padded_shape
+
+
+def collisions(board: np.ndarray, index: np.ndarray, padded_shape: tuple, x_offset: int) -> np.ndarray:
+    """
+    Correlates the cells of every rotation of a piece with the board, with the walls and the floor counting as
+    filled cells.
+    :param board: a boolean array of shape (board_height, board_width)
+    :param index, padded_shape: see collision_index()
+    :param x_offset: the smallest value of piece['x'] considered is -x_offset
+    :return: a boolean array of shape (nb_rotations, board_height + 1, board_width + 2 * x_offset), which is True at
+            [rotation, y, x + x_offset] if the piece with its template at (x, y) overlaps a filled cell or the border
+    """
+    board_height, board_width = board.shape
+    padded = np.ones(padded_shape, dtype=bool)
+    padded[:board_height, x_offset:x_offset + board_width] = board
+    return padded.ravel()[index].any(axis=1)
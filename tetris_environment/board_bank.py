@@ -0,0 +1,126 @@
+from typing import Callable
+
+import numpy as np
+
+from tetris_environment.tetris_engine import get_variant, BLANK
+
+
+class BoardBank:
+    """
+    A collection of boards from which TetrisEnv.reset can start its episodes, so that training reaches the high
+    stacks where a policy fails without first playing through the same easy openings every time.
+    Every board is stored as its rows, row 0 at the top, with column x of a row in bit x. These are kept in one
+    array of shape (nb_boards, board_height), of uint8 for boards of at most 8 columns and of uint16 otherwise,
+    which is saved as a .npy file.
+    """
+
+    def __init__(self, type: str, rows: np.ndarray = None):
+        """
+        :param type: the Tetris variant of the boards, see UnrenderedTetrisGame
+        :param rows: the rows of the boards, as described above. If none are provided, the bank is empty.
+        """
+        variant = get_variant(type)
+        if variant.board_width > 16:
+            raise RuntimeError("Board banks are only supported for boards of at most 16 columns")
+        self.type = type
+        self.board_width = variant.board_width
+        self.board_height = variant.board_height
+        self.dtype = np.dtype(np.uint8 if self.board_width <= 8 else '<u2')
+        if rows is None:
+            rows = np.zeros((0, self.board_height), dtype=self.dtype)
+        if rows.ndim != 2 or rows.shape[1] != self.board_height:
+            raise RuntimeError("The rows do not match the board height of the variant")
+        if np.any(rows >= 1 << self.board_width):
+            raise RuntimeError("The rows do not match the board width of the variant")
+        self.rows = rows.astype(self.dtype, copy=False)
+        self._new_rows = []
+
+    def __len__(self) -> int:
+        return len(self.rows) + len(self._new_rows)
+
+    def add(self, board: np.ndarray) -> None:
+        """
+        :param board: a boolean array of shape (board_height, board_width), as returned by
+                UnrenderedTetrisGame.get_board_array
+        """
+        self._new_rows.append(board @ (1 << np.arange(self.board_width)))
+
+    def get_rows(self) -> np.ndarray:
+        """
+        :return: the array with the rows of all boards
+        """
+        if self._new_rows:
+            self.rows = np.concatenate([self.rows, np.array(self._new_rows, dtype=self.dtype)])
+            self._new_rows = []
+        return self.rows
+
+    def get_board(self, index: int) -> list:
+        """
+        :return: board index in the column-major format of UnrenderedTetrisGame, with every filled cell colored 0.
+                It is a new list, which can be passed to UnrenderedTetrisGame.reinit.
+        """
+        rows = self.get_rows()[index].tolist()
+        return [[0 if row >> x & 1 else BLANK for row in rows] for x in range(self.board_width)]
+
+    def sample(self, rng: np.random.Generator) -> list:
+        """
+        :return: a board drawn uniformly at random with rng, as in get_board()
+        """
+        if len(self) == 0:
+            raise RuntimeError("The board bank is empty")
+        return self.get_board(int(rng.integers(len(self))))
+
+    def save(self, filename: str) -> None:
+        """
+        Saves the rows of all boards with numpy.save. The variant is not stored, so it has to be given to load().
+        """
+        np.save(filename, self.get_rows())
+
+    @staticmethod
+    def load(filename: str, type: str, mmap: bool = False):
+        """
+        :param type: the Tetris variant of the boards
+        :param mmap: if True, the boards are read from the file as they are needed instead of all at once
+        :return: the BoardBank saved in filename
+        """
+        return BoardBank(type, np.load(filename, mmap_mode='r' if mmap else None))
+
+    @staticmethod
+    def record(env, nb_boards: int, policy: Callable = None, record_probability: float = 0.1,
+               min_height: int = 0, seed: int = None):
+        """
+        Builds a bank by playing episodes in env, one piece at a time with TetrisEnv.place, and keeping a random
+        sample of the boards on which a new piece starts
+        :param env: a TetrisEnv, which is reset and played by this method
+        :param nb_boards: the number of boards to record
+        :param policy: a function of the environment returning the placement (rotation, x) of the falling piece,
+                e.g. lambda env: model.predict()[2] for an AfterstateModel. If none is provided, the placements are
+                drawn at random.
+        :param record_probability: the probability with which every board is kept. Keeping only a few boards of
+                every episode makes the bank more diverse.
+        :param min_height: only boards with a column of at least this height are kept
+        :param seed: seed for the choice of the boards which are kept
+        :return: the BoardBank with the recorded boards
+        """
+        if not 0 < record_probability <= 1:
+            raise RuntimeError("The probability of recording a board should be in (0, 1]")
+        if policy is None:
+            def policy(env):
+                sampled = env.sample_placement()
+                return None if sampled is None else sampled[2]
+
+        bank = BoardBank(env.type)
+        rng = np.random.default_rng(seed)
+        env.reset()
+        while len(bank) < nb_boards:
+            placement = policy(env)
+            if placement is None:  # no falling piece, so wait for the next one
+                _, _, done, _ = env.step(env.no_move)
+            else:
+                _, _, done, _ = env.place(*placement)
+            if done:
+                env.reset()
+            elif rng.random() < record_probability and max(env.game_state.get_column_heights()) >= min_height:
+                bank.add(env.game_state.get_board_array())
+        return bank
+
@@ -0,0 +1,102 @@
+import random
+from collections import deque
+
+import numpy as np
+
+# the ways in which a PieceSource can draw pieces
+PIECE_MODES = ('legacy', 'uniform', 'bag')
+
+
+class PieceSource:
+    """
+    Produces the sequence of falling pieces of one game. Pieces are drawn ahead of time into a queue, which also
+    serves as the preview of the upcoming pieces. There are three modes:
+        • 'legacy': every piece is drawn on demand with the random module, exactly as the game always did. If a
+            seed is given, the source gets its own random.Random instead of the shared module.
+        • 'uniform': shapes, rotations and colors are drawn uniformly at random, buffer_size pieces at a time,
+            with a seeded NumPy generator
+        • 'bag': like 'uniform', but the shapes are dealt from shuffled bags holding every shape once. For
+            regular Tetris, this is the 7-bag of the official rules.
+    """
+
+    def __init__(self, variant, mode: str = 'legacy', seed: int = None, nb_colors: int = 4,
+                 buffer_size: int = 256):
+        """
+        :param variant: the TetrisVariant of the game
+        :param mode: one of PIECE_MODES
+        :param seed: seed for the random generator of this source. See seed()
+        :param nb_colors: the number of colors a piece can have
+        :param buffer_size: the number of pieces drawn at once in the 'uniform' and 'bag' modes
+        """
+        if mode not in PIECE_MODES:
+            raise RuntimeError("Invalid piece mode")
+        if buffer_size < 1:
+            raise RuntimeError("The buffer size should be at least one")
+
+        self.variant = variant
+        self.mode = mode
+        self.nb_colors = nb_colors
+        self.buffer_size = buffer_size
+        self.nb_rotations = np.array([len(variant.pieces[shape]) for shape in variant.shapes])
+
+        # upcoming pieces as (shape index, rotation, color) tuples
+        self.queue = deque()
+        self.seed(seed)
+
+    def seed(self, seed: int = None) -> None:
+        """
+        Restarts the sequence of pieces from the given seed and discards the pieces drawn so far. Two sources of
+        the same variant and mode which are seeded alike produce the same pieces.
+        :param seed: if None, the legacy mode returns to the shared random module and the other modes are seeded
+                from fresh entropy
+        """
+        if self.mode == 'legacy':
+            self.random = random if seed is None else random.Random(seed)
+        else:
+            self.rng = np.random.default_rng(seed)
+        self.queue.clear()
+
+    def next_piece(self) -> dict:
+        """
+        :return: a new piece at the top of the board, as used for UnrenderedTetrisGame.fallingPiece
+        """
+        if not self.queue:
+            self._fill()
+        shape, rotation, color = self.queue.popleft()
+        return {'shape': self.variant.shapes[shape],
+                'rotation': rotation,
+                'x': self.variant.spawn_x,
+                'y': 0,  # start it above the self.board (i.e. less than 0)
+                'color': color}
+
+    def preview(self, nb_pieces: int) -> list:
+        """
+        Draws pieces ahead of time if needed. In the legacy mode without a seed, this changes the order in which
+        the shared random module is used.
+        :param nb_pieces: the length of the preview
+        :return: a list of (shape, rotation) tuples of the next nb_pieces pieces returned by next_piece()
+        """
+        while len(self.queue) < nb_pieces:
+            self._fill()
+        return [(self.variant.shapes[self.queue[i][0]], self.queue[i][1]) for i in range(nb_pieces)]
+
+    def _fill(self) -> None:
+        """
+        Appends newly drawn pieces to the queue
+        """
+        if self.mode == 'legacy':
+            shape = self.random.choice(self.variant.shapes)
+            rotation = self.random.randint(0, len(self.variant.pieces[shape]) - 1)
+            color = self.random.randint(0, self.nb_colors - 1)
+            self.queue.append((self.variant.shapes.index(shape), rotation, color))
+            return
+
+        nb_shapes = len(self.variant.shapes)
+        if self.mode == 'bag':
+            nb_bags = -(-self.buffer_size // nb_shapes)
+            shapes = self.rng.permuted(np.tile(np.arange(nb_shapes), (nb_bags, 1)), axis=1).ravel()
+        else:
+            shapes = self.rng.integers(nb_shapes, size=self.buffer_size)
+        rotations = self.rng.integers(0, self.nb_rotations[shapes])
+        colors = self.rng.integers(self.nb_colors, size=len(shapes))
+        self.queue.extend(zip(shapes.tolist(), rotations.tolist(), colors.tolist()))
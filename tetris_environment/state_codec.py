@@ -0,0 +1,133 @@
+import pickle
+from typing import Union
+
+import numpy as np
+
+
+class StateCodec:
+    """
+    Packs an encoded state (see TetrisEnv.get_encoded_state), a tuple of height differences in [low, high], into a
+    single integer and back. Height difference i is digit i of the number in base high - low + 1, least significant
+    digit first. The codes of all states are exactly 0 .. nb_states - 1, so a code is also a perfect hash of its
+    state and can index a dense array: 343 states for the 'fourer' variants and about 40 million for 'regular'.
+    """
+
+    def __init__(self, length: int, low: int = -3, high: int = 3):
+        """
+        :param length: the number of height differences of a state, board_width - 1
+        :param low, high: the range of every height difference
+        """
+        if low > high:
+            raise RuntimeError("The lowest height difference should not exceed the highest")
+        self.length = length
+        self.low = low
+        self.high = high
+        self.base = high - low + 1
+        self.nb_states = self.base ** length
+        self.weights = self.base ** np.arange(length, dtype=np.int64)
+
+    def encode(self, state) -> int:
+        """
+        :param state: a sequence of length height differences
+        :return: the code of the state
+        """
+        code = 0
+        for height_diff in reversed(state):
+            code = code * self.base + height_diff - self.low
+        return code
+
+    def decode(self, code: int) -> tuple:
+        """
+        :return: the state, as a tuple of height differences, of which code is the code
+        """
+        state = []
+        for _ in range(self.length):
+            code, digit = divmod(code, self.base)
+            state.append(digit + self.low)
+        return tuple(state)
+
+    def encode_array(self, states: np.ndarray) -> np.ndarray:
+        """
+        :param states: an integer array of shape (..., length)
+        :return: the int64 array of shape states.shape[:-1] with the code of every state
+        """
+        return (states.astype(np.int64) - self.low) @ self.weights
+
+    def decode_array(self, codes: np.ndarray) -> np.ndarray:
+        """
+        :return: the int8 array of shape codes.shape + (length,) with the states of the codes
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        return (codes[..., None] // self.weights % self.base + self.low).astype(np.int8)
+
+    def is_state(self, key) -> bool:
+        """
+        :return: whether key is a state as returned by TetrisEnv.get_encoded_state
+        """
+        return isinstance(key, tuple) and len(key) == self.length and \
+            all(isinstance(height_diff, int) and self.low <= height_diff <= self.high for height_diff in key)
+
+    def compact_table(self, table: dict) -> dict:
+        """
+        Replaces the states among the keys of a table by their codes: both keys which are states and keys of the
+        form (state, piece) or (piece, state), as used by the state-action models. Other keys and the values are
+        kept as they are.
+        :return: a new dict with the compact keys
+        """
+        compact = {}
+        for key, value in table.items():
+            if self.is_state(key):
+                key = self.encode(key)
+            elif isinstance(key, tuple) and len(key) == 2 and self.is_state(key[0]):
+                key = (self.encode(key[0]), key[1])
+            elif isinstance(key, tuple) and len(key) == 2 and self.is_state(key[1]):
+                key = (key[0], self.encode(key[1]))
+            compact[key] = value
+        return compact
+
+
+def is_compact_table(table: dict) -> Union[bool, None]:
+    """
+    :return: whether the states in the keys of a table are codes of a StateCodec, or None if this is unknown because
+            the table is empty. An empty DenseValueTable knows the kind of its keys, so it is compact if its keys are.
+    """
+    for key in table:
+        if isinstance(key, tuple) and len(key) == 2:
+            if _is_piece(key[0]):
+                key = key[1]  # a (piece, state) key
+            elif key[1] is None or _is_piece(key[1]):
+                key = key[0]  # a (state, piece) key
+        return isinstance(key, (int, np.integer))
+    return getattr(table, 'compact_keys', None)
+
+
+def compact_states_kwargs(table: dict) -> dict:
+    """
+    :return: the keyword arguments which give a TetrisEnv the kind of states of a table, see is_compact_table. They
+            are empty if the kind is unknown, so the environment keeps its default setting.
+    """
+    compact = is_compact_table(table)
+    return {} if compact is None else {"compact_states": compact}
+
+
+def _is_piece(value) -> bool:
+    """
+    :return: whether value is a falling piece as returned by TetrisEnv.get_falling_piece, (shape, x, y, rotation)
+    """
+    return isinstance(value, tuple) and len(value) == 4 and isinstance(value[0], str)
+
+
+def compact_pickled_tables(filename: str, compact_filename: str, length: int) -> None:
+    """
+    Converts a model saved with pickle to compact state keys, see StateCodec.compact_table. Every dict among the
+    saved attributes is converted, the other attributes are copied as they are. The model can then be loaded from
+    compact_filename as usual, and plays in a TetrisEnv with compact_states=True.
+    :param length: the number of height differences of a state, board_width - 1 of the variant of the model
+    """
+    codec = StateCodec(length)
+    with open(filename, 'rb') as f:
+        attributes = pickle.load(f)
+    attributes = tuple(codec.compact_table(attribute) if isinstance(attribute, dict) else attribute
+                       for attribute in attributes)
+    with open(compact_filename, 'wb') as f:
+        pickle.dump(attributes, f)
@@ -8,7 +8,13 @@ import random
 import time
 from abc import abstractmethod
 from math import sqrt
-from typing import Union
+from typing import Tuple, Union
+
+import numpy as np
+
+from tetris_environment.board_arrays import ALPHA, BETA, GAMMA, clear_lines, board_features, encode_heights, \
+    piece_cells, collision_index, collisions
+from tetris_environment.piece_source import PieceSource
 
 FPS = 25
 BOXSIZE = 20
@@ -43,6 +49,23 @@ COLORS = (BLUE, GREEN, RED, YELLOW)
 LIGHTCOLORS = (LIGHTBLUE, LIGHTGREEN, LIGHTRED, LIGHTYELLOW)
 assert len(COLORS) == len(LIGHTCOLORS)  # each color must have light color
 
+# input for a frame without any action
+NO_ACTION = (1, 0, 0, 0, 0, 0)
+
+# the actions of frame_step(), numbered as in TetrisEnv
+MOVE_LEFT = 1
+ROTATE_CLOCKWISE = 2
+MOVE_RIGHT = 3
+MOVE_DOWN = 4
+ROTATE_COUNTERCLOCKWISE = 5
+
+# every action mask of frame_step(), indexed by the bits of the legal actions (see get_action_mask). Doing nothing is
+# always legal. The masks are shared, so they are read-only.
+ACTION_MASKS = tuple(np.array([1] + [bits >> action & 1 for action in range(1, 6)], dtype=np.int8)
+                     for bits in range(64))
+for _mask in ACTION_MASKS:
+    _mask.flags.writeable = False
+
 TEMPLATEWIDTH = 5
 TEMPLATEHEIGHT = 5
 
@@ -198,46 +221,218 @@ X_SHAPE_TEMPLATE = [['.O...',
                      '.....']]
 
 
+# compiled geometry, shared by all games playing with the same templates
+_GEOMETRY_CACHE = {}
+
+
+class PieceGeometry:
+    """
+    The geometry of one rotation of a piece, compiled once from its 5x5 string template.
+        • cells: the (x, y) template coordinates of every occupied cell
+        • min_x, max_x: the leftmost and rightmost occupied template columns
+        • bottom: a (x, y) pair for every occupied template column x, with y the lowest occupied template row
+        • row_masks: a (y, mask) pair for every occupied template row y. Bit i of mask stands for template
+            column min_x + i, so the mask of a piece at x is placed on a bitboard with a left shift of x + min_x.
+    """
+    __slots__ = ('cells', 'min_x', 'max_x', 'bottom', 'row_masks')
+
+    def __init__(self, template):
+        self.cells = tuple((x, y) for y in range(TEMPLATEHEIGHT) for x in range(TEMPLATEWIDTH)
+                           if template[y][x] != BLANK)
+        self.min_x = min(x for x, _ in self.cells)
+        self.max_x = max(x for x, _ in self.cells)
+        self.bottom = tuple((x, max(y for cell_x, y in self.cells if cell_x == x))
+                            for x in range(self.min_x, self.max_x + 1)
+                            if any(cell_x == x for cell_x, _ in self.cells))
+
+        row_masks = []
+        for y in range(TEMPLATEHEIGHT):
+            mask = 0
+            for x, cell_y in self.cells:
+                if cell_y == y:
+                    mask |= 1 << (x - self.min_x)
+            if mask:
+                row_masks.append((y, mask))
+        self.row_masks = tuple(row_masks)
+
+    def x_range(self, board_width: int) -> range:
+        """
+        :return: all values for piece['x'] which keep this rotation within the walls of the board
+        """
+        return range(-self.min_x, board_width - self.max_x)
+
+    def landing_y(self, column_heights, x: int, board_height: int) -> int:
+        """
+        Computes where a piece with its template at x lands when dropped from above the stack, in O(piece width)
+        :param column_heights: a function returning the height of the stack in a given column
+        :return: the y value of the piece's template once it has landed
+        """
+        return min(board_height - column_heights(x + column) - 1 - y for column, y in self.bottom)
+
+
+def compile_pieces(pieces: dict) -> dict:
+    """
+    :param pieces: a dict mapping every shape to its list of templates, one for every rotation
+    :return: a dict mapping every shape to a list of PieceGeometry, one for every rotation
+    """
+    key = tuple((shape, id(templates)) for shape, templates in pieces.items())
+    if key not in _GEOMETRY_CACHE:
+        _GEOMETRY_CACHE[key] = {shape: [PieceGeometry(template) for template in templates]
+                                for shape, templates in pieces.items()}
+    return _GEOMETRY_CACHE[key]
+
+
+class TetrisVariant:
+    """
+    The configuration of a type of Tetris: the size of the board and the pieces played with. Every game keeps its
+    own variant, so games of different types can be played side by side in one process.
+    """
+
+    def __init__(self, name: str, board_width: int, pieces: dict, board_height: int = BOARDHEIGHT):
+        """
+        :param name: the name of the type, as passed to TetrisEnv
+        :param pieces: a dict mapping every shape to its list of templates, one for every rotation
+        """
+        self.name = name
+        self.board_width = board_width
+        self.board_height = board_height
+        self.pieces = pieces
+        self.shapes = tuple(pieces.keys())
+        self.geometry = compile_pieces(pieces)
+        self.cells = {shape: piece_cells(geometries) for shape, geometries in self.geometry.items()}
+        # every (rotation, x) of a shape which keeps the piece within the walls
+        self.candidates = {shape: tuple((rotation, x) for rotation, geometry in enumerate(geometries)
+                                        for x in geometry.x_range(board_width))
+                           for shape, geometries in self.geometry.items()}
+        # the shapes of which two rotations fill the same cells up to a translation, so that two placements of them
+        # can fill the same cells of the board
+        self.repeated_rotations = {shape for shape, geometries in self.geometry.items()
+                                   if len({frozenset((x - geometry.min_x, y - min(y for _, y in geometry.cells))
+                                                     for x, y in geometry.cells)
+                                           for geometry in geometries}) < len(geometries)}
+        self.collision_indices = {}
+        self.spawn_x = int(board_width / 2) - int(TEMPLATEWIDTH / 2)
+
+        # a random 64-bit key for every cell, indexed by [x][y]. The Zobrist hash of a board is the XOR of the keys
+        # of its filled cells. The keys only depend on the size of the board, so hashes agree across processes.
+        keys = random.Random(board_width * board_height)
+        self.zobrist_keys = [[keys.getrandbits(64) for _ in range(board_height)] for _ in range(board_width)]
+
+    def get_collision_index(self, shape: str, x_offset: int) -> tuple:
+        """
+        :return: the collision_index() of the shape on this board, computed once
+        """
+        if (shape, x_offset) not in self.collision_indices:
+            cells_x, cells_y = self.cells[shape]
+            self.collision_indices[shape, x_offset] = collision_index(cells_x, cells_y, self.board_height,
+                                                                      self.board_width, x_offset)
+        return self.collision_indices[shape, x_offset]
+
+
+# every supported type of Tetris
+VARIANTS = {'regular': TetrisVariant('regular', 10, {'S': S_SHAPE_TEMPLATE,
+                                                     'Z': Z_SHAPE_TEMPLATE,
+                                                     'J': J_SHAPE_TEMPLATE,
+                                                     'L': L_SHAPE_TEMPLATE,
+                                                     'I': I_SHAPE_TEMPLATE,
+                                                     'O': O_SHAPE_TEMPLATE,
+                                                     'T': T_SHAPE_TEMPLATE}),
+            'fourer': TetrisVariant('fourer', 4, {'I': SMALL_I_SHAPE_TEMPLATE,
+                                                  'X': X_SHAPE_TEMPLATE}),
+            'extended fourer': TetrisVariant('extended fourer', 4, {'I': SMALL_I_SHAPE_TEMPLATE,
+                                                                    'X': X_SHAPE_TEMPLATE,
+                                                                    'O': O_SHAPE_TEMPLATE,
+                                                                    'o': SMALL_O_SHAPE_TEMPLATE,
+                                                                    'L': SMALL_L_SHAPE_TEMPLATE})}
+
+
+def get_variant(type) -> TetrisVariant:
+    """
+    :param type: the name of a supported type of Tetris, or a TetrisVariant
+    :return: the TetrisVariant of the type
+    :raise RuntimeError if the type is not supported
+    """
+    if isinstance(type, TetrisVariant):
+        return type
+    if type not in VARIANTS:
+        raise RuntimeError("Unsupported Tetris type")
+    return VARIANTS[type]
+
+
+def get_placement_actions(curr_piece: dict, target_piece: dict, nb_rotations: int, x_range: range = None) -> list:
+    """
+    Finds the actions of frame_step() which bring the piece :param curr_piece in the same position as
+    :param target_piece, and drop it. A press to the left or to the right moves the piece two columns if there is
+    room, so an odd number of columns can only be covered by a press which is stopped after one column. If the
+    walls are known, the piece is then moved into the wall for which this happens and back to its target.
+    :param nb_rotations: the number of rotations of the shape of the pieces
+    :param x_range: the values of piece['x'] within the walls for the rotation of target_piece, see
+            PieceGeometry.x_range. If none is provided, the piece is moved straight to its target.
+    :return: a list of all actions required: first rotations in the shortest direction, then lateral presses. The
+            last action added is the move_down action. Whether the piece gets there on the board is found by
+            UnrenderedTetrisGame.is_legal_placement.
+    :raise AssertionError if the shapes of the falling pieces are different
+    """
+    assert curr_piece['shape'] == target_piece['shape']
+
+    actions = []
+    clockwise = (target_piece['rotation'] - curr_piece['rotation']) % nb_rotations
+    if clockwise <= nb_rotations - clockwise:
+        actions.extend([ROTATE_CLOCKWISE] * clockwise)
+    else:
+        actions.extend([ROTATE_COUNTERCLOCKWISE] * (nb_rotations - clockwise))
+
+    def presses(x: int, target_x: int) -> list:
+        # the last press covers a single column if the distance is odd
+        return [MOVE_RIGHT if target_x > x else MOVE_LEFT] * ((abs(target_x - x) + 1) // 2)
+
+    x, target_x = curr_piece['x'], target_piece['x']
+    lateral = presses(x, target_x)
+    if (target_x - x) % 2 == 1 and x_range is not None:
+        # a wall at an odd distance stops the last press towards it after one column
+        routes = [presses(x, wall) + presses(wall, target_x) for wall in (x_range[0], x_range[-1])
+                  if (wall - x) % 2 == 1]
+        if routes:
+            lateral = min(routes, key=len)
+    actions.extend(lateral)
+    actions.append(MOVE_DOWN)
+    return actions
+
+
 class UnrenderedTetrisGame:
-    def __init__(self, type: str, board=None):
+    def __init__(self, type, board=None, headless: bool = True, piece_source: PieceSource = None):
         """
         Initializes a Tetris game
         :param type: indicates the size of the board and the pieces used.
                 'regular' is normal Tetris according to the official rules
                 'fourer' is Tetris on a board of width 4, with two 2-cell pieces: small I and X
+                A TetrisVariant can be passed as well.
         :param board:
+        :param headless: if True, the game never reads the clock. The times of the last moves are only kept
+                when the game is played in real time.
+        :param piece_source: produces the falling pieces. If none is provided, the pieces are drawn with the
+                random module.
         """
-        global PIECES, BOARDWIDTH, WINDOWWIDTH
-        global FPSCLOCK, DISPLAYSURF, BASICFONT, BIGFONT
-
-        if type == 'regular':
-            BOARDWIDTH = 10
-            PIECES = {'S': S_SHAPE_TEMPLATE,
-                      'Z': Z_SHAPE_TEMPLATE,
-                      'J': J_SHAPE_TEMPLATE,
-                      'L': L_SHAPE_TEMPLATE,
-                      'I': I_SHAPE_TEMPLATE,
-                      'O': O_SHAPE_TEMPLATE,
-                      'T': T_SHAPE_TEMPLATE}
-            WINDOWWIDTH = BOXSIZE * BOARDWIDTH
-        elif type == "fourer":
-            BOARDWIDTH = 4
-            PIECES = {'I': SMALL_I_SHAPE_TEMPLATE,
-                      'X': X_SHAPE_TEMPLATE}
-            WINDOWWIDTH = BOXSIZE * BOARDWIDTH
-        elif type == "extended fourer":
-            BOARDWIDTH = 4
-            PIECES = {'I': SMALL_I_SHAPE_TEMPLATE,
-                      'X': X_SHAPE_TEMPLATE,
-                      'O': O_SHAPE_TEMPLATE,
-                      'o': SMALL_O_SHAPE_TEMPLATE,
-                      'L': SMALL_L_SHAPE_TEMPLATE}
-        else:
-            raise RuntimeError("Unsupported Tetris type")
+        self.variant = get_variant(type)
+        self.headless = headless
+        if piece_source is None:
+            piece_source = PieceSource(self.variant, nb_colors=len(COLORS))
+        self.piece_source = piece_source
+
+        self.board_width = self.variant.board_width
+        self.board_height = self.variant.board_height
+        self.pieces = self.variant.pieces
+        self._compile_pieces()
 
         # DEBUG
         self.total_lines = 0
 
+        # snapshots taken by make_placement, restored by unmake_placement
+        self.undo_stack = []
+
+        # notified after every frame, see attach()
+        self.observers = []
+
         # For calculation of reward
         self.avg_height = 0
         self.holes = 0
@@ -248,9 +443,11 @@ class UnrenderedTetrisGame:
             self.board = board
         else:
             self.board = self.get_blank_board()
-        self.lastMoveDownTime = time.time()
-        self.lastMoveSidewaysTime = time.time()
-        self.lastFallTime = time.time()
+        self.compute_features()
+        if not self.headless:
+            self.lastMoveDownTime = time.time()
+            self.lastMoveSidewaysTime = time.time()
+            self.lastFallTime = time.time()
         self.movingDown = False  # note: there is no movingUp variable
         self.movingLeft = False
         self.movingRight = False
@@ -262,25 +459,25 @@ class UnrenderedTetrisGame:
         self.fallingPiece = self.get_new_piece()
         self.nextPiece = self.get_new_piece()
 
-        self.board_width = BOARDWIDTH
-        self.board_height = BOARDHEIGHT
-
-        self.pieces = PIECES
         self.frame_step([1, 0, 0, 0, 0, 0])
 
-    def reinit(self):
+    def reinit(self, board=None):
         """
         Re-initializes the board to an empty board
+        :param board: if provided, the game starts over on this board instead, in the format of the board argument
+                of the constructor. The game takes the board over, so it must not be shared.
         """
 
         self.avg_height = 0
         self.holes = 0
         self.bumpiness = 0
 
-        self.board = self.get_blank_board()
-        self.lastMoveDownTime = time.time()
-        self.lastMoveSidewaysTime = time.time()
-        self.lastFallTime = time.time()
+        self.board = self.get_blank_board() if board is None else board
+        self.compute_features()
+        if not self.headless:
+            self.lastMoveDownTime = time.time()
+            self.lastMoveSidewaysTime = time.time()
+            self.lastFallTime = time.time()
         self.movingDown = False  # note: there is no movingUp variable
         self.movingLeft = False
         self.movingRight = False
@@ -294,6 +491,22 @@ class UnrenderedTetrisGame:
 
         self.frame_step([1, 0, 0, 0, 0, 0])
 
+    def attach(self, observer) -> None:
+        """
+        Lets an observer, such as a TetrisRenderer, follow this game. Its update(game) method is called right away
+        and after every frame played with frame_step() or place(). Placements simulated with make_placement() or
+        all_afterstates() are not observed.
+        """
+        self.observers.append(observer)
+        observer.update(self)
+
+    def _compile_pieces(self):
+        """
+        Looks up the compiled geometry of the pieces of the variant being played. Subclasses extend this to
+        precompute their own piece data.
+        """
+        self.geometry = self.variant.geometry
+
     @property
     def get_board_width(self):
         return self.board_width
@@ -311,7 +524,8 @@ class UnrenderedTetrisGame:
             self.fallingPiece['x'] -= 1
             self.movingLeft = True
             self.movingRight = False
-            self.lastMoveSidewaysTime = time.time()
+            if not self.headless:
+                self.lastMoveSidewaysTime = time.time()
 
     def move_right(self):
         """
@@ -322,21 +536,22 @@ class UnrenderedTetrisGame:
             self.fallingPiece['x'] += 1
             self.movingRight = True
             self.movingLeft = False
-            self.lastMoveSidewaysTime = time.time()
+            if not self.headless:
+                self.lastMoveSidewaysTime = time.time()
 
     def rotate_clockwise(self):
         self.fallingPiece['rotation'] = (self.fallingPiece['rotation'] + 1) % len(
-            PIECES[self.fallingPiece['shape']])
+            self.pieces[self.fallingPiece['shape']])
         if not self.is_valid_position():
             self.fallingPiece['rotation'] = (self.fallingPiece['rotation'] - 1) % len(
-                PIECES[self.fallingPiece['shape']])
+                self.pieces[self.fallingPiece['shape']])
 
     def rotate_counterclockwise(self):
         self.fallingPiece['rotation'] = (self.fallingPiece['rotation'] - 1) % len(
-            PIECES[self.fallingPiece['shape']])
+            self.pieces[self.fallingPiece['shape']])
         if not self.is_valid_position():
             self.fallingPiece['rotation'] = (self.fallingPiece['rotation'] + 1) % len(
-                PIECES[self.fallingPiece['shape']])
+                self.pieces[self.fallingPiece['shape']])
 
     def move_down(self):
         """
@@ -346,10 +561,28 @@ class UnrenderedTetrisGame:
         self.movingDown = False
         self.movingLeft = False
         self.movingRight = False
-        for i in range(1, BOARDHEIGHT):
-            if not self.is_valid_position(adjY=i):
-                break
-        self.fallingPiece['y'] += i - 1
+        # a piece never drops more than board_height - 2 rows at once
+        self.fallingPiece['y'] += min(self.get_drop_distance(), self.board_height - 2)
+
+    def get_drop_distance(self, piece=None) -> int:
+        """
+        Computes how many rows a piece can move down before it lands. If the piece is above the stack in all of
+        its columns, this follows from the column heights. Otherwise the piece is below an overhang and is moved
+        down row by row.
+        :param piece: the piece to drop. If none is provided, the falling piece is used
+        :return: the number of rows the piece can move down
+        """
+        if piece is None:
+            piece = self.fallingPiece
+        geometry = self.geometry[piece['shape']][piece['rotation']]
+        landing_y = geometry.landing_y(self.get_column_height, piece['x'], self.board_height)
+        if landing_y >= piece['y']:
+            return landing_y - piece['y']
+
+        distance = 0
+        while self.is_valid_position(adjY=distance + 1, piece=piece):
+            distance += 1
+        return distance
 
     def frame_step(self, input):
         self.movingLeft = False
@@ -364,7 +597,8 @@ class UnrenderedTetrisGame:
             new_piece = True
             self.fallingPiece = self.nextPiece
             self.nextPiece = self.get_new_piece()
-            self.lastFallTime = time.time()  # reset self.lastFallTime
+            if not self.headless:
+                self.lastFallTime = time.time()  # reset self.lastFallTime
 
             if not self.is_valid_position():
                 terminal = True
@@ -394,11 +628,13 @@ class UnrenderedTetrisGame:
                 self.fallingPiece['x'] -= 1
             elif self.movingRight and self.is_valid_position(adjX=1):
                 self.fallingPiece['x'] += 1
-            self.lastMoveSidewaysTime = time.time()
+            if not self.headless:
+                self.lastMoveSidewaysTime = time.time()
 
         if self.movingDown:
             self.fallingPiece['y'] += 1
-            self.lastMoveDownTime = time.time()
+            if not self.headless:
+                self.lastMoveDownTime = time.time()
 
         # let the piece fall if it is time to fall
         # see if the piece has landed
@@ -406,53 +642,346 @@ class UnrenderedTetrisGame:
         extra_score = 0
         if not self.is_valid_position(adjY=1):
             # falling piece has landed, set it on the self.board
-            self.add_to_board()
-
-            cleared = self.remove_complete_lines()
-            if cleared > 0:
-                if cleared == 1:
-                    extra_score = 40 * self.level
-                elif cleared == 2:
-                    extra_score = 100 * self.level
-                elif cleared == 3:
-                    extra_score = 300 * self.level
-                elif cleared == 4:
-                    extra_score += 1200 * self.level
-
-            extra_score += self.fallingPiece['y']
-            self.score += extra_score
-            self.lines += cleared
-            self.total_lines += cleared
-
-            self.height = self.get_height()
-
-            self.level, self.fallFreq = self.calculate_level_and_fall_freq()
-            self.fallingPiece = None
-
+            cleared, extra_score = self.lock_piece()
         else:
             # piece did not land, just move the piece down
             self.fallingPiece['y'] += 1
 
         data = {"score": extra_score, "lines_cleared": cleared, "new_piece": new_piece}
         reward = self.get_reward()
+        for observer in self.observers:
+            observer.update(self)
         return None, reward, terminal, data
 
+    def place(self, rotation: int, x: int) -> Tuple[float, bool, dict]:
+        """
+        Drops the falling piece with the given rotation and x all the way down, locks it and starts the next
+        piece. This has the same result as the frames of the actions of placement_actions() followed by a frame
+        without action, but takes a single call.
+        :param rotation: the new rotation of the falling piece
+        :param x: the new value for piece['x']
+        :return: a 3-tuple (reward, terminal, data) with the summed reward of these frames, whether the next piece
+                ended the game, and the summed "score" and "lines_cleared" of these frames
+        :raise RuntimeError if the placement is not legal, see is_legal_placement()
+        """
+        if self.fallingPiece is None or not self.is_legal_placement(rotation, x):
+            raise RuntimeError("Illegal placement")
+        self.fallingPiece['rotation'] = rotation
+        self.fallingPiece['x'] = x
+        self.fallingPiece['y'] += self.get_drop_distance()
+        cleared, extra_score = self.lock_piece()
+        reward = self.get_reward()
+
+        # start the next piece
+        _, next_reward, terminal, data = self.frame_step(NO_ACTION)
+        data = {"score": extra_score + data["score"], "lines_cleared": cleared + data["lines_cleared"],
+                "new_piece": True}
+        return reward + next_reward, terminal, data
+
+    def lock_piece(self) -> Tuple[int, int]:
+        """
+        Sets the falling piece on the board where it is, removes complete lines and updates the score.
+        Afterwards, there is no falling piece.
+        :return: a tuple (lines cleared, score received)
+        """
+        extra_score = 0
+        self.add_to_board()
+        self.update_features()
+
+        cleared = self.remove_complete_lines()
+        if cleared > 0:
+            # the tops of the columns may have been cleared, so rescan the board
+            self.compute_features()
+            if cleared == 1:
+                extra_score = 40 * self.level
+            elif cleared == 2:
+                extra_score = 100 * self.level
+            elif cleared == 3:
+                extra_score = 300 * self.level
+            elif cleared == 4:
+                extra_score += 1200 * self.level
+
+        extra_score += self.fallingPiece['y']
+        self.score += extra_score
+        self.lines += cleared
+        self.total_lines += cleared
+
+        self.height = self.get_height()
+
+        self.level, self.fallFreq = self.calculate_level_and_fall_freq()
+        self.fallingPiece = None
+        return cleared, extra_score
+
+    def snapshot(self) -> tuple:
+        """
+        Takes a lightweight snapshot of the game: a copy of the board, the falling and next piece, the cached
+        column features, the board hash and the score. The game can be reset to it any number of times with
+        restore().
+        """
+        falling_piece = dict(self.fallingPiece) if self.fallingPiece is not None else None
+        return (self.copy_board(), falling_piece, dict(self.nextPiece),
+                self.column_heights[:], self.column_cells[:], self.features_changed, self.board_hash,
+                self.avg_height, self.holes, self.bumpiness,
+                self.score, self.lines, self.total_lines, self.height, self.level, self.fallFreq)
+
+    def restore(self, snapshot: tuple) -> None:
+        """
+        Resets the game to a snapshot taken with snapshot(). The board is overwritten in place, so references to
+        it stay valid.
+        """
+        (board, falling_piece, self.nextPiece,
+         column_heights, column_cells, self.features_changed, self.board_hash,
+         self.avg_height, self.holes, self.bumpiness,
+         self.score, self.lines, self.total_lines, self.height, self.level, self.fallFreq) = snapshot
+        self.restore_board(board)
+        self.fallingPiece = dict(falling_piece) if falling_piece is not None else None
+        self.column_heights[:] = column_heights
+        self.column_cells[:] = column_cells
+
+    def make_placement(self, rotation: int, x: int) -> Tuple[float, int]:
+        """
+        Moves the falling piece to the given rotation and x, drops it all the way down and locks it, without
+        starting a new piece. Undo this with unmake_placement(). Placements can be nested.
+        :param rotation: the new rotation of the falling piece. Together with x, this must be a legal placement, see
+                is_legal_placement(). This is not checked.
+        :param x: the new value for piece['x']
+        :return: a tuple (reward, lines cleared)
+        """
+        self.undo_stack.append(self.snapshot())
+        self.fallingPiece['rotation'] = rotation
+        self.fallingPiece['x'] = x
+        self.fallingPiece['y'] += self.get_drop_distance()
+        cleared, _ = self.lock_piece()
+        return self.get_reward(), cleared
+
+    def unmake_placement(self) -> None:
+        """
+        Undoes the last placement made with make_placement()
+        """
+        self.restore(self.undo_stack.pop())
+
+    def get_action_mask(self) -> np.ndarray:
+        """
+        Finds the actions of frame_step() which have an effect in the next frame. Doing nothing is always legal,
+        moves and rotations are legal if the piece fits afterwards, and moving down is legal if the piece is above
+        the place where it lands. If there is no falling piece, the next frame starts the next piece, so the actions
+        apply to that piece. If that piece does not fit, the game ends whatever the action, so only doing nothing
+        is legal.
+        :return: a read-only int8 array of length 6 with a 1 for every legal action, from ACTION_MASKS
+        """
+        piece = self.fallingPiece
+        if piece is None:
+            piece = self.nextPiece
+            if not self.is_valid_position(piece=piece):
+                return ACTION_MASKS[0]
+        bits = self._translation_bits(piece) | self._rotation_bits(piece)
+        return ACTION_MASKS[bits]
+
+    def _translation_bits(self, piece: dict) -> int:
+        """
+        :return: the bits of ACTION_MASKS of the legal moves to the left, to the right and down of a valid piece
+        """
+        return (self.is_valid_position(adjX=-1, piece=piece) << 1 | self.is_valid_position(adjX=1, piece=piece) << 3 |
+                self.is_valid_position(adjY=1, piece=piece) << 4)
+
+    def _rotation_bits(self, piece: dict) -> int:
+        """
+        :return: the bits of ACTION_MASKS of the legal rotations of a piece
+        """
+        nb_rotations = len(self.pieces[piece['shape']])
+        if nb_rotations == 1:
+            return 0
+        clockwise = self.is_valid_position(piece=dict(piece, rotation=(piece['rotation'] + 1) % nb_rotations))
+        if nb_rotations == 2:
+            # both directions lead to the same rotation
+            return clockwise << 2 | clockwise << 5
+        counterclockwise = self.is_valid_position(piece=dict(piece, rotation=(piece['rotation'] - 1) % nb_rotations))
+        return clockwise << 2 | counterclockwise << 5
+
+    def placement_actions(self, rotation: int, x: int) -> list:
+        """
+        :return: the actions of frame_step() which bring the falling piece to the given rotation and x and drop it,
+                see get_placement_actions
+        """
+        piece = self.fallingPiece
+        geometries = self.geometry[piece['shape']]
+        return get_placement_actions(piece, dict(piece, rotation=rotation, x=x), len(geometries),
+                                     geometries[rotation].x_range(self.board_width))
+
+    def is_legal_placement(self, rotation: int, x: int) -> bool:
+        """
+        A placement is legal if the falling piece fits with the given rotation and x at its current height, and the
+        frames of placement_actions() bring it there without landing on the way, above the place where it lands
+        when dropped from its current height. The piece is then placed the same way by make_placement(), place()
+        and these frames. Placements for which the piece is blocked, or slides under an overhang, are left out.
+        :return: whether the placement is legal
+        """
+        piece = dict(self.fallingPiece, rotation=rotation, x=x)
+        if not self.is_valid_position(piece=piece):
+            return False
+        end = self._follow_actions(self.placement_actions(rotation, x), self._fits)
+        if end is None or end[:2] != (rotation, x):
+            return False
+        return end[2] <= piece['y'] + self.get_drop_distance(piece)
+
+    def _fits(self, rotation: int, x: int, y: int) -> bool:
+        piece = {'shape': self.fallingPiece['shape'], 'rotation': rotation, 'x': x, 'y': y}
+        return self.is_valid_position(piece=piece)
+
+    def _follow_actions(self, actions: list, fits) -> Union[Tuple[int, int, int], None]:
+        """
+        Follows the falling piece through the frames of the actions of a placement, as frame_step() plays them, up
+        to the final move_down action, without touching the game
+        :param actions: the actions of placement_actions()
+        :param fits: a function fits(rotation, x, y) which tells whether the falling piece fits there
+        :return: the (rotation, x, y) of the piece before the final move_down action, or None if it lands on its way
+        """
+        piece = self.fallingPiece
+        rotation, x, y = piece['rotation'], piece['x'], piece['y']
+        nb_rotations = len(self.pieces[piece['shape']])
+        for action in actions[:-1]:
+            if action == MOVE_LEFT or action == MOVE_RIGHT:
+                step = -1 if action == MOVE_LEFT else 1
+                # a press moves the piece a second column if there is room
+                for _ in range(2):
+                    if not fits(rotation, x + step, y):
+                        break
+                    x += step
+            else:
+                turned = (rotation + (1 if action == ROTATE_CLOCKWISE else -1)) % nb_rotations
+                if fits(turned, x, y):
+                    rotation = turned
+            if not fits(rotation, x, y + 1):
+                return None
+            y += 1
+        return rotation, x, y
+
+    def legal_placements(self) -> list:
+        """
+        :return: the (rotation, x) of every legal placement of the falling piece, see is_legal_placement(), without
+                simulating any of them
+        """
+        if self.fallingPiece is None:
+            return []
+        return [(rotation, x) for rotation, x in self.variant.candidates[self.fallingPiece['shape']]
+                if self.is_legal_placement(rotation, x)]
+
+    def sample_placement(self, rng=random) -> Union[Tuple[int, int], None]:
+        """
+        Draws a legal placement of the falling piece uniformly at random. Candidates within the walls are drawn
+        until one is legal, which mostly succeeds at the first draw. After a few misses, which only happen close to
+        the top of the board, the legal placements are listed instead.
+        :param rng: the random.Random to draw with, by default the shared random module
+        :return: a (rotation, x) tuple, or None if there is no falling piece or no legal placement
+        """
+        if self.fallingPiece is None:
+            return None
+        candidates = self.variant.candidates[self.fallingPiece['shape']]
+        for _ in range(4):
+            rotation, x = rng.choice(candidates)
+            if self.is_legal_placement(rotation, x):
+                return rotation, x
+        legal_placements = self.legal_placements()
+        return rng.choice(legal_placements) if legal_placements else None
+
+    def all_afterstates(self, x_offset: int = 4, distinct: bool = True) -> tuple:
+        """
+        Simulates every legal placement of the falling piece (see is_legal_placement) at once with NumPy, without
+        touching the game. Every placement is dropped all the way down as in make_placement().
+        :param x_offset: the values of piece['x'] considered range over [-x_offset, board_width + x_offset)
+        :param distinct: if True, of the placements which lead to the same board, only the one with the fewest
+                actions from the falling piece (see placement_actions) is kept, and only its features are computed
+        :return: a 5-tuple of arrays (placements, boards, states, rewards, lines_cleared), with one entry for every
+                legal placement:
+                • placements: the (rotation, x) of every placement, of shape (n, 2)
+                • boards: the boolean boards after the placement, of shape (n, board_height, board_width)
+                • states: the encoded afterstates (see TetrisEnv.get_encoded_state), of shape (n, board_width - 1)
+                • rewards: the reward get_reward() would return after the placement
+                • lines_cleared: the number of lines every placement clears
+                If there is no falling piece, all arrays are empty.
+        """
+        if self.fallingPiece is None:
+            return (np.zeros((0, 2), dtype=int), np.zeros((0, self.board_height, self.board_width), dtype=bool),
+                    np.zeros((0, self.board_width - 1), dtype=np.int8), np.zeros(0), np.zeros(0, dtype=int))
+
+        shape, y = self.fallingPiece['shape'], self.fallingPiece['y']
+        board = self.get_board_array()
+        cells_x, cells_y = self.variant.cells[shape]
+        collides = collisions(board, *self.variant.get_collision_index(shape, x_offset), x_offset)
+
+        # the piece lands right above the first row below y where it collides
+        legal = ~collides[:, y]
+        landing = y + collides[:, y + 1:].argmax(axis=1)
+        rotations, xs = np.nonzero(legal)
+        ys = landing[rotations, xs]
+        xs -= x_offset
+
+        # of these, only the placements which the frames of their actions reach, see is_legal_placement()
+        table = collides.tolist()
+        nb_xs = collides.shape[2]
+
+        def fits(rotation: int, x: int, y: int) -> bool:
+            return 0 <= x + x_offset < nb_xs and not table[rotation][y][x + x_offset]
+
+        reached = np.zeros(len(rotations), dtype=bool)
+        for i, (rotation, x, landing_y) in enumerate(zip(rotations.tolist(), xs.tolist(), ys.tolist())):
+            end = self._follow_actions(self.placement_actions(rotation, x), fits)
+            reached[i] = end is not None and end[:2] == (rotation, x) and end[2] <= landing_y
+        rotations, xs, ys = rotations[reached], xs[reached], ys[reached]
+
+        boards = np.repeat(board[None], len(rotations), axis=0)
+        placed = np.arange(len(rotations))[:, None]
+        boards[placed, cells_y[rotations] + ys[:, None], cells_x[rotations] + xs[:, None]] = True
+        boards, lines_cleared = clear_lines(boards)
+        if distinct:
+            kept = self._distinct_placements(rotations, xs, boards, lines_cleared)
+            if not kept.all():
+                rotations, xs, boards, lines_cleared = rotations[kept], xs[kept], boards[kept], lines_cleared[kept]
+
+        heights, holes, avg_height, bumpiness = board_features(boards)
+        rewards = ALPHA * (self.avg_height - avg_height) + BETA * (self.holes - holes) + \
+            GAMMA * (self.bumpiness - bumpiness)
+        return np.column_stack((rotations, xs)), boards, encode_heights(heights), rewards, lines_cleared
+
+    def _distinct_placements(self, rotations: np.ndarray, xs: np.ndarray, boards: np.ndarray,
+                             lines_cleared: np.ndarray) -> np.ndarray:
+        """
+        Finds the placements which lead to the same board as a cheaper placement, see all_afterstates()
+        :param rotations, xs: the rotation and x of every placement
+        :param boards: the boolean boards after every placement, once the complete lines are removed
+        :param lines_cleared: the number of lines every placement clears
+        :return: a boolean mask of the placements which are kept
+        """
+        # without a complete line, two placements only lead to the same board if they fill the same cells. A
+        # placement which clears lines leaves fewer cells on the board than one which doesn't.
+        shape = self.fallingPiece['shape']
+        if shape in self.variant.repeated_rotations:
+            candidates = range(len(boards))
+        else:
+            candidates = np.flatnonzero(lines_cleared).tolist()
+
+        kept = np.ones(len(boards), dtype=bool)
+        if len(candidates) < 2:
+            return kept
+        cheapest = {}
+        for i in candidates:
+            cost = len(self.placement_actions(int(rotations[i]), int(xs[i])))
+            board = boards[i].tobytes()
+            if board in cheapest:
+                j, other_cost = cheapest[board]
+                if other_cost <= cost:
+                    kept[i] = False
+                    continue
+                kept[j] = False
+            cheapest[board] = i, cost
+        return kept
+
     @staticmethod
     def get_action_set():
         return range(6)
 
     def get_height(self):
-        stack_height = 0
-        for i in range(0, BOARDHEIGHT):
-            blank_row = True
-            for j in range(0, BOARDWIDTH):
-                if self.board[j][i] != '.':
-                    blank_row = False
-            if not blank_row:
-                stack_height = BOARDHEIGHT - i
-                break
-
-        return stack_height
+        return max(self.column_heights)
 
     @property
     def get_score(self):
@@ -467,14 +996,10 @@ class UnrenderedTetrisGame:
         and the floor/sides.
         :return: holes^t-holes^(t+1)
         """
+        # every cell below the top of a column which is not filled, is a hole
         nb_holes = 0
-
-        for col in range(BOARDWIDTH):
-            i = 0
-            while i < BOARDHEIGHT and self.board[col][i] == ".":
-                i += 1
-            # nb_holes += len([x for x in self.board[col][i+1:] if x == "."])
-            nb_holes += min(len([x for x in self.board[col][i + 1:] if x == "."]), 3)  # use to limit hole penalty
+        for height, cells in zip(self.column_heights, self.column_cells):
+            nb_holes += min(height - cells, 3)  # use to limit hole penalty
 
         nb_holes_diff = self.holes - nb_holes
         self.holes = nb_holes
@@ -489,9 +1014,8 @@ class UnrenderedTetrisGame:
         old_height = self.avg_height
         total_height = 0
         nb_used_columns = 0
-        for i in range(BOARDWIDTH):
-            col_height = self.get_column_height(i)
-            total_height += self.get_column_height(i)
+        for col_height in self.column_heights:
+            total_height += col_height
             if col_height > 0:
                 nb_used_columns += 1
 
@@ -505,12 +1029,10 @@ class UnrenderedTetrisGame:
         """
         :return: quadratic unevenness or bumpiness: U_q^t-U_q^(t+1)
         """
+        heights = self.column_heights
         total_bumpiness = 0
-        min_ys = []
-
-        total_bumpiness = 0
-        for col in range(BOARDWIDTH - 1):
-            col_difference = pow(self.get_column_height(col) - self.get_column_height(col + 1), 2)
+        for col in range(self.board_width - 1):
+            col_difference = pow(heights[col] - heights[col + 1], 2)
             total_bumpiness += col_difference
 
         total_bumpiness = sqrt(total_bumpiness)
@@ -521,10 +1043,46 @@ class UnrenderedTetrisGame:
         return bumpiness_diff
 
     def get_column_height(self, column_nb):
-        for row in range(BOARDHEIGHT):
-            if self.board[column_nb][row] != ".":
-                return BOARDHEIGHT - row
-        return 0
+        return self.column_heights[column_nb]
+
+    def get_column_heights(self) -> list:
+        """
+        :return: the height of every column. This list is kept up to date by the game and must not be modified.
+        """
+        return self.column_heights
+
+    def compute_features(self):
+        """
+        Computes the height and the number of filled cells of every column, and the Zobrist hash of the board, by
+        scanning the whole board. The game keeps these up to date itself, so this is only needed when a new board
+        is set.
+        """
+        self.column_heights = [0] * self.board_width
+        self.column_cells = [0] * self.board_width
+        self.board_hash = 0
+        for col in range(self.board_width):
+            for row in range(self.board_height):
+                if self.board[col][row] != BLANK:
+                    if self.column_heights[col] == 0:
+                        self.column_heights[col] = self.board_height - row
+                    self.column_cells[col] += 1
+                    self.board_hash ^= self.variant.zobrist_keys[col][row]
+        self.features_changed = True
+
+    def update_features(self):
+        """
+        Updates the column heights, filled cells and board hash after the falling piece has been added to the
+        board. Only the columns covered by the piece change.
+        """
+        piece_x, piece_y = self.fallingPiece['x'], self.fallingPiece['y']
+        zobrist_keys = self.variant.zobrist_keys
+        for x, y in self.geometry[self.fallingPiece['shape']][self.fallingPiece['rotation']].cells:
+            x += piece_x
+            y += piece_y
+            self.column_cells[x] += 1
+            self.column_heights[x] = max(self.column_heights[x], self.board_height - y)
+            self.board_hash ^= zobrist_keys[x][y]
+        self.features_changed = True
 
     def get_reward(self) -> float:
         """
@@ -536,6 +1094,11 @@ class UnrenderedTetrisGame:
         :ivar: ALPHA, BETA, GAMMA greater than or equal to zero
         :return: r_(t+1)=α(h_avg^t-h_avg^(t+1) )+β(holes^t-holes^(t+1) )+γ(U^t-U^(t+1) ) where α,β,γ>0
         """
+        if not self.features_changed:
+            # the board did not change since the last reward, so neither did any of the parts
+            return 0.0
+        self.features_changed = False
+
         # Parameters as used in [Thiam, Kessler and Schwenker]
         ALPHA = 5
         BETA = 10
@@ -561,35 +1124,57 @@ class UnrenderedTetrisGame:
         self.fallFreq = 0.27 - (self.level * 0.02)
         return self.level, self.fallFreq
 
-    @staticmethod
-    def get_new_piece():
+    def get_new_piece(self):
         # return a random new piece in a random rotation and color
-        shape = random.choice(list(PIECES.keys()))
-        newPiece = {'shape': shape,
-                    'rotation': random.randint(0, len(PIECES[shape]) - 1),
-                    'x': int(BOARDWIDTH / 2) - int(TEMPLATEWIDTH / 2),
-                    'y': 0,  # start it above the self.board (i.e. less than 0)
-                    'color': random.randint(0, len(COLORS) - 1)}
-        return newPiece
+        return self.piece_source.next_piece()
+
+    def get_preview(self, nb_pieces: int) -> list:
+        """
+        :param nb_pieces: the number of upcoming pieces to show, including self.nextPiece
+        :return: a list of (shape, rotation) tuples of the pieces which will fall after the current falling piece
+        """
+        if nb_pieces <= 0:
+            return []
+        return [(self.nextPiece['shape'], self.nextPiece['rotation'])] + self.piece_source.preview(nb_pieces - 1)
 
     def add_to_board(self):
         # fill in the self.board based on piece's location, shape, and rotation
-        for x in range(TEMPLATEWIDTH):
-            for y in range(TEMPLATEHEIGHT):
-                if PIECES[self.fallingPiece['shape']][self.fallingPiece['rotation']][y][x] != BLANK:
-                    # noinspection PyTypeChecker
-                    self.board[x + self.fallingPiece['x']][y + self.fallingPiece['y']] = self.fallingPiece['color']
+        for x, y in self.geometry[self.fallingPiece['shape']][self.fallingPiece['rotation']].cells:
+            # noinspection PyTypeChecker
+            self.board[x + self.fallingPiece['x']][y + self.fallingPiece['y']] = self.fallingPiece['color']
+
+    def get_board_columns(self) -> list:
+        """
+        :return: the board as a list of columns, with the color of every filled cell and BLANK elsewhere
+        """
+        return self.board
+
+    def get_board_array(self) -> np.ndarray:
+        """
+        :return: a boolean array of shape (board_height, board_width), True where a cell is filled, with row 0 at
+                the top
+        """
+        return np.array([[cell != BLANK for cell in column] for column in self.board]).T
+
+    def copy_board(self) -> list:
+        return [column[:] for column in self.board]
+
+    def restore_board(self, board) -> None:
+        """
+        Overwrites the board in place with a copy made by copy_board()
+        """
+        for column, saved_column in zip(self.board, board):
+            column[:] = saved_column
 
     def get_blank_board(self):
         # create and return a new blank self.board data structure
         self.board = []
-        for i in range(BOARDWIDTH):
-            self.board.append([BLANK] * BOARDHEIGHT)
+        for i in range(self.board_width):
+            self.board.append([BLANK] * self.board_height)
         return self.board
 
-    @staticmethod
-    def is_on_board(x, y):
-        return 0 <= x < BOARDWIDTH and y < BOARDHEIGHT
+    def is_on_board(self, x, y):
+        return 0 <= x < self.board_width and y < self.board_height
 
     def get_falling_piece(self) -> Union[tuple, None]:
         """
@@ -609,20 +1194,20 @@ class UnrenderedTetrisGame:
         """
         if piece is None:
             piece = self.fallingPiece
-        for x in range(TEMPLATEWIDTH):
-            for y in range(TEMPLATEHEIGHT):
-                is_above_board = y + piece['y'] + adjY < 0
-                if is_above_board or PIECES[piece['shape']][piece['rotation']][y][x] == BLANK:
-                    continue
-                if not self.is_on_board(x + piece['x'] + adjX, y + piece['y'] + adjY):
-                    return False
-                if self.board[x + piece['x'] + adjX][y + piece['y'] + adjY] != BLANK:
-                    return False
+        piece_x = piece['x'] + adjX
+        piece_y = piece['y'] + adjY
+        for x, y in self.geometry[piece['shape']][piece['rotation']].cells:
+            x += piece_x
+            y += piece_y
+            if y < 0:  # above the board
+                continue
+            if not 0 <= x < self.board_width or y >= self.board_height or self.board[x][y] != BLANK:
+                return False
         return True
 
     def is_complete_line(self, y):
         # Return True if the line filled with boxes with no gaps.
-        for x in range(BOARDWIDTH):
+        for x in range(self.board_width):
             if self.board[x][y] == BLANK:
                 return False
         return True
@@ -631,15 +1216,15 @@ class UnrenderedTetrisGame:
         # Remove any completed lines on the self.board, move everything above them down,
         # and return the number of complete lines.
         num_lines_removed = 0
-        y = BOARDHEIGHT - 1  # start y at the bottom of the self.board
+        y = self.board_height - 1  # start y at the bottom of the self.board
         while y >= 0:
             if self.is_complete_line(y):
                 # Remove the line and pull boxes down by one line.
                 for pullDownY in range(y, 0, -1):
-                    for x in range(BOARDWIDTH):
+                    for x in range(self.board_width):
                         self.board[x][pullDownY] = self.board[x][pullDownY - 1]
                 # Set very top line to blank.
-                for x in range(BOARDWIDTH):
+                for x in range(self.board_width):
                     self.board[x][0] = BLANK
                 num_lines_removed += 1
                 # Note on the next iteration of the loop, y is the same.
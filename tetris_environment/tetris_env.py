@@ -1,71 +1,248 @@
-import copy
 import random
-from typing import Tuple, Union
+from typing import Iterator, Tuple, Union
 
 import numpy as np
 import gym
 from gym import spaces
-from tetris_environment.tetris_engine import UnrenderedTetrisGame
-from tetris_environment.rendering_tetris_engine import RenderingTetrisGame
+from tetris_environment.tetris_engine import UnrenderedTetrisGame, VARIANTS, COLORS, get_placement_actions
+from tetris_environment.piece_source import PieceSource
+from tetris_environment.transposition_cache import TranspositionCache
+from tetris_environment.state_codec import StateCodec
+from tetris_environment.board_bank import BoardBank
+from tetris_environment.bitboard_tetris_engine import BitboardTetrisGame
 
 SCREEN_WIDTH, SCREEN_HEIGHT = 200, 400
 
+# the kinds of observations returned by TetrisEnv
+OBSERVATION_MODES = ('encoded', 'bitplanes')
+
 
 class TetrisEnv(gym.Env):
     metadata = {'render.modes': ['human', 'rgb_array']}
 
-    def __init__(self, type: str, render: bool = False, low: int = -3, high: int = 3):
+    def __init__(self, type: str, render: bool = False, low: int = -3, high: int = 3, bitboard: bool = False,
+                 piece_mode: str = 'legacy', seed: int = None, cache_size: int = 4096, compact_states: bool = False,
+                 observation: str = 'encoded', piece_planes: bool = False, max_pieces: int = None,
+                 max_steps: int = None, board_bank: Union[BoardBank, str] = None, bank_probability: float = 1.0):
+        """
+        :param type: the Tetris variant, see UnrenderedTetrisGame
+        :param render: whether or not the game is drawn with pygame. The game itself stays headless and a
+                TetrisRenderer is attached to it, so only the frames which are really played are drawn.
+        :param bitboard: use the bitboard engine, which stores every row as an integer bitmask. This is only
+                slightly faster, see BitboardTetrisGame, and does not keep the colors of the pieces on the board.
+        :param piece_mode: how the pieces are drawn, see PieceSource
+        :param seed: seed for the pieces of this environment, and for the order and sampling of its placements.
+                Without a seed, the 'legacy' mode and the placements use the shared random module.
+        :param cache_size: the number of positions for which all_possible_placements() keeps its result. Zero
+                disables the cache.
+        :param compact_states: if True, every encoded state is returned as its integer code, see StateCodec, instead
+                of as a tuple
+        :param observation: one of OBSERVATION_MODES, the kind of observation returned by step(), place() and
+                reset(), see get_observation()
+        :param piece_planes: if True, the 'bitplanes' observation also holds the falling piece and the next piece
+        :param max_pieces, max_steps: if provided, the limits on the pieces placed and the steps taken in one
+                episode, see set_episode_limits()
+        :param board_bank: a BoardBank, or the name of a file saved by BoardBank.save, from which reset() draws the
+                boards to start the episodes on
+        :param bank_probability: the probability with which reset() starts on a board of the bank rather than on
+                an empty board
+        """
 
-        if type not in ("fourer", 'regular', 'extended fourer'):
+        if type not in VARIANTS:
             raise RuntimeError("Invalid Tetris type")
+        if observation not in OBSERVATION_MODES:
+            raise RuntimeError("Invalid observation mode")
+        if not 0 <= bank_probability <= 1:
+            raise RuntimeError("The probability of starting on a board of the bank should be in [0, 1]")
+        piece_source = PieceSource(VARIANTS[type], piece_mode, seed, nb_colors=len(COLORS))
 
         # open up a game state to communicate with emulator
-        if not render:
-            self.game_state = UnrenderedTetrisGame(type)
-            self.game_type = UnrenderedTetrisGame
+        if bitboard:
+            self.game_state = BitboardTetrisGame(type, piece_source=piece_source)
+            self.game_type = BitboardTetrisGame
         else:
-            self.game_state = RenderingTetrisGame(type)
-            self.game_type = RenderingTetrisGame
-            # raise RuntimeError()
+            self.game_state = UnrenderedTetrisGame(type, piece_source=piece_source)
+            self.game_type = UnrenderedTetrisGame
+        self.renderer = None
+        if render:
+            # pygame is only imported when the game is drawn, so headless environments start faster
+            from tetris_environment.rendering_tetris_engine import TetrisRenderer
+            self.renderer = TetrisRenderer(type)
+            self.game_state.attach(self.renderer)
 
         self._action_set = self.game_state.get_action_set()
         self.action_space = spaces.Discrete(len(self._action_set))
-        self.observation_space = spaces.Box(low=low, high=high, shape=(9,), dtype=int)
+        # the input of frame_step for every action
+        self._frame_inputs = [tuple(int(i == a) for i in self._action_set) for a in self._action_set]
+        self.codec = StateCodec(self.game_state.board_width - 1)
+        self.compact_states = compact_states
+        self.observation_mode = observation
+        self.piece_planes = piece_planes
+        if observation == 'bitplanes':
+            self._init_bitplanes()
+        elif compact_states:
+            self.observation_space = spaces.Discrete(self.codec.nb_states)
+        else:
+            self.observation_space = spaces.Box(low=low, high=high, shape=(self.codec.length,), dtype=int)
         self.viewer = None
         self.type = type
         self.rendering = render
+        self.bitboard = bitboard
+        self.placement_cache = TranspositionCache(cache_size) if cache_size > 0 else None
+        self.set_episode_limits(max_pieces, max_steps)
+        if isinstance(board_bank, str):
+            board_bank = BoardBank.load(board_bank, type)
+        self.board_bank = board_bank
+        self.bank_probability = bank_probability
+        self._bank_rng = np.random.default_rng(seed)
+        self._placement_random = random if seed is None else random.Random(seed)
 
     def step(self, a: int) -> Tuple[tuple, float, bool, dict]:
         """
         Takes one step in the environment using the defined action a
         :param a: the action to take
         :return: a 4-tuple consisting of
-                • the current encoded state (see get_encoded_state())
+                • the observation, by default the encoded state (see get_observation())
                 • the reward received
                 • whether or not the end of an epîsode has been reached
                 • several observations with their own labels
                     - label "score" (int): the total score received during this step and this step alone
                     - label "new_piece (bool): is True when a new falling piece was added to the board
                     - label "lines_cleared" (int): the total amount of lines cleared during this step
+                    - label "action_mask" (np.ndarray): an int8 array with a 1 for every action which has an effect
+                        in the next step, see UnrenderedTetrisGame.get_action_mask
+                    - label "TimeLimit.truncated" (bool): only present, and True, if the episode ended because it
+                        reached a limit of set_episode_limits() rather than by game over
         """
-        self._action_set = np.zeros([len(self._action_set)])
-        self._action_set[a] = 1
-        _, reward, terminal, observations = self.game_state.frame_step(self._action_set)
-        state = self.get_encoded_state()
+        _, reward, terminal, observations = self.game_state.frame_step(self._frame_inputs[a])
+        if self._limited:
+            # the falling piece is gone if it landed during this frame
+            terminal = self._count_episode(terminal, observations, 1, self.game_state.fallingPiece is None)
+        observations["action_mask"] = self.game_state.get_action_mask()
+        state = self.get_observation()
+        return state, reward, terminal, observations
+
+    def step_many(self, actions) -> Tuple[tuple, float, bool, dict]:
+        """
+        Takes the steps of a whole sequence of actions, such as the actions of all_possible_placements(), and only
+        encodes the state at the end. Stops early if the episode ends.
+        :param actions: the actions to take, one per frame
+        :return: a 4-tuple as in step(), with the state after the last frame taken, the summed reward, whether the
+                episode ended, and the observations summed over all frames. "new_piece" is True if a new piece was
+                added during any of the frames, and the label "nb_frames" holds the number of frames taken.
+        """
+        game = self.game_state
+        frame_step = game.frame_step
+        frame_inputs = self._frame_inputs
+        total_reward, score, lines_cleared, new_piece, terminal, nb_frames, nb_pieces = 0, 0, 0, False, False, 0, 0
+        for a in actions:
+            _, reward, terminal, observations = frame_step(frame_inputs[a])
+            total_reward += reward
+            score += observations["score"]
+            lines_cleared += observations["lines_cleared"]
+            new_piece = new_piece or observations["new_piece"]
+            nb_frames += 1
+            if terminal:
+                break
+            if game.fallingPiece is None:
+                nb_pieces += 1
+        observations = {"score": score, "lines_cleared": lines_cleared, "new_piece": new_piece,
+                        "nb_frames": nb_frames}
+        if self._limited:
+            terminal = self._count_episode(terminal, observations, nb_frames, nb_pieces)
+        observations["action_mask"] = game.get_action_mask()
+        state = self.get_observation()
+        return state, total_reward, terminal, observations
+
+    def place(self, rotation: int, x: int) -> Tuple[tuple, float, bool, dict]:
+        """
+        Drops the falling piece with the given rotation and x in one call, instead of stepping through the actions
+        of the placement frame by frame. See UnrenderedTetrisGame.place
+        :param rotation: the rotation of the placement, as in all_possible_placements()
+        :param x: the x-coordinate of the placement, as in all_possible_placements()
+        :return: a 4-tuple as in step(), with the state after the next piece was started. For the limits of
+                set_episode_limits(), this counts as one step.
+        """
+        reward, terminal, observations = self.game_state.place(rotation, x)
+        if self._limited:
+            # the next piece may have landed right away as well
+            terminal = self._count_episode(terminal, observations, 1, 1 + (self.game_state.fallingPiece is None))
+        observations["action_mask"] = self.game_state.get_action_mask()
+        state = self.get_observation()
         return state, reward, terminal, observations
 
+    def set_episode_limits(self, max_pieces: int = None, max_steps: int = None) -> None:
+        """
+        Limits the length of the episodes, so that a strong policy can not play on for hours. An episode which
+        reaches a limit is truncated: step() returns done, without the game over penalty, and the label
+        "TimeLimit.truncated" in its observations. The state returned is the state the game was truncated in, and
+        the next reset() starts over on an empty board. The counts start at the next reset().
+        :param max_pieces: the number of pieces which may be placed in one episode, or None for no limit
+        :param max_steps: the number of steps which may be taken in one episode, or None for no limit. Every frame
+                of step() and step_many() is a step, and so is every call of place().
+        """
+        if (max_pieces is not None and max_pieces < 1) or (max_steps is not None and max_steps < 1):
+            raise RuntimeError("An episode should be allowed at least one piece and one step")
+        self.max_pieces = max_pieces
+        self.max_steps = max_steps
+        self._limited = max_pieces is not None or max_steps is not None
+        self.truncated = False
+        self.episode_pieces = 0
+        self.episode_steps = 0
+
+    def _count_episode(self, terminal: bool, observations: dict, nb_steps: int, nb_pieces: int) -> bool:
+        """
+        Adds the steps taken and the pieces placed to the counts of the episode, and truncates it if it reached a
+        limit of set_episode_limits()
+        :param terminal: whether the game is over
+        :param observations: the observations of the step, which get the label "TimeLimit.truncated" if the
+                episode is truncated
+        :return: whether the episode ended, either by game over or by truncation
+        """
+        if terminal:
+            return True
+        self.episode_steps += nb_steps
+        self.episode_pieces += nb_pieces
+        if (self.max_steps is not None and self.episode_steps >= self.max_steps) or \
+                (self.max_pieces is not None and self.episode_pieces >= self.max_pieces):
+            self.truncated = True
+            observations["TimeLimit.truncated"] = True
+            return True
+        return False
+
     @property
     def n_actions(self):
         return len(self._action_set)
 
     # return: (states, observations)
-    def reset(self):
-        do_nothing = np.zeros(len(self._action_set))
-        do_nothing[0] = 1
+    def reset(self, seed: int = None, return_info: bool = False, from_bank: bool = True):
+        """
+        :param seed: if provided, the game starts over on an empty board with the pieces of this seed, so the
+                episode can be replayed exactly. Otherwise the game continues as it is, which is on an empty board
+                after a game over. After a truncated episode, the game starts over on an empty board as well.
+                With a board bank, the game starts over on a board drawn from the bank instead, with probability
+                bank_probability. The seed also seeds these draws.
+        :param return_info: if True, a dict with the action mask of the first step is returned as well
+        :param from_bank: if False, the board bank is not used for this episode, e.g. to evaluate a policy from
+                the usual empty board
+        :return: the observation, by default the encoded state, or a tuple (observation, info) if return_info is True
+        """
+        if seed is not None:
+            self.game_state.piece_source.seed(seed)
+            self._bank_rng = np.random.default_rng(seed)
+            self._placement_random = random.Random(seed)
+        if from_bank and self.board_bank is not None and self._bank_rng.random() < self.bank_probability:
+            self.game_state.reinit(self.board_bank.sample(self._bank_rng))
+        elif seed is not None or self.truncated:
+            self.game_state.reinit()
+        self.truncated = False
+        self.episode_pieces = 0
+        self.episode_steps = 0
         # self.observation_space = spaces.Box(low=0, high=255, shape=(SCREEN_WIDTH, SCREEN_HEIGHT, 3))
-        self.observation_space = spaces.Box(low=-3, high=3, shape=(9,), dtype=int)
-        self.game_state.frame_step(do_nothing)
-        state = self.get_encoded_state()
+        self.game_state.frame_step(self._frame_inputs[self.no_move])
+        state = self.get_observation()
+        if return_info:
+            return state, {"action_mask": self.game_state.get_action_mask()}
         return state
 
     def render(self, mode='human', close=False):
@@ -78,7 +255,7 @@ class TetrisEnv(gym.Env):
                 self.viewer.close()
                 self.viewer = None
             return
-        img = self.game_state.get_image()
+        img = self.renderer.get_image()
         if mode == 'rgb_array':
             return img
         elif mode == 'human':
@@ -87,107 +264,265 @@ class TetrisEnv(gym.Env):
                 self.viewer = rendering.SimpleImageViewer()
             self.viewer.imshow(img)
 
-    def get_encoded_state(self, board=None) -> tuple:
+    def get_observation(self):
+        """
+        :return: the observation of the current game, depending on the observation mode:
+                • 'encoded': the encoded state, see get_encoded_state()
+                • 'bitplanes': the board as a uint8 array of shape (board_height, (board_width + 7) // 8). Row y
+                    holds the cells of row y of the board as bits, with column x in bit x % 8 of byte x // 8. With
+                    the bitboard engine, this is a view of the board of the game, so it is not copied. Wider boards
+                    store their rows in the byte order of the machine, which is assumed to be little-endian.
+                    If the environment has piece planes, the observation is a dict with this array under "board",
+                    and the cells of the falling piece and of the next piece, at the position where it will start,
+                    in arrays of the same shape under "piece" and "next_piece".
+                The bitplanes are updated in place by the following steps, so they must be copied to be kept.
+        """
+        if self.observation_mode == 'encoded':
+            return self.get_encoded_state()
+
+        game = self.game_state
+        if not self.bitboard:
+            self._board_planes = np.packbits(game.get_board_array(), axis=1, bitorder='little')
+        elif self._board_source is not game.board:
+            # the game started over on a new board
+            self._board_source = game.board
+            self._board_planes = np.frombuffer(game.board, dtype=np.uint8).reshape(game.board_height, -1)
+        if not self.piece_planes:
+            return self._board_planes
+        self._draw_piece(self._piece_rows, game.fallingPiece)
+        self._draw_piece(self._next_piece_rows, game.nextPiece)
+        return {"board": self._board_planes, "piece": self._piece_planes, "next_piece": self._next_piece_planes}
+
+    def _init_bitplanes(self) -> None:
+        """
+        Sets up the buffers and the observation space of the 'bitplanes' observation mode
+        """
+        height, width = self.game_state.board_height, self.game_state.board_width
+        if width > 16:
+            raise RuntimeError("Bitplanes are only supported for boards of at most 16 columns")
+        planes_space = spaces.Box(low=0, high=255, shape=(height, (width + 7) // 8), dtype=np.uint8)
+        self._board_source = None
+        self._board_planes = None
+        if self.piece_planes:
+            # the rows of the pieces as bitmasks, as on a bitboard, of which the planes are views
+            row_type = np.uint8 if width <= 8 else np.dtype('<u2')
+            self._piece_rows = np.zeros(height, dtype=row_type)
+            self._next_piece_rows = np.zeros(height, dtype=row_type)
+            self._piece_planes = self._piece_rows.view(np.uint8).reshape(height, -1)
+            self._next_piece_planes = self._next_piece_rows.view(np.uint8).reshape(height, -1)
+            self.observation_space = spaces.Dict({"board": planes_space, "piece": planes_space,
+                                                  "next_piece": planes_space})
+        else:
+            self.observation_space = planes_space
+
+    def _draw_piece(self, rows: np.ndarray, piece: Union[dict, None]) -> None:
+        """
+        Overwrites rows with the bitmasks of the cells of a piece, or with zeros if there is no piece
+        """
+        rows.fill(0)
+        if piece is None:
+            return
+        geometry = self.game_state.geometry[piece['shape']][piece['rotation']]
+        shift = piece['x'] + geometry.min_x
+        for y, mask in geometry.row_masks:
+            y += piece['y']
+            if 0 <= y < len(rows):
+                rows[y] = mask << shift
+
+    def get_encoded_state(self, board=None) -> Union[tuple, int]:
         """
         Encodes the state space from the 10-by-20 (for a normal Tetris game) board to an integer array of size 9 by
         only noting the height differences between adjacent columns. If this difference is greater than 3 or
         smaller than -3, the value is equal to 3 or -3 respectively.
         :param board: the Tetris board to be encoded. If none is provided, the board of the class is used
-        :return: a tuple of size board_width - 1 containing h_(i+1)-h_i in the i'th spot.
+        :return: a tuple of size board_width - 1 containing h_(i+1)-h_i in the i'th spot. If the environment uses
+                compact states, the integer code of this tuple is returned instead.
         """
         if board is None:
             board = self.game_state
 
         board_width = board.board_width
+        heights = board.get_column_heights()  # kept up to date by the game, so no need to scan the board
         state = [0 for _ in range(board_width - 1)]  # list of zeroes
 
         low = -3
         high = 3
 
         for i in range(board_width - 1):
-            height_diff = board.get_column_height(i + 1) - board.get_column_height(i)
+            height_diff = heights[i + 1] - heights[i]
             if height_diff < low:
                 height_diff = low
             elif height_diff > high:
                 height_diff = high
             state[i] = height_diff
 
+        if self.compact_states:
+            return self.codec.encode(state)
         return tuple(state)  # finally, convert to hashable type, i.e. tuple
 
+    def encode_states(self, states: np.ndarray) -> list:
+        """
+        :param states: an integer array of encoded states, of shape (n, board_width - 1), as in all_afterstates()
+        :return: the list of these states in the form of get_encoded_state()
+        """
+        if self.compact_states:
+            return self.codec.encode_array(states).tolist()
+        return [tuple(state) for state in states.tolist()]
+
     def all_possible_placements(self):
         """
         Move the piece from all the way left to all the way right, and rotate it in all possible ways.
         Then return the state achieved by dropping the piece down and the first (of several) actions to
         take to achieve this state
-        :return:
+        :return: a list of tuples (afterstate, actions, placement), with placement the tuple (rotation, x) which
+                can be passed to place() instead of taking the actions one by one. The placements are listed in a
+                random order. Placements leading to the same board are listed once, with the shortest actions.
+                Only the placements which the actions really reach are listed, see
+                UnrenderedTetrisGame.is_legal_placement.
+        """
+        # the placements only depend on the board and on where the falling piece is, so positions which come up
+        # again are looked up in the cache
+        key = self._cache_key('placements')
+        if key is None:
+            return [simulated[:3] for simulated in self._distinct_simulated_placements()]
+
+        cached = self.placement_cache.get(key)
+        if cached is None:
+            # the rewards are stored as well, as they only depend on the board too
+            cached = tuple(self._distinct_simulated_placements())
+            self.placement_cache.put(key, cached)
+            return [simulated[:3] for simulated in cached]
+
+        all_possible_placements = [simulated[:3] for simulated in cached]
+        self._placement_random.shuffle(all_possible_placements)
+        return all_possible_placements
+
+    def iter_placements(self) -> Iterator[tuple]:
+        """
+        Lazy version of all_possible_placements(): the legal placements are found when iterating starts, but every
+        placement is only simulated when it is requested. The game must not change while iterating.
+        :return: an iterator over the tuples (afterstate, actions, placement) of all_possible_placements(), in a
+                random order. Of the placements leading to the same board, only the first one simulated is returned,
+                which need not have the shortest actions.
+        """
+        boards = set()
+        for simulated in self._iter_simulated_placements():
+            if simulated[4] not in boards:
+                boards.add(simulated[4])
+                yield simulated[:3]
+
+    def sample_placement(self) -> Union[tuple, None]:
+        """
+        Draws one legal placement of the falling piece uniformly at random and only simulates that one
+        :return: a tuple (afterstate, actions, placement) as in all_possible_placements(), or None if there is no
+                falling piece
+        """
+        placement = self.game_state.sample_placement(self._placement_random)
+        if placement is None:
+            return None
+        return self._simulate_placement(placement)[:3]
+
+    def _distinct_simulated_placements(self) -> list:
+        """
+        :return: the tuples of _iter_simulated_placements(), in a random order, keeping only the one with the shortest
+                actions of the placements which lead to the same board
         """
-        all_possible_positions = []
+        distinct = {}
+        for simulated in self._iter_simulated_placements():
+            kept = distinct.get(simulated[4])
+            # ties are broken by the placement, as in UnrenderedTetrisGame.all_afterstates
+            if kept is None or (len(simulated[1]), simulated[2]) < (len(kept[1]), kept[2]):
+                distinct[simulated[4]] = simulated
+        return list(distinct.values())
 
+    def _iter_simulated_placements(self) -> Iterator[tuple]:
+        """
+        :return: an iterator over (afterstate, actions, placement, reward, board hash) for every legal placement, in
+                a random order
+        """
+        placements = self.game_state.legal_placements()
+        self._placement_random.shuffle(placements)
+        for placement in placements:
+            yield self._simulate_placement(placement)
+
+    def _simulate_placement(self, placement: tuple) -> tuple:
+        """
+        Simulates a placement on the game itself and undoes it afterwards
+        :param placement: a legal (rotation, x) of the falling piece
+        :return: a tuple (afterstate, actions, placement, reward, board hash), with the Zobrist hash of the board
+                after the placement
+        """
+        rotation, x = placement
+        actions = self.game_state.placement_actions(rotation, x)
+        reward, _ = self.game_state.make_placement(rotation, x)
+        state = self.get_encoded_state()
+        board_hash = self.game_state.board_hash
+        self.game_state.unmake_placement()
+        return state, actions, placement, reward, board_hash
+
+    def all_afterstates(self) -> tuple:
+        """
+        Array version of all_possible_placements(): simulates all placements of the falling piece in one go, see
+        UnrenderedTetrisGame.all_afterstates
+        :return: a 6-tuple (placements, boards, states, rewards, lines_cleared, actions). The first five are the
+                arrays of UnrenderedTetrisGame.all_afterstates, in a fixed order, and actions is a list with the
+                actions of every placement as in all_possible_placements(). Placements leading to the same board are
+                listed once, with the shortest actions. These may be shared with the cache, so they must not be
+                modified.
+        """
+        key = self._cache_key('afterstates')
+        if key is not None:
+            cached = self.placement_cache.get(key)
+            if cached is not None:
+                return cached
+
+        placements, boards, states, rewards, lines_cleared = self.game_state.all_afterstates()
+        actions = [self.game_state.placement_actions(rotation, x) for rotation, x in placements.tolist()]
+
+        afterstates = (placements, boards, states, rewards, lines_cleared, actions)
+        if key is not None:
+            self.placement_cache.put(key, afterstates)
+        return afterstates
+
+    def _cache_key(self, kind: str) -> Union[tuple, None]:
+        """
+        :param kind: the kind of result stored in the cache
+        :return: the key in the placement cache for the current board and falling piece, or None if the cache is
+                disabled or there is no falling piece
+        """
         piece = self.game_state.fallingPiece
-        if piece is not None:
-            for width in range(-4, self.game_state.board_width + 4):
-                shape = piece['shape']
-                for rotation in range(len(self.game_state.pieces.get(shape))):
-                    new_piece = copy.deepcopy(piece)
-                    new_piece['x'] = width
-                    new_piece['rotation'] = rotation
-                    if self.game_state.is_valid_position(piece=new_piece):
-                        all_possible_positions.insert(random.randint(0, len(all_possible_positions)), new_piece)
-
-            all_possible_placements = []
-            for piece in all_possible_positions:
-                board = copy.deepcopy(self.game_state.board)
-                new_game = self.game_type(board=board, type=self.type)
-                new_game.fallingPiece = piece
-                actions = self._get_actions(old_board=self.game_state, new_board=new_game)
-                move_down = np.zeros(6)
-                move_down[4] = 1
-                new_game.frame_step(move_down)
-                state = self.get_encoded_state(new_game)
-                all_possible_placements.append((state, actions))
-
-            return all_possible_placements
-        else:
-            return []
+        if self.placement_cache is None or piece is None:
+            return None
+        return kind, self.game_state.board_hash, piece['shape'], piece['rotation'], piece['x'], piece['y']
 
     @staticmethod
-    def _get_actions(old_board, new_board):
+    def _get_actions(curr_piece: dict, target_piece: dict, nb_rotations: int, x_range: range = None):
         """
-        Finds the actions required to position the falling piece on :param old_board in the same way as
-        the falling piece on :param new_board
-        :return: a list of all actions required (first rotations, then lateral movement). The last action added
-                is the move_down action
+        Finds the actions required to position the falling piece :param curr_piece in the same way as
+        :param target_piece, see tetris_engine.get_placement_actions
+        :param nb_rotations: the number of rotations of the shape of the pieces
+        :param x_range: the values of piece['x'] within the walls for the rotation of target_piece, if known
+        :return: a list of all actions required (first rotations in the shortest direction, then lateral
+                movement). The last action added is the move_down action
         :raise AssertionError if the shapes of the falling pieces are different
         """
-        # Define actions
-        move_left = 1
-        move_right = 3
-        move_down = 4
-        rotate_clockwise = 5
-
-        actions = []
-
-        curr_piece = old_board.fallingPiece
-        target_piece = new_board.fallingPiece
-        
-        assert curr_piece['shape'] == target_piece['shape']
-
-        if curr_piece['rotation'] != target_piece['rotation']:
-            for _ in range(abs(curr_piece["rotation"] - target_piece["rotation"])):
-                actions.append(rotate_clockwise)
-        if curr_piece['x'] < target_piece['x']:
-            for _ in range(target_piece['x'] - curr_piece['x']):
-                actions.append(move_right)
-        if curr_piece['x'] > target_piece['x']:
-            for _ in range(curr_piece['x'] - target_piece['x']):
-                actions.append(move_left)
-        if len(actions) == 0:
-            # piece placements are identical, so no actions are added.
-            pass
-
-        actions.append(move_down)
-
-        return actions
+        return get_placement_actions(curr_piece, target_piece, nb_rotations, x_range)
+
+    def cache_info(self) -> dict:
+        """
+        :return: the hits, misses, hit rate and size of the cache of all_possible_placements(). All are zero if the
+                cache is disabled.
+        """
+        cache = self.placement_cache
+        if cache is None:
+            return {"hits": 0, "misses": 0, "hit_rate": 0.0, "size": 0}
+        return {"hits": cache.hits, "misses": cache.misses, "hit_rate": cache.hit_rate, "size": len(cache)}
+
+    def get_preview(self, nb_pieces: int = 1) -> list:
+        """
+        :return: the (shape, rotation) tuples of the next nb_pieces pieces, see UnrenderedTetrisGame.get_preview
+        """
+        return self.game_state.get_preview(nb_pieces)
 
     def get_falling_piece(self) -> Union[tuple, None]:
         """
@@ -0,0 +1,122 @@
+from typing import Tuple
+
+import numpy as np
+from gym import spaces
+
+from tetris_environment.tetris_env import TetrisEnv
+
+
+class TetrisPlacementEnv(TetrisEnv):
+    """
+    A TetrisEnv in which every step places a whole piece. Action a = rotation * board_width + column drops the
+    falling piece with the given rotation so that its leftmost cell is in the given column. Only the actions of
+    action_mask() are legal: the rotation must exist for the shape of the falling piece, and the piece must fit at
+    that column at its current height.
+    As in TetrisEnv, the encoded state does not include the falling piece, which is found with get_falling_piece().
+    """
+
+    def __init__(self, type: str, **kwargs):
+        """
+        :param type: the Tetris variant, see TetrisEnv
+        :param kwargs: further arguments of TetrisEnv
+        """
+        super().__init__(type, **kwargs)
+        variant = self.game_state.variant
+        self.nb_rotations = max(len(templates) for templates in variant.pieces.values())
+        self.nb_columns = variant.board_width
+        self.action_space = spaces.Discrete(self.nb_rotations * self.nb_columns)
+
+        # for every shape, the action of every placement within the walls and the placement of every such action
+        self._actions = {}
+        self._placements = {}
+        for shape, candidates in variant.candidates.items():
+            geometries = variant.geometry[shape]
+            self._actions[shape] = {(rotation, x): rotation * self.nb_columns + x + geometries[rotation].min_x
+                                    for rotation, x in candidates}
+            self._placements[shape] = {action: placement for placement, action in self._actions[shape].items()}
+
+    def step(self, a: int) -> Tuple[tuple, float, bool, dict]:
+        """
+        Places the falling piece and starts the next one
+        :param a: a legal action, see action_mask()
+        :return: a 4-tuple as in TetrisEnv.place, where the observations also hold the action mask of the next
+                piece under the label "action_mask"
+        :raise RuntimeError if the action is not legal
+        """
+        placement = self.get_placement(a)
+        if placement is None or not self.game_state.is_legal_placement(*placement):
+            raise RuntimeError("Illegal placement")
+
+        state, reward, done, observations = self.place(*placement)
+        if not done and self.game_state.fallingPiece is None:
+            # the next piece landed right away, so let it spawn
+            state, next_reward, done, next_observations = self._wait_for_piece()
+            reward += next_reward
+            observations = dict(next_observations, score=observations["score"] + next_observations["score"],
+                                lines_cleared=observations["lines_cleared"] + next_observations["lines_cleared"])
+        observations["action_mask"] = self.action_mask()
+        return state, reward, done, observations
+
+    def reset(self, seed: int = None, return_info: bool = False, from_bank: bool = True):
+        """
+        See TetrisEnv.reset. Afterwards, there always is a falling piece to place.
+        :param return_info: if True, a dict with the action mask of the falling piece, see action_mask(), is
+                returned as well
+        :return: the encoded state, or a tuple (encoded state, info) if return_info is True
+        """
+        state = super().reset(seed, from_bank=from_bank)
+        if self.game_state.fallingPiece is None:
+            state, _, _, _ = self._wait_for_piece()
+        if return_info:
+            return state, {"action_mask": self.action_mask()}
+        return state
+
+    def action_mask(self) -> np.ndarray:
+        """
+        :return: an int8 array with a 1 for every legal action of the falling piece. It can be passed to
+                action_space.sample(mask=...).
+        """
+        mask = np.zeros(self.action_space.n, dtype=np.int8)
+        piece = self.game_state.fallingPiece
+        if piece is not None:
+            actions = self._actions[piece['shape']]
+            for placement in self.game_state.legal_placements():
+                mask[actions[placement]] = 1
+        return mask
+
+    def get_placement(self, a: int):
+        """
+        :return: the placement (rotation, x) of action a for the falling piece, as used by TetrisEnv.place, or None
+                if the rotation does not exist or the piece does not fit within the walls at that column
+        """
+        piece = self.game_state.fallingPiece
+        if piece is None:
+            return None
+        return self._placements[piece['shape']].get(int(a))
+
+    def get_action(self, rotation: int, x: int) -> int:
+        """
+        :return: the action of placement (rotation, x) of the falling piece, as in all_possible_placements()
+        """
+        return self._actions[self.game_state.fallingPiece['shape']][rotation, x]
+
+    def _wait_for_piece(self) -> Tuple[tuple, float, bool, dict]:
+        """
+        Takes frames without action until there is a falling piece
+        :return: a 4-tuple as in TetrisEnv.step, with the rewards and observations summed over these frames. The
+                label "TimeLimit.truncated" is kept if the last frame truncated the episode.
+        """
+        reward, score, lines_cleared, done = 0, 0, 0, False
+        while self.game_state.fallingPiece is None:
+            state, frame_reward, done, observations = super().step(self.no_move)
+            reward += frame_reward
+            score += observations["score"]
+            lines_cleared += observations["lines_cleared"]
+        summed = {"score": score, "lines_cleared": lines_cleared, "new_piece": True}
+        if observations.get("TimeLimit.truncated", False):
+            summed["TimeLimit.truncated"] = True
+        return state, reward, done, summed
+
+    @property
+    def n_actions(self):
+        return self.action_space.n
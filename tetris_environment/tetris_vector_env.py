@@ -0,0 +1,240 @@
+import multiprocessing as mp
+import traceback
+from typing import List, Tuple, Union
+
+import numpy as np
+from gym import spaces
+from gym.vector import VectorEnv
+
+from tetris_environment.tetris_env import TetrisEnv
+
+
+class TetrisVectorEnv(VectorEnv):
+    """
+    Runs num_envs TetrisEnv instances, each in its own worker process, and steps them all at once. Every worker
+    writes its observation, reward and done flag into shared-memory NumPy buffers, so only the info dicts are sent
+    back through a pipe. Dict observations, such as bitplanes with piece planes, get a buffer for every key.
+    A finished episode is reset in the worker right away, as in the gym vector environments: the observation
+    returned for it is the first state of the next episode, and the last state of the finished episode is stored
+    under "terminal_observation" in its info. Likewise, the "action_mask" in its info is the one of the new
+    episode, and the mask of the last state is stored under "terminal_action_mask".
+
+    step() waits for all workers. Alternatively, step_async() sends the actions and returns immediately, and
+    step_wait() collects the results, so other work can be done in between.
+    """
+
+    def __init__(self, type: str, num_envs: int, seed: int = None, copy: bool = True, context: str = None,
+                 **env_kwargs):
+        """
+        :param type: the Tetris variant played in every environment, see TetrisEnv
+        :param num_envs: the number of environments and worker processes
+        :param seed: if provided, environment i draws its pieces with seed + i
+        :param copy: if True, step() and reset() return copies of the shared observation buffers. Otherwise they
+                return the buffers themselves, which are overwritten by the next step.
+        :param context: the multiprocessing start method of the workers, e.g. 'fork' or 'spawn'. If none is
+                provided, the default of the platform is used.
+        :param env_kwargs: further arguments for every TetrisEnv, such as piece_mode or bitboard. Rendering is not
+                supported.
+        """
+        if num_envs < 1:
+            raise RuntimeError("The number of environments should be at least one")
+        if env_kwargs.get('render', False):
+            raise RuntimeError("The environments of a TetrisVectorEnv can not be rendered")
+
+        dummy_env = TetrisEnv(type, **dict(env_kwargs, cache_size=0))
+        super().__init__(num_envs, dummy_env.observation_space, dummy_env.action_space)
+        dummy_env.close()
+        self.type = type
+        self.copy = copy
+
+        ctx = mp.get_context(context)
+        self._shared_observations = _shared_buffers(ctx, self.single_observation_space, num_envs)
+        self._shared_rewards = ctx.RawArray('d', num_envs)
+        self._shared_dones = ctx.RawArray('b', num_envs)
+        self.observations = _buffer_views(self._shared_observations, self.single_observation_space)
+        self.rewards = np.frombuffer(self._shared_rewards, dtype=np.float64)
+        self.dones = np.frombuffer(self._shared_dones, dtype=np.int8).view(bool)
+
+        self.parent_pipes, self.processes = [], []
+        for index in range(num_envs):
+            parent_pipe, child_pipe = ctx.Pipe()
+            kwargs = dict(env_kwargs, seed=None if seed is None else seed + index)
+            process = ctx.Process(target=_worker, name=f"TetrisVectorEnv-{index}", daemon=True,
+                                  args=(index, type, kwargs, child_pipe, parent_pipe, self._shared_observations,
+                                        self._shared_rewards, self._shared_dones))
+            self.parent_pipes.append(parent_pipe)
+            self.processes.append(process)
+            process.start()
+            child_pipe.close()
+
+        # the command the workers are executing, if step_async() or reset_async() was called without waiting
+        self._waiting = None
+
+    def reset(self, seed: Union[int, List[int]] = None) -> np.ndarray:
+        """
+        :param seed: see TetrisEnv.reset. An integer seed gives environment i the seed seed + i.
+        :return: the observations of all environments, of shape (num_envs,) + single_observation_space.shape
+        """
+        self.reset_async(seed)
+        return self.reset_wait()
+
+    def reset_async(self, seed: Union[int, List[int]] = None, **kwargs) -> None:
+        if seed is None or isinstance(seed, int):
+            seed = [None if seed is None else seed + index for index in range(self.num_envs)]
+        if len(seed) != self.num_envs:
+            raise RuntimeError("There should be one seed for every environment")
+        self._send('reset', seed)
+
+    def reset_wait(self, **kwargs) -> np.ndarray:
+        self._receive('reset')
+        return _copy_views(self.observations) if self.copy else self.observations
+
+    def step_async(self, actions) -> None:
+        """
+        Sends an action to every environment without waiting for the results
+        :param actions: one action of TetrisEnv.step for every environment
+        """
+        actions = np.asarray(actions)
+        if actions.shape != (self.num_envs,):
+            raise RuntimeError("There should be one action for every environment")
+        self._send('step', actions.tolist())
+
+    def step_wait(self, **kwargs) -> Tuple[np.ndarray, np.ndarray, np.ndarray, list]:
+        """
+        :return: a 4-tuple (observations, rewards, dones, infos) with the results of TetrisEnv.step in every
+                environment, as arrays of shape (num_envs, ...) and a list of info dicts
+        """
+        infos = self._receive('step')
+        if self.copy:
+            return _copy_views(self.observations), self.rewards.copy(), self.dones.copy(), infos
+        return self.observations, self.rewards, self.dones, infos
+
+    def call(self, name: str, *args, **kwargs) -> list:
+        """
+        Calls a method of TetrisEnv in every environment, e.g. call('all_possible_placements')
+        :return: the list of results, one for every environment
+        """
+        self._send('call', [(name, args, kwargs)] * self.num_envs)
+        return self._receive('call')
+
+    def _send(self, command: str, data: list) -> None:
+        if self.closed:
+            raise RuntimeError("The environment is closed")
+        if self._waiting is not None:
+            raise RuntimeError(f"Still waiting for the results of {self._waiting}")
+        for pipe, item in zip(self.parent_pipes, data):
+            pipe.send((command, item))
+        self._waiting = command
+
+    def _receive(self, command: str) -> list:
+        if self._waiting != command:
+            raise RuntimeError(f"{command} was not started")
+        results = [pipe.recv() for pipe in self.parent_pipes]
+        self._waiting = None
+        errors = [message for success, message in results if not success]
+        if errors:
+            raise RuntimeError("A worker of TetrisVectorEnv failed:\n" + errors[0])
+        return [result for _, result in results]
+
+    def close_extras(self, **kwargs) -> None:
+        if self._waiting is not None:
+            for pipe in self.parent_pipes:
+                pipe.recv()
+            self._waiting = None
+        for pipe in self.parent_pipes:
+            pipe.send(('close', None))
+        for process, pipe in zip(self.processes, self.parent_pipes):
+            process.join()
+            pipe.close()
+
+
+def _shared_buffers(ctx, space: spaces.Space, num_envs: int):
+    """
+    :return: a shared array large enough for an observation of space for every environment, or a dict of such
+            arrays for a Dict space
+    """
+    if isinstance(space, spaces.Dict):
+        return {key: _shared_buffers(ctx, subspace, num_envs) for key, subspace in space.spaces.items()}
+    dtype = np.dtype(space.dtype)
+    return ctx.RawArray(np.ctypeslib.as_ctypes_type(dtype), num_envs * int(np.prod(space.shape)))
+
+
+def _buffer_views(buffers, space: spaces.Space):
+    """
+    :return: NumPy views of the shared arrays of _shared_buffers(), of shape (num_envs,) + space.shape
+    """
+    if isinstance(space, spaces.Dict):
+        return {key: _buffer_views(buffers[key], subspace) for key, subspace in space.spaces.items()}
+    return np.frombuffer(buffers, dtype=np.dtype(space.dtype)).reshape((-1,) + space.shape)
+
+
+def _write_views(views, index: int, observation) -> None:
+    if isinstance(views, dict):
+        for key, view in views.items():
+            view[index] = observation[key]
+    else:
+        views[index] = observation
+
+
+def _copy_views(views):
+    if isinstance(views, dict):
+        return {key: view.copy() for key, view in views.items()}
+    return views.copy()
+
+
+def _copy_observation(observation):
+    """
+    :return: a copy of the arrays in an observation of TetrisEnv. Tuples and codes are returned as they are.
+    """
+    if isinstance(observation, dict):
+        return {key: _copy_observation(value) for key, value in observation.items()}
+    if isinstance(observation, np.ndarray):
+        return observation.copy()
+    return observation
+
+
+def _worker(index: int, type: str, env_kwargs: dict, pipe, parent_pipe, shared_observations, shared_rewards,
+            shared_dones) -> None:
+    """
+    Plays one TetrisEnv of a TetrisVectorEnv. Every command received through the pipe is answered with a tuple
+    (success, result), with the formatted exception as result if the command failed.
+    """
+    parent_pipe.close()
+    env = TetrisEnv(type, **env_kwargs)
+    observations = _buffer_views(shared_observations, env.observation_space)
+    rewards = np.frombuffer(shared_rewards, dtype=np.float64)
+    dones = np.frombuffer(shared_dones, dtype=np.int8).view(bool)
+    try:
+        while True:
+            command, data = pipe.recv()
+            try:
+                if command == 'reset':
+                    _write_views(observations, index, env.reset(data))
+                    result = None
+                elif command == 'step':
+                    state, reward, done, result = env.step(data)
+                    if done:
+                        # a copy, as reset() reuses the arrays of the observation, e.g. the piece planes
+                        result = dict(result, terminal_observation=_copy_observation(state))
+                        state, reset_info = env.reset(return_info=True)
+                        # the action mask is the one of the returned observation, the first of the next episode
+                        result["terminal_action_mask"] = result["action_mask"]
+                        result["action_mask"] = reset_info["action_mask"]
+                    _write_views(observations, index, state)
+                    rewards[index] = reward
+                    dones[index] = done
+                elif command == 'call':
+                    name, args, kwargs = data
+                    result = getattr(env, name)(*args, **kwargs)
+                elif command == 'close':
+                    break
+                else:
+                    raise RuntimeError(f"Unknown command {command}")
+                pipe.send((True, result))
+            except Exception:
+                pipe.send((False, traceback.format_exc()))
+    except (KeyboardInterrupt, EOFError):
+        pass
+    finally:
+        env.close()
+        pipe.close()
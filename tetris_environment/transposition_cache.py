@@ -0,0 +1,59 @@
+from collections import OrderedDict
+
+
+class TranspositionCache:
+    """
+    A bounded cache for positions which come up again and again. When it is full, the least recently used entry
+    is forgotten. The hits and misses of all lookups are counted.
+    """
+
+    def __init__(self, max_size: int):
+        """
+        :param max_size: the maximum number of entries kept
+        """
+        if max_size < 1:
+            raise RuntimeError("The size of the cache should be at least one")
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        :return: the value stored for key, or None if it is not in the cache
+        """
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value) -> None:
+        """
+        Stores value for key, forgetting the least recently used entry if the cache is full
+        """
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        :return: the fraction of lookups which were hits, or 0 if there were no lookups yet
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+    def clear(self) -> None:
+        """
+        Forgets all entries and resets the counters
+        """
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)